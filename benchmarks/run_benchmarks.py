@@ -0,0 +1,338 @@
+"""Throughput and memory benchmarks of the MOS and observation utilities.
+
+Every benchmark runs against a synthetic data directory (see
+`synthetic.py`) of N stations x M years, in its own forked process, and
+reports how many items (blocks, dates, stations, ...) and megabytes of
+input it processes per second along with the peak resident memory of
+that process. Results can be saved as JSON, and a later run compared
+against them to catch performance regressions:
+
+    $ python run_benchmarks.py --stations 20 --years 1 --save baseline.json
+    $ python run_benchmarks.py --stations 20 --years 1 --compare baseline.json
+
+For a load test, scale up the synthetic archive, e.g. `--stations 200
+--years 5`; pass `--data` to generate it once and re-use it across runs.
+
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "mosobs"))
+sys.path.insert(0, os.path.join(HERE, "..", "precip_error"))
+
+import numpy as np
+
+import synthetic
+from util import data, mos, obs, parse
+from precip_error import penalty
+import scoring
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(f):
+    """Register a benchmark.
+
+    Each benchmark takes the benchmark context (see `make_context()`),
+    does any setup it needs, and returns a function to be timed along
+    with the number of items and bytes that function processes.
+
+    """
+    BENCHMARKS[f.__name__.replace("bench_", "", 1)] = f
+    return f
+
+def make_context(path, n_stations, years):
+    stations = synthetic.station_ids(n_stations)
+    return { 'path': path, 'years': years,
+             'stations': [s for s, _ in stations], 'codes': dict(stations) }
+
+def _bulletins(ctx, model="GFS"):
+    year = ctx['years'][0]
+    cycles = synthetic.MODEL_CYCLES[model] if model == "GFS" else [0, ]
+    return [os.path.join(ctx['path'], synthetic.BULLETIN_PATTERN[model] %
+                         {'year': year, 'month': month, 'hour': hour})
+            for month in xrange(1, 13) for hour in cycles]
+
+def _station_year_blocks(ctx, model="GFS"):
+    station = ctx['stations'][0]
+    blocks = []
+    for filename in _bulletins(ctx, model):
+        with open(filename) as f:
+            blocks.extend(mos.station_headers(f, station, model))
+    return blocks
+
+@benchmark
+def bench_station_headers(ctx):
+    """Split a year of GFS bulletins into blocks for (up to) 5 stations, in
+    one pass over each bulletin (`mos.station_blocks()`)."""
+    filenames = _bulletins(ctx)
+    stations = ctx['stations'][:5]
+
+    def run():
+        count = 0
+        for filename in filenames:
+            with open(filename) as f:
+                for _ in mos.station_blocks(f, stations, "GFS"):
+                    count += 1
+        return count
+
+    nbytes = sum(os.path.getsize(fn) for fn in filenames)
+    return run, run(), nbytes
+
+@benchmark
+def bench_process_MOS(ctx):
+    """Process a year of GFS runs for one station into DataFrames."""
+    blocks = _station_year_blocks(ctx)
+    run = lambda: [mos.process_MOS(b) for b in blocks]
+    return run, len(blocks), sum(len(l) for b in blocks for l in b)
+
+@benchmark
+def bench_process_MOS_summary(ctx):
+    """Extract max/min and precip from a year of GFS runs for one station."""
+    blocks = _station_year_blocks(ctx)
+    run = lambda: [mos.process_MOS_summary(b) for b in blocks]
+    return run, len(blocks), sum(len(l) for b in blocks for l in b)
+
+@benchmark
+def bench_parse_blocks(ctx):
+    """Batch-parse a year of GFS runs for one station."""
+    blocks = _station_year_blocks(ctx)
+    run = lambda: parse.parse_blocks(blocks, "GFS")
+    return run, len(blocks), sum(len(l) for b in blocks for l in b)
+
+@benchmark
+def bench_concatenate_MOS(ctx):
+    """Align every GFS and NAM run for one station, one date at a time."""
+    station = ctx['stations'][0]
+    nbytes = 0
+    for model in ["GFS", "NAM"]:
+        full_path = os.path.join(ctx['path'], station, model)
+        if not os.path.exists(full_path):
+            os.makedirs(full_path)
+        for year in ctx['years']:
+            for filename in _bulletins(dict(ctx, years=[year, ]), model):
+                with open(filename) as f:
+                    for lines in mos.station_headers(f, station, model):
+                        run_date, run_time = lines[0].split()[4:6]
+                        month, day, year = map(int, run_date.split("/"))
+                        mos_filename = "%s.%02d%02d%4d.%s.%02dZ" % (
+                            station, month, day, year, mos.full_model_name[model],
+                            int(run_time)/100)
+                        with open(os.path.join(full_path, mos_filename), "w") as out:
+                            out.writelines(lines)
+                        nbytes += sum(len(l) for l in lines)
+
+    first = datetime.datetime(ctx['years'][0], 1, 2)
+    last = datetime.datetime(ctx['years'][-1], 12, 31)
+    dates = [first + datetime.timedelta(days=n) for n in xrange((last - first).days + 1)]
+
+    def run():
+        ## Measure the parsing, rather than the memoization
+        mos.mos_cache.clear()
+        for date in dates:
+            mos.concatenate_MOS(station, date)
+
+    return run, len(dates), nbytes
+
+@benchmark
+def bench_fetch_OBS(ctx):
+    """Parse and archive the GHCN-Daily record of every station."""
+    for station, code in ctx['codes'].iteritems():
+        data.STATION_CODES[station.lower()] = code
+
+    def run():
+        for station in ctx['stations']:
+            obs.fetch_OBS(station, update=False)
+
+    nbytes = sum(os.path.getsize(os.path.join(ctx['path'], s, "OBS", "%s.dly" % c))
+                 for s, c in ctx['codes'].iteritems())
+    return run, len(ctx['stations']), nbytes
+
+@benchmark
+def bench_parse_observations(ctx):
+    """Load the archived observations of every station."""
+    for station, code in ctx['codes'].iteritems():
+        data.STATION_CODES[station.lower()] = code
+        obs.fetch_OBS(station, update=False)
+
+    def run():
+        for station in ctx['stations']:
+            obs.parse_observations(station)
+
+    nbytes = sum(os.path.getsize(os.path.join(ctx['path'], s, "OBS", f))
+                 for s in ctx['stations']
+                 for f in os.listdir(os.path.join(ctx['path'], s, "OBS"))
+                 if f.endswith(".npy"))
+    return run, len(ctx['stations']), nbytes
+
+@benchmark
+def bench_penalty(ctx):
+    """Score a million pairs of precipitation forecast and observation at once."""
+    rng = np.random.RandomState(0)
+    fcsts, obs_amounts = rng.gamma(0.5, 0.3, (2, 10**6))
+    run = lambda: penalty(fcsts, obs_amounts)
+    return run, len(fcsts), 0
+
+@benchmark
+def bench_score(ctx):
+    """Score and rank 1000 forecasters over 60 days at 10 cities."""
+    rng = np.random.RandomState(0)
+    shape = (60, 10)
+    verification = np.stack([rng.normal(70., 10., shape).round(), rng.normal(50., 10., shape).round(),
+                             rng.uniform(0., 25., shape).round(), rng.gamma(0.5, 0.3, shape).round(2)],
+                            axis=-1)
+    errors = rng.normal(0., 3., (1000, ) + verification.shape).round()
+    errors[..., 3] /= 30.
+    forecasts = np.abs(verification[None] + errors)
+
+    def run():
+        scores = scoring.score(forecasts, verification)
+        scores.ranks(scores.tournament)
+
+    return run, forecasts.size/forecasts.shape[-1], 0
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _run_one(name, ctx, repeat, queue):
+    """Set up and time a single benchmark (in a forked process).
+
+    """
+    mos.data_path = ctx['path']
+    obs.data_path = ctx['path']
+    ## (pandas complains about the attributes which process_MOS attaches)
+    warnings.simplefilter("ignore", UserWarning)
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        run, items, nbytes = BENCHMARKS[name](ctx)
+        setup_mb = _peak_rss_mb()
+        times = []
+        for _ in xrange(repeat):
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+    except Exception, e:
+        queue.put({ 'error': "%s: %s" % (type(e).__name__, e) })
+        return
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    best = min(times)
+    queue.put({ 'seconds': best,
+                'items': items,
+                'items_per_s': items / best,
+                'mb_per_s': nbytes / 1048576. / best,
+                'setup_mb': setup_mb,
+                'peak_mb': _peak_rss_mb() })
+
+def run_benchmarks(ctx, names=None, repeat=3):
+    """Run benchmarks, each in its own process, and collect their results.
+
+    Returns
+    -------
+    OrderedDict
+        Results of each benchmark, keyed by name
+
+    """
+    results = OrderedDict()
+    for name in (names or BENCHMARKS.keys()):
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_run_one, args=(name, ctx, repeat, queue))
+        p.start()
+        results[name] = queue.get()
+        p.join()
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """Find benchmarks which are slower, or use more memory, than a
+    baseline by more than the given fraction.
+
+    Returns
+    -------
+    list of strings
+        Description of each regression
+
+    """
+    regressions = []
+    for name, result in results.iteritems():
+        base = baseline.get(name)
+        if (base is None) or ('error' in result) or ('error' in base):
+            continue
+        if result['items_per_s'] < base['items_per_s'] * (1. - tolerance):
+            regressions.append("%s: throughput %.1f/s, was %.1f/s" %
+                               (name, result['items_per_s'], base['items_per_s']))
+        if result['peak_mb'] > base['peak_mb'] * (1. + tolerance):
+            regressions.append("%s: peak memory %.1f MB, was %.1f MB" %
+                               (name, result['peak_mb'], base['peak_mb']))
+    return regressions
+
+def print_results(results, baseline=None):
+    print "%-26s %10s %12s %9s %9s %9s" % ("benchmark", "items", "items/s", "MB/s",
+                                          "peak MB", "vs base")
+    for name, r in results.iteritems():
+        if 'error' in r:
+            print "%-26s %s" % (name, r['error'])
+            continue
+        ratio = ""
+        if baseline and (name in baseline) and ('items_per_s' in baseline[name]):
+            ratio = "%.2fx" % (r['items_per_s'] / baseline[name]['items_per_s'])
+        print "%-26s %10d %12.1f %9.2f %9.1f %9s" % (name, r['items'], r['items_per_s'],
+                                                    r['mb_per_s'], r['peak_mb'], ratio)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2009)
+    parser.add_argument("--data", help="synthetic data directory to (generate and) re-use")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS.keys())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    years = range(args.start_year, args.start_year + args.years)
+    path = args.data or tempfile.mkdtemp(prefix="wxc-bench-")
+    ctx = make_context(path, args.stations, years)
+    try:
+        if not os.path.exists(os.path.join(path, "mav%4d01.t00z" % years[0])):
+            print "Generating %d stations x %d years in %s" % (args.stations, args.years, path)
+            synthetic.generate(path, args.stations, years)
+
+        results = run_benchmarks(ctx, args.only, args.repeat)
+    finally:
+        if args.data is None:
+            shutil.rmtree(path)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({ 'stations': args.stations, 'years': years, 'results': results },
+                      f, indent=1)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print "REGRESSION", regression
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,311 @@
+"""Generator of synthetic MOS bulletins and GHCN-Daily observations.
+
+Produces a data directory laid out just like one populated by
+`mos.get_GFS()`/`mos.get_NAM()` (with `explode=False`) and
+`obs.fetch_OBS()`, for any number of stations and years, so that the
+utilities can be exercised and load-tested without network access:
+
+    {path}/
+      mav200901.t00z, mav200901.t06z, ...   GFS MAV monthly bulletins
+      met200901, ...                        NAM MET monthly bulletins
+      {STATION}/OBS/{CODE}.dly              GHCN-Daily station record
+
+The forecasts and observations follow a smooth seasonal and diurnal
+climatology with noise, so that every field takes plausible values, and
+the fixed-width layout of each product matches the real one. All output
+is deterministic for a given set of arguments.
+
+From the command line,
+
+    $ python synthetic.py data_arch --stations 20 --years 2
+
+"""
+import argparse
+import calendar
+import datetime
+import os
+import zlib
+
+import numpy as np
+
+## Lead times (in hours) of the MAV and MET guidance
+MOS_LEADS = range(6, 61, 3) + [66, 72]
+MODEL_CYCLES = { 'GFS': [0, 6, 12, 18], 'NAM': [0, 12] }
+BULLETIN_PATTERN = { 'NAM': "met%(year)4d%(month)02d",
+                     'GFS': "mav%(year)4d%(month)02d.t%(hour)02dz" }
+
+MONTH_LABELS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUNE", "JULY", "AUG",
+                "SEPT", "OCT", "NOV", "DEC"]
+CLOUD_LABELS = ["CL", "FW", "SC", "BK", "OV"]
+
+def station_ids(n):
+    """Make up `n` distinct 4-letter station identifiers and GHCN codes.
+
+    """
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    stations = []
+    for i in xrange(n):
+        name = "K" + letters[(i // 676) % 26] + letters[(i // 26) % 26] + letters[i % 26]
+        stations.append((name, "USW%08d" % (90000 + i)))
+    return stations
+
+class Climate(object):
+    """Smooth seasonal/diurnal climatology of one (synthetic) station.
+
+    """
+
+    def __init__(self, station):
+        rng = np.random.RandomState(zlib.crc32(station) & 0xffffffff)
+        self.mean = rng.uniform(40., 62.)     # annual mean temperature (F)
+        self.seasonal = rng.uniform(10., 22.) # seasonal amplitude (F)
+        self.diurnal = rng.uniform(6., 11.)   # half of the diurnal range (F)
+        self.humidity = rng.uniform(6., 15.)  # mean dewpoint depression (F)
+        self.wetness = rng.uniform(0.2, 0.5)  # climatological chance of rain
+
+    def temperature(self, times):
+        """Expected temperature (F) at an array of datetime64 times.
+
+        """
+        days = (times - np.datetime64('2000-01-01T00', 'h')).astype('f8') / 24.
+        seasonal = -self.seasonal * np.cos(2*np.pi*(days - 20.) / 365.25)
+        # Warmest in the late afternoon, local time, which is ~21Z
+        diurnal = self.diurnal * np.cos(2*np.pi*(np.mod(days, 1.) - 21./24.))
+        return self.mean + seasonal + diurnal
+
+def _rng(*keys):
+    return np.random.RandomState(zlib.crc32(repr(keys)) & 0xffffffff)
+
+def _row(name, cells):
+    return (" %-3s " % name + "".join("   " if c is None else "%3s" % c
+                                      for c in cells)).rstrip()
+
+def _date_line(valid):
+    """Label each calendar day, starting above its first column.
+
+    """
+    chars = list(" DT ") + [" "]*(3*len(valid) + 1)
+    end = 0
+    for i, v in enumerate(valid):
+        if (i == 0) or (v.hour == 0):
+            label = "/%s %3d" % (MONTH_LABELS[v.month - 1], v.day)
+            pos = 4 if i == 0 else max(5 + 3*i, end)
+            chars[pos:pos + len(label)] = list(label)
+            end = pos + len(label)
+    return "".join(chars).rstrip()
+
+def mos_block(station, run, model="GFS", climate=None):
+    """Generate a single MAV (GFS) or MET (NAM) forecast block.
+
+    Parameters
+    ----------
+    station : string
+        Station identifier code
+    run : datetime.datetime
+        Model initialization time
+    model : string, optional
+        Model name, either "GFS" or "NAM"
+    climate : Climate, optional
+        Climatology of the station; created from its name by default
+
+    Returns
+    -------
+    list of strings
+        Lines of the block, including a trailing blank line
+
+    """
+    if climate is None:
+        climate = Climate(station)
+    rng = _rng(station, model, run.isoformat())
+    n = len(MOS_LEADS)
+
+    run64 = np.datetime64(run, 'h')
+    valid64 = run64 + np.array(MOS_LEADS).astype('m8[h]')
+    valid = [run + datetime.timedelta(hours=h) for h in MOS_LEADS]
+
+    ## Temperatures, with forecast errors growing with lead time
+    error = np.cumsum(rng.normal(0., 1.2, n))
+    tmp = np.round(climate.temperature(valid64) + error).astype(int)
+    dpt = np.minimum(tmp, np.round(tmp - climate.humidity - rng.gamma(2., 2., n))).astype(int)
+
+    ## Clouds and precipitation follow a single latent "storminess"
+    storm = np.clip(climate.wetness + np.cumsum(rng.normal(0., 0.08, n)), 0., 1.)
+    cld = [CLOUD_LABELS[int(min(4, s*5.))] for s in storm]
+    wdr = rng.randint(0, 37, n)
+    wsp = np.round(rng.gamma(2., 3.5, n)*(0.5 + storm)).astype(int)
+    wdr[wsp == 0] = 0
+
+    pop = np.clip(np.round(100*storm**2 + rng.normal(0, 5, n)), 0, 100).astype(int)
+    qpf = np.minimum(6, pop // 20)
+    poz = np.where(tmp < 34, rng.randint(0, 20, n), 0)
+    pos = np.clip(np.round(100*(1. - (tmp - 28.)/10.)), 0, 100).astype(int)
+    typ = ["S" if p > 50 else ("Z" if z > 10 else "R") for p, z in zip(pos, poz)]
+    cig = np.clip(np.round(8 - 6*storm + rng.normal(0, 0.7, n)), 1, 8).astype(int)
+    vis = np.clip(np.round(7 - 4*storm**2 + rng.normal(0, 0.5, n)), 1, 7).astype(int)
+    obv = ["N" if v == 7 else ("BR" if v > 3 else "FG") for v in vis]
+
+    hours = np.array([v.hour for v in valid])
+    six = (hours % 6 == 0)
+    twelve = (hours % 12 == 0) & (np.arange(n) > 1)
+
+    ## Max/min rows: maxima under 00Z (for the preceding day), minima under
+    ## 12Z, starting with the max (00Z/06Z runs) or the min (12Z/18Z runs)
+    temps = climate.temperature(valid64)
+    xn_cells = [None, ]*n
+    first = [i for i in xrange(n) if hours[i] == (0 if run.hour < 12 else 12)][0]
+    cols = [i for i in xrange(first, n) if hours[i] in (0, 12)][:5]
+    for i in cols:
+        window = slice(max(0, i - 4), i + 1)
+        if hours[i] == 0:
+            xn_cells[i] = int(np.round(np.max(temps[window]) + error[i] + 2))
+        else:
+            xn_cells[i] = int(np.round(np.min(temps[window]) + error[i] - 2))
+
+    t06 = " ".join("%2d/%2d" % (rng.randint(0, 5), rng.randint(0, 20)) for _ in xrange(n // 2 - 1))
+
+    lines = [ " %-4s   %s MOS GUIDANCE   %2d/%02d/%04d  %02d00 UTC" %
+                  (station, model, run.month, run.day, run.year, run.hour),
+              _date_line(valid),
+              " HR  " + "".join(" %02d" % h for h in hours),
+              _row("X/N" if run.hour < 12 else "N/X", xn_cells),
+              _row("TMP", tmp),
+              _row("DPT", dpt),
+              _row("CLD", cld),
+              _row("WDR", ["%02d" % d for d in wdr]),
+              _row("WSP", ["%02d" % s for s in wsp]),
+              _row("P06", [p if six[i] and i > 0 else None for i, p in enumerate(pop)]),
+              _row("P12", [p if twelve[i] else None for i, p in enumerate(pop)]),
+              _row("Q06", [c if six[i] and i > 0 else None for i, c in enumerate(qpf)]),
+              _row("Q12", [c + (c > 0) if twelve[i] else None for i, c in enumerate(qpf)]),
+              " T06      " + t06,
+              _row("POZ", poz),
+              _row("POS", pos),
+              _row("TYP", typ),
+              _row("CIG", cig),
+              _row("VIS", vis),
+              _row("OBV", obv),
+              "" ]
+    return [l + "\n" for l in lines]
+
+def write_bulletins(path, stations, years, models=None):
+    """Write the monthly bulletins of each model, holding a block for every
+    station and run.
+
+    Returns
+    -------
+    list of strings
+        Paths of the bulletins written
+
+    """
+    if models is None:
+        models = ["GFS", "NAM"]
+    climates = dict((s, Climate(s)) for s in stations)
+    written = []
+    for model in models:
+        ## Each GFS bulletin holds a single cycle, each NAM bulletin all of them
+        cycles = MODEL_CYCLES[model]
+        groups = [[h, ] for h in cycles] if model == "GFS" else [cycles, ]
+        for year in years:
+            for month in xrange(1, 13):
+                ndays = calendar.monthrange(year, month)[1]
+                for group in groups:
+                    filename = os.path.join(path, BULLETIN_PATTERN[model] %
+                                            {'year': year, 'month': month, 'hour': group[0]})
+                    with open(filename, "w") as f:
+                        for day in xrange(1, ndays + 1):
+                            for hour in group:
+                                run = datetime.datetime(year, month, day, hour)
+                                for station in stations:
+                                    f.writelines(mos_block(station, run, model,
+                                                           climates[station]))
+                    written.append(filename)
+    return written
+
+def dly_lines(station, code, years, climate=None, missing=0.01):
+    """Generate the GHCN-Daily records (TMAX, TMIN, PRCP, SNOW) of a station.
+
+    Values are in the units of the archive: tenths of a degree C, and
+    tenths of a mm; a fraction `missing` of them are reported as -9999.
+
+    """
+    if climate is None:
+        climate = Climate(station)
+    rng = _rng(station, "GHCND")
+    lines = []
+    for year in years:
+        for month in xrange(1, 13):
+            ndays = calendar.monthrange(year, month)[1]
+            days = np.datetime64("%04d-%02d-01T00" % (year, month), 'h') + \
+                   (24*np.arange(31)).astype('m8[h]')
+            hours = days[:, None] + np.arange(24).astype('m8[h]')
+            temps = climate.temperature(hours.ravel()).reshape(31, 24)
+            tmax = temps.max(axis=1) + rng.normal(0., 4., 31)
+            tmin = np.minimum(tmax - 2., temps.min(axis=1) + rng.normal(0., 4., 31))
+            prcp = np.where(rng.rand(31) < climate.wetness*0.6, rng.gamma(0.8, 60., 31), 0.)
+            snow = np.where(tmax < 34., prcp, 0.)
+
+            elements = [ ('TMAX', np.round((tmax - 32.)*5./9.*10.)),
+                         ('TMIN', np.round((tmin - 32.)*5./9.*10.)),
+                         ('PRCP', np.round(prcp)),
+                         ('SNOW', np.round(snow)) ]
+            for element, values in elements:
+                values = values.astype(int)
+                values[rng.rand(31) < missing] = -9999
+                values[ndays:] = -9999
+                cells = "".join("%5d  %s" % (v, " " if v == -9999 else "7") for v in values)
+                lines.append("%11s%04d%02d%4s%s\n" % (code, year, month, element, cells))
+    return lines
+
+def write_dly(path, station, code, years):
+    """Write a station's GHCN-Daily record where `obs.fetch_OBS()` expects it.
+
+    """
+    obs_path = os.path.join(path, station, "OBS")
+    if not os.path.exists(obs_path):
+        os.makedirs(obs_path)
+    filename = os.path.join(obs_path, "%s.dly" % code)
+    with open(filename, "w") as f:
+        f.writelines(dly_lines(station, code, years))
+    return filename
+
+def generate(path, n_stations, years, models=None):
+    """Populate a data directory with bulletins and observations.
+
+    Parameters
+    ----------
+    path : string
+        Data directory; created if necessary
+    n_stations : int
+        Number of stations to generate
+    years : iterable of int
+        Calendar years of data to generate
+    models : iterable of strings, optional
+        Models whose bulletins should be generated; both by default
+
+    Returns
+    -------
+    dict
+        Mapping of each station identifier to its GHCN code, suitable for
+        adding to `data.STATION_CODES` (with lower-case keys)
+
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    stations = station_ids(n_stations)
+    write_bulletins(path, [s for s, _ in stations], years, models)
+    for station, code in stations:
+        write_dly(path, station, code, years)
+    return dict(stations)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="data directory to populate")
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2009)
+    parser.add_argument("--models", nargs="+", default=["GFS", "NAM"])
+    args = parser.parse_args()
+
+    years = range(args.start_year, args.start_year + args.years)
+    codes = generate(args.path, args.stations, years, args.models)
+    print "Generated %d stations x %d years in %s" % (len(codes), len(years), args.path)
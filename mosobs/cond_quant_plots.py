@@ -7,8 +7,9 @@ ref:
 """
 import numpy as np
 import pandas as pd
-from util.obs import parse_observations
-from util.mos import concatenate_MOS
+from util.obs import parse_observations, open_obs
+from util.mos import summarize_MOS
+from util.calibration import conditional_quantiles
 from pylab import *
 ion()
 
@@ -20,6 +21,7 @@ model_keys = ["GFS12Z", "GFS18Z", "NAM12Z"]
 station = "KCON"
 field = "TMAX"
 vd, core = parse_observations(station)
+record = open_obs(station, [field, ])
 
 ## Subset the observational data. As an example, choose all
 ## October data
@@ -38,9 +40,9 @@ for i, d in enumerate(dates):
    sys.stdout.write("\r%2.1f%%" % (100.*float(i)/len(dates)))
    sys.stdout.flush() 
 
-   try:
-        mos_panel, mos_fcst = concatenate_MOS(station, d)
-   except ValueError:
+   ## Only the max/min forecasts are needed, so skip the full 3-hourly parse
+   mos_fcst = summarize_MOS(station, d)
+   if not mos_fcst:
         continue
 
    valid_dates.append(d)
@@ -51,63 +53,33 @@ for i, d in enumerate(dates):
         except KeyError:
             fcst_fields[key].append(np.nan)
        
-obs_fields = np.floor(core_ss[field].ix[valid_dates])
+obs_fields = np.floor(record.take(field, valid_dates).filled(np.nan))
 fcst_fields.update({'obs': obs_fields})
 
-data = pd.DataFrame(fcst_fields)      
+data = pd.DataFrame(fcst_fields, index=valid_dates)
 
 ################################
-for model in model_keys:
-    data_slice = data[["obs", model]]
-    data_slice = data_slice.dropna()
-
-    ## Calculate quantiles
-    # Gather the data for each forecast value:
-    fcst_groups = data_slice.groupby(model)
-    fcsts, obs = [], []
-    for fcst_tmax, group in fcst_groups:
-        #print fcst_tmax, "\n", group
-        fcsts.append(fcst_tmax)
-        obs.append(group['obs'].values.tolist())
-        
-    # Use percentile function in numpy
-    from scipy.stats.mstats import mquantiles
-    quants = []
-    cor_fcsts = []
-    for fcst, obs_set in zip(fcsts, obs): 
-        #if len(obs_set) <= 5: continue
-        q = mquantiles(obs_set, [0.1, 0.25, .5, 0.75, .9])
-        quants.append(q)
-        cor_fcsts.append(fcst)
-        print fcst, q
-    quants = np.array(quants)
-    print quants.shape
-    print len(cor_fcsts)
-
-    # Smooth using LOWESS
-    import statsmodels.api as sm
-    lowess = sm.nonparametric.lowess
-    num_valid, num_quantiles = quants.shape
-    all_quants = np.zeros([len(fcsts), num_quantiles])
-    for i in xrange(num_quantiles):
-        fi = lowess(quants[:, i], cor_fcsts, return_sorted=False,
-                    frac=1./12., it=0)
-        all_quants[:, i] = fi[:]
-
-    print all_quants.shape
-    quants = all_quants[:]
+## Conditional quantiles of every model at once
+cq = conditional_quantiles(data[model_keys].values.T, data["obs"].values[None])
+
+def plot_conditional_quantiles(cq, i, model):
+    """Plot the smoothed conditional quantiles of one series, over a
+    histogram of its forecasts.
+
+    """
+    has_data = cq.counts[i] > 0
+    fcsts = cq.bins[has_data]
+    quants = cq.smoothed[i][has_data]
     for fcst, q in zip(fcsts, quants):
         print fcst, q
 
-    tmaxes_unique = data[model].value_counts()
-
     ## Make frequency plot
     fig = figure()
     ax = fig.add_subplot(111)
     ax_freq = ax.twinx()
 
-    lefts = np.array(tmaxes_unique.index) - 0.5
-    heights = tmaxes_unique.values
+    lefts = fcsts - 0.5
+    heights = cq.counts[i][has_data]
     ax_freq.bar(lefts, heights, width=1.0)
     ax_freq.set_xlim(np.min(lefts)-4.5, np.max(lefts)+4.5)
     ax_freq.set_ylim(0, np.max(heights)*3)
@@ -130,3 +102,6 @@ for model in model_keys:
 
     ax.set_title("%s - %s - %s" % (model, station, field), loc="left", color="#555555")
     savefig("%s.%s.%s.pdf" % (station, model, field), transparent=True, bbox_inches="tight")
+
+for i, model in enumerate(model_keys):
+    plot_conditional_quantiles(cq, i, model)
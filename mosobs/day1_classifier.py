@@ -98,9 +98,8 @@ def aggregate_mos(station, interval):
         ## GFS 18Z
         # Read raw MOS data
         fn = "%s.%02d%02d%4d.%s.%02dZ" % (station, m, d, y, mos.full_model_name["GFS"], 18)
-        f = open(os.path.join(path_to_mos_data, "GFS", fn), "r")
         # Process MOS data
-        proc_mos = mos.process_MOS(f.readlines())
+        proc_mos = mos.load_MOS(os.path.join(path_to_mos_data, "GFS", fn))
         gfs_day1 = _analyze_mos(proc_mos, day1=day1)
         # Append
         all_gfs_fcsts.append(gfs_day1)
@@ -108,9 +107,8 @@ def aggregate_mos(station, interval):
         ## NAM 12Z
         # Read raw MOS data
         fn = "%s.%02d%02d%4d.%s.%02dZ" % (station, m, d, y, mos.full_model_name["NAM"], 12)
-        f = open(os.path.join(path_to_mos_data, "NAM", fn), "r")
         # Process MOS data
-        proc_mos = mos.process_MOS(f.readlines())
+        proc_mos = mos.load_MOS(os.path.join(path_to_mos_data, "NAM", fn))
         nam_day1 = _analyze_mos(proc_mos, day1=day1)
         # Append
         all_nam_fcsts.append(nam_day1)
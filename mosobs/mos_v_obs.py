@@ -2,11 +2,10 @@ import sys, os
 import numpy as np
 import datetime
 import itertools
-from operator import mul
 
 from pandas import *
 
-from util import mos, obs
+from util import cube, mos, obs, parse
 
 from pylab import *
 ion()
@@ -17,50 +16,28 @@ def mos_maxmin_fcsts(station, interval, model):
     '''
     start_date, end_date = interval
     day_count = (end_date - start_date).days + 1
-
-    path_to_mos_data = os.path.join(os.getcwd(), "data_arch", station, model)
-
-    all_fcsts = []
     dates = [start_date + datetime.timedelta(n) for n in range(day_count)]
-    for date in dates:
-        print date
-        y, m, d = date.year, date.month, date.day
-        day1 = date + datetime.timedelta(1)
-        day2 = date + datetime.timedelta(2)
-
-        day1_maxes, day1_mins, day2_maxes, day2_mins = [], [], [], []
-        fcsts = {}
-
-        fcst_hours = [0, 6, 12, 18] if model == "GFS" else [0, 12]
-
-        for h in fcst_hours:
-            fn = "%s.%02d%02d%4d.%s.%02dZ" % (station, m, d, y, mos.full_model_name[model], h)
-            f = open(os.path.join(path_to_mos_data, fn), "r")
-
-            proc_mos = mos.process_MOS(f.readlines())
-            maxmins = proc_mos.maxmins
 
-            mm_day1 = maxmins[day1]
-            day1_max, day1_min = mm_day1['max'], mm_day1['min']
+    fcst_hours = [0, 6, 12, 18] if model == "GFS" else [0, 12]
 
-            mm_day2 = maxmins[day2]
-            day2_max, day2_min = mm_day2['max'], mm_day2['min']
+    ## Load all the runs at once. Maxes are printed under the 00Z column
+    ## following the forecast day and mins under its 12Z column, so each
+    ## day's max/min sits at a fixed offset from the model run date.
+    fcst_cube = cube.load_mos_range(station, start_date, end_date, [model],
+                                    fcst_hours, ["X/N"])
+    valid_hours = { ("Tmax", "day1"): 48, ("Tmin", "day1"): 36,
+                    ("Tmax", "day2"): 72, ("Tmin", "day2"): 60 }
 
-            day1_maxes.append(day1_max)
-            day2_maxes.append(day2_max)
-            day1_mins.append(day1_min)
-            day2_mins.append(day2_min)
-
-        all_fcsts.append([ [day1_maxes, day2_maxes], [day1_mins, day2_mins] ])
-
-    all_fcsts = np.array(all_fcsts)
-    length = len(all_fcsts)
-    ncols = reduce(mul, all_fcsts.shape[1:])
-
-    all_fcsts = np.reshape(all_fcsts, [length, ncols])
+    tuples = list(itertools.product(["Tmax", "Tmin"], ["day1", "day2"], ["%02dZ" % h for h in fcst_hours]))
+    all_fcsts = []
+    for field, day, hour in tuples:
+        cycle = "%s%s" % (model, hour)
+        lead = valid_hours[(field, day)] - int(hour[:2])
+        fcst = fcst_cube.sel("X/N", station=station.upper(), cycle=cycle, lead=lead)
+        all_fcsts.append(parse.decode_field("X/N", fcst))
+    all_fcsts = np.column_stack(all_fcsts)
     print all_fcsts.shape
 
-    tuples = list(itertools.product(["Tmax", "Tmin"], ["day1", "day2"], ["%02dZ" % h for h in fcst_hours]))
     cols = MultiIndex.from_tuples(tuples, names=['field', 'fcst day', 'model run'])
 
     print cols
@@ -0,0 +1,171 @@
+"""Memoization of parsed MOS forecasts.
+
+Parsed runs are kept in a bounded, least-recently-used in-memory cache,
+and can optionally be pickled to a directory on disk so that they survive
+between sessions. Runs are keyed either by the path, size and modification
+time of the file they were read from, or by a hash of its contents.
+
+"""
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import os
+
+## Extra attributes attached to a DataFrame by `mos.process_MOS`; pickling
+## a DataFrame drops these, so they are saved alongside it
+MOS_ATTRS = ["meta", "maxmins", "precip"]
+
+class LRUCache(object):
+    """Dictionary-like container holding at most `maxsize` items, which
+    discards the least recently used item when it overflows.
+
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+class MOSCache(object):
+    """Two-tier cache of MOS forecasts parsed from files on disk.
+
+    Parameters
+    ----------
+    parse : function
+        Converts the lines of a MOS block into a forecast; usually
+        `mos.process_MOS`
+    maxsize : int, optional
+        Maximum number of parsed forecasts to keep in memory
+    cache_dir : string, optional
+        Directory in which to pickle parsed forecasts; by default, nothing
+        is written to disk
+    by_content : boolean, optional
+        Key each file on a hash of its contents instead of its path, size
+        and modification time
+
+    """
+
+    def __init__(self, parse, maxsize=1024, cache_dir=None, by_content=False):
+        self.parse = parse
+        self.memory = LRUCache(maxsize)
+        self.cache_dir = cache_dir
+        self.by_content = by_content
+
+        self.hits, self.misses = 0, 0
+
+    def key(self, filename, contents=None):
+        """Compute the cache key for a MOS file.
+
+        """
+        h = hashlib.sha1()
+        if self.by_content:
+            if contents is None:
+                with open(filename, "rb") as f:
+                    contents = f.read()
+            h.update(contents)
+        else:
+            st = os.stat(filename)
+            h.update("%s|%d|%r" % (os.path.abspath(filename), st.st_size, st.st_mtime))
+        return h.hexdigest()
+
+    def load(self, filename):
+        """Return the parsed forecast in a MOS file, parsing it only if it
+        isn't already cached.
+
+        .. note:: The same object is returned on every call with the same
+            key, so it should be treated as read-only.
+
+        Parameters
+        ----------
+        filename : string
+            Path to a file containing a single MOS block
+
+        Returns
+        -------
+        object
+            The output of `parse` for the contents of the file
+
+        """
+        contents = None
+        if self.by_content:
+            with open(filename, "rb") as f:
+                contents = f.read()
+        key = self.key(filename, contents)
+
+        fcst = self.memory.get(key)
+        if fcst is not None:
+            self.hits += 1
+            return fcst
+
+        fcst = self._read_disk(key)
+        if fcst is None:
+            self.misses += 1
+            if contents is None:
+                with open(filename, "rb") as f:
+                    contents = f.read()
+            fcst = self.parse(contents.splitlines(True))
+            self._write_disk(key, fcst)
+        else:
+            self.hits += 1
+
+        self.memory.put(key, fcst)
+        return fcst
+
+    def clear(self):
+        """Empty the in-memory tier of the cache.
+
+        """
+        self.memory.clear()
+        self.hits, self.misses = 0, 0
+
+    def _disk_filename(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        filename = self._disk_filename(key)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "rb") as f:
+            fcst, attrs = pickle.load(f)
+        for attr, value in attrs.iteritems():
+            setattr(fcst, attr, value)
+        return fcst
+
+    def _write_disk(self, key, fcst):
+        if self.cache_dir is None:
+            return
+        filename = self._disk_filename(key)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        attrs = dict((attr, getattr(fcst, attr)) for attr in MOS_ATTRS
+                     if hasattr(fcst, attr))
+        ## Write to a temporary file first so that readers never see a
+        ## partially written entry
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp_filename, "wb") as f:
+            pickle.dump((fcst, attrs), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, filename)
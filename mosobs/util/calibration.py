@@ -0,0 +1,231 @@
+"""Conditional quantiles of observations given forecasts, for calibration
+diagnostics.
+
+Following Murphy et al (1989) and Wilks (Section 7.3), the calibration
+of a set of forecasts is summarized by the quantiles of the observations
+which followed each forecast value. Here those are computed for any
+number of forecast series at once - e.g. every model, field and station
+- stacked along the leading dimensions of one array. All the pairs are
+bucketed by series and forecast value and sorted in a single pass, and
+the quantiles of every bucket are then read off the sorted observations
+by indexing. The quantile curves are smoothed with a kernel smoother on
+the grid of forecast values, weighted by the number of pairs in each
+bucket, which replaces running LOWESS separately for each quantile.
+
+Nothing here plots; see `cond_quant_plots.py` for that.
+
+"""
+import unittest
+
+import numpy as np
+from scipy.stats.mstats import mquantiles
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+class ConditionalQuantilesTest(unittest.TestCase):
+
+    def testMquantiles(self):
+        rng = np.random.RandomState(0)
+        obs = rng.normal(60, 15, (4, 300)).round()
+        fcsts = (obs[None] + rng.normal(0, 3, (3, 4, 300))).round()
+        fcsts[rng.rand(*fcsts.shape) < .05] = np.nan
+        obs[rng.rand(*obs.shape) < .05] = np.nan
+        cq = conditional_quantiles(fcsts, obs[None])
+        ## Buckets of every size, including empty and one- or two-sample ones
+        sizes = set()
+        for m in xrange(3):
+            for s in xrange(4):
+                for b, value in enumerate(cq.bins):
+                    sample = obs[s][(fcsts[m, s] == value) & ~np.isnan(obs[s])]
+                    self.assertEqual(cq.counts[m, s, b], len(sample))
+                    sizes.add(min(len(sample), 3))
+                    if not len(sample):
+                        self.assertTrue(np.isnan(cq.quantiles[m, s, b]).all())
+                        self.assertTrue(np.isnan(cq.smoothed[m, s, b]).all())
+                    else:
+                        self.assertTrue(np.allclose(cq.quantiles[m, s, b],
+                                                    mquantiles(sample, QUANTILES)))
+        self.assertEqual(sizes, set([0, 1, 2, 3]))
+
+    def testSmallBuckets(self):
+        cq = conditional_quantiles([50., 51., 51.], [55., 40., 45.])
+        self.assertEqual(list(cq.counts), [1, 2])
+        self.assertTrue(np.allclose(cq.quantiles[0], 55.))
+        self.assertTrue(np.allclose(cq.quantiles[1], mquantiles([40., 45.], QUANTILES)))
+        ## The smoothed curves stay between the buckets' quantiles
+        self.assertTrue(((cq.smoothed >= 40.) & (cq.smoothed <= 55.)).all())
+
+    def testAllMissing(self):
+        cq = conditional_quantiles(np.full((2, 3), np.nan), np.zeros(3))
+        self.assertEqual(cq.counts.shape, (2, 0))
+        self.assertEqual(cq.quantiles.shape, (2, 0, len(QUANTILES)))
+        cq = conditional_quantiles([50., 51.], [np.nan, np.nan])
+        self.assertEqual(list(cq.counts), [0, 0])
+        self.assertTrue(np.isnan(cq.smoothed).all())
+
+class ConditionalQuantiles(object):
+    """Conditional quantiles of several series of forecasts.
+
+    Attributes
+    ----------
+    bins : numpy.ndarray
+        The forecast value at the center of each bucket
+    probs : numpy.ndarray
+        The quantiles computed
+    counts : numpy.ndarray
+        Number of pairs in each bucket, with dimensions (..., bin)
+    quantiles : numpy.ndarray
+        Quantiles of the observations in each bucket, with dimensions
+        (..., bin, quantile); NaN for empty buckets
+    smoothed : numpy.ndarray
+        Smoothed quantiles, with the same dimensions; NaN for empty
+        buckets
+
+    """
+
+    def __init__(self, bins, probs, counts, quantiles, smoothed):
+        self.bins, self.probs = bins, probs
+        self.counts, self.quantiles, self.smoothed = counts, quantiles, smoothed
+
+def sorted_buckets(forecasts, observations, bins):
+    """Bucket pairs of forecasts and observations by series and forecast
+    value, and sort the observations within each bucket.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        The observations, grouped by bucket (in C order over the series
+        and bins) and sorted within each one
+    starts, counts : numpy.ndarray
+        Position in `values` of the first observation of each bucket, and
+        the number of them, with dimensions (..., bin)
+
+    """
+    forecasts, observations = np.broadcast_arrays(np.asarray(forecasts, dtype='f8'),
+                                                  np.asarray(observations, dtype='f8'))
+    series_shape = forecasts.shape[:-1]
+    n_series = int(np.prod(series_shape))
+    forecasts = forecasts.reshape(n_series, -1)
+    observations = observations.reshape(n_series, -1)
+
+    width = bins[1] - bins[0] if len(bins) > 1 else 1.
+    origin = bins[0] if len(bins) else 0.
+    positions = np.floor((forecasts - origin)/width + 0.5)
+    with np.errstate(invalid='ignore'):
+        valid = ~np.isnan(forecasts) & ~np.isnan(observations) & \
+                (positions >= 0) & (positions < len(bins))
+    series = np.repeat(np.arange(n_series)[:, None], forecasts.shape[1], axis=1)
+    buckets = (series*len(bins) + positions)[valid].astype('i8')
+    values = observations[valid]
+
+    order = np.lexsort((values, buckets))
+    values = values[order]
+    counts = np.bincount(buckets, minlength=n_series*len(bins))
+    starts = np.cumsum(counts) - counts
+    shape = series_shape + (len(bins), )
+    return values, starts.reshape(shape), counts.reshape(shape)
+
+def bucket_quantiles(values, starts, counts, probs, alphap=0.4, betap=0.4):
+    """Quantiles of each bucket of sorted values.
+
+    The plotting positions are those of `scipy.stats.mstats.mquantiles()`,
+    with the same defaults, so each bucket's quantiles match it.
+
+    Returns
+    -------
+    numpy.ndarray
+        With dimensions (..., quantile) of the buckets; NaN for empty ones
+
+    """
+    probs = np.asarray(probs, dtype='f8')
+    n = counts[..., None].astype('f8')
+    aleph = n*probs + (alphap + probs*(1. - alphap - betap))
+    k = np.floor(np.clip(aleph, 1., np.maximum(n - 1., 1.)))
+    gamma = np.clip(aleph - k, 0., 1.)
+
+    lower = np.minimum(k - 1, np.maximum(n - 1, 0)).astype('i8')
+    upper = np.minimum(k, np.maximum(n - 1, 0)).astype('i8')
+    empty = (counts == 0)[..., None]
+    if not len(values):
+        return np.full(n.shape[:-1] + probs.shape, np.nan)
+    first = np.clip(starts[..., None] + lower, 0, len(values) - 1)
+    last = np.clip(starts[..., None] + upper, 0, len(values) - 1)
+    result = (1. - gamma)*values[first] + gamma*values[last]
+    return np.where(empty, np.nan, result)
+
+def kernel_smooth(bins, quantiles, counts, bandwidth=2.):
+    """Smooth quantile curves with a Gaussian kernel over the forecast bins.
+
+    Each smoothed value is the average of the quantiles of the nearby
+    (non-empty) buckets, weighted by the kernel and by the number of pairs
+    in each bucket.
+
+    Parameters
+    ----------
+    bins : numpy.ndarray
+        Forecast value of each bucket
+    quantiles : numpy.ndarray
+        With dimensions (..., bin, quantile)
+    counts : numpy.ndarray
+        With dimensions (..., bin)
+    bandwidth : real, optional
+        Standard deviation of the kernel, in units of the forecast
+
+    """
+    kernel = np.exp(-0.5*((bins[:, None] - bins[None, :])/bandwidth)**2)
+    weights = np.where(counts > 0, counts, 0.).astype('f8')
+    filled = np.where(np.isnan(quantiles), 0., quantiles)
+
+    numerator = np.einsum('ij,...j,...jq->...iq', kernel, weights, filled)
+    denominator = np.einsum('ij,...j->...i', kernel, weights)[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = numerator/denominator
+    return np.where((counts > 0)[..., None], smoothed, np.nan)
+
+def conditional_quantiles(forecasts, observations, probs=QUANTILES, bins=None,
+                          bandwidth=2.):
+    """Compute the conditional quantiles of many series of forecasts at once.
+
+    For example, with the Day 1 max temperature forecasts of several
+    models at several stations stacked in an array of shape
+    (model, station, day), and the observations in one of shape
+    (station, day),
+
+    >>> cq = conditional_quantiles(fcsts, obs[None])
+    >>> cq.smoothed[0, 1]   # quantile curves of model 0 at station 1
+
+    Parameters
+    ----------
+    forecasts : array-like
+        Forecasts, with the samples along the last dimension and any
+        number of series along the others; missing ones are NaN
+    observations : array-like
+        Verifying observations, broadcastable against `forecasts`
+    probs : iterable of reals, optional
+        Quantiles to compute
+    bins : array-like, optional
+        Evenly-spaced forecast values to bucket by, shared by all of the
+        series; every whole number spanned by the forecasts by default.
+        Forecasts are put in the nearest bucket, and those beyond the
+        ends are left out.
+    bandwidth : real, optional
+        Width of the smoothing kernel (see `kernel_smooth()`)
+
+    Returns
+    -------
+    ConditionalQuantiles
+
+    """
+    forecasts = np.asarray(forecasts, dtype='f8')
+    if bins is None:
+        if np.isnan(forecasts).all():
+            bins = np.zeros(0)
+        else:
+            bins = np.arange(np.floor(np.nanmin(forecasts)), np.ceil(np.nanmax(forecasts)) + 1.)
+    bins = np.asarray(bins, dtype='f8')
+    probs = np.asarray(probs, dtype='f8')
+
+    values, starts, counts = sorted_buckets(forecasts, observations, bins)
+    quantiles = bucket_quantiles(values, starts, counts, probs)
+    smoothed = kernel_smooth(bins, quantiles, counts, bandwidth)
+    return ConditionalQuantiles(bins, probs, counts, quantiles, smoothed)
@@ -0,0 +1,323 @@
+"""In-process, streaming decompression of archived MOS bulletins.
+
+The MDL archives are distributed as Unix `compress` (.Z) files, which are
+decoded here directly rather than by shelling out to `uncompress`. Data
+is consumed and produced in chunks, so a bulletin can be piped straight
+from a download (or a file on disk) into the block splitter without ever
+writing the uncompressed text to disk. Gzipped and plain-text bulletins,
+such as those on mirrors of the archive, are recognized as well.
+
+"""
+import os
+import unittest
+import zlib
+
+from tracing import tracer
+
+CHUNK_SIZE = 64*1024
+
+LZW_MAGIC = "\x1f\x9d"
+GZIP_MAGIC = "\x1f\x8b"
+
+_INIT_BITS = 9
+_CLEAR = 256
+
+def _lzw_compress(data, max_bits=16, clear=True):
+    """Encode data in the .Z format, following `compress` (ncompress), for
+    testing; the table is cleared as soon as it fills if `clear` is set,
+    rather than when the compression ratio drops.
+
+    """
+    max_max_code = 1 << max_bits
+    out = []
+    state = { 'n_bits': _INIT_BITS, 'max_code': (1 << _INIT_BITS) - 1,
+              'free_ent': 257, 'group': [] }
+
+    def output(code, clearing=False):
+        state['group'].append(code)
+        if (state['free_ent'] > state['max_code']) or clearing or (len(state['group']) == 8):
+            ## Write out the group, padded to a whole group of n_bits bytes
+            n = state['n_bits']
+            value = sum(c << (i*n) for i, c in enumerate(state['group']))
+            out.append(("%0*x" % (2*n, value)).decode("hex")[::-1])
+            state['group'] = []
+        if clearing:
+            state['n_bits'], state['max_code'] = _INIT_BITS, (1 << _INIT_BITS) - 1
+        elif state['free_ent'] > state['max_code']:
+            state['n_bits'] += 1
+            state['max_code'] = max_max_code if state['n_bits'] == max_bits \
+                                else (1 << state['n_bits']) - 1
+
+    codes = dict((chr(i), i) for i in xrange(256))
+    prefix = data[:1]
+    for c in data[1:]:
+        if prefix + c in codes:
+            prefix += c
+            continue
+        output(codes[prefix])
+        if state['free_ent'] < max_max_code:
+            codes[prefix + c] = state['free_ent']
+            state['free_ent'] += 1
+        elif clear:
+            codes = dict((chr(i), i) for i in xrange(256))
+            state['free_ent'] = 257
+            output(_CLEAR, clearing=True)
+        prefix = c
+    if prefix:
+        output(codes[prefix])
+    if state['group']:
+        n = state['n_bits']
+        value = sum(c << (i*n) for i, c in enumerate(state['group']))
+        ## Only the bytes holding the last codes are written
+        n_bytes = (len(state['group'])*n + 7) // 8
+        out.append(("%0*x" % (2*n, value)).decode("hex")[::-1][:n_bytes])
+    return LZW_MAGIC + chr(0x80 | max_bits) + "".join(out)
+
+class LZWTest(unittest.TestCase):
+
+    def setUp(self):
+        ## Repetitive text, as in a bulletin, and noise, which fills the
+        ## table quickly
+        text = "".join("KSYR   GFS MOS GUIDANCE   1/%02d/2009  0000 UTC\n"
+                       " TMP  30 28 27 %2d 31 35 39 41 40 37 33 30\n" % (i % 31 + 1, i % 97)
+                       for i in xrange(400))
+        noise = "".join(chr((i*7919 + (i >> 3)*104729) % 251) for i in xrange(20000))
+        self.samples = [text, noise, text + noise + text, "", "a"]
+
+    def roundtrip(self, data, max_bits, clear, chunk_size=4097):
+        encoded = _lzw_compress(data, max_bits, clear)
+        chunks = [encoded[i:i+chunk_size] for i in xrange(0, len(encoded), chunk_size)]
+        return "".join(lzw_decompress(chunks))
+
+    def testRoundtrip(self):
+        for max_bits in [9, 10, 12, 16]:
+            for clear in [True, False]:
+                for data in self.samples:
+                    self.assertEqual(self.roundtrip(data, max_bits, clear), data)
+
+    def testSmallChunks(self):
+        data = self.samples[2]
+        self.assertEqual(self.roundtrip(data, 9, True, chunk_size=1), data)
+
+    def testCorrupt(self):
+        self.assertRaises(IOError, list, lzw_decompress(["\x1f\x8b\x08"]))
+        ## A code past the end of the table
+        self.assertRaises(IOError, list, lzw_decompress([LZW_MAGIC + "\x90" + "\x41\x58\x02"]))
+
+def _read_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    while True:
+        with tracer.stage("read") as counts:
+            chunk = fileobj.read(chunk_size)
+            counts['bytes'] += len(chunk)
+        if not chunk: break
+        yield chunk
+
+def _measure(chunk):
+    return {'bytes': len(chunk)}
+
+def lzw_decompress(chunks):
+    """Decode a stream of Unix `compress` (.Z) data.
+
+    Codes are read in groups of `n_bits` bytes, just as `compress` writes
+    them; whenever the code width grows or the table is cleared, the rest
+    of the current group is padding and is skipped.
+
+    Parameters
+    ----------
+    chunks : iterable of strings
+        Successive pieces of the compressed data, including the header
+
+    Returns
+    -------
+    generator of strings
+        Successive pieces of the decompressed data
+
+    Raises
+    ------
+    IOError
+        If the data isn't in the .Z format or is corrupt.
+
+    """
+    chunks = iter(chunks)
+
+    header = ""
+    while len(header) < 3:
+        try:
+            header += next(chunks)
+        except StopIteration:
+            break
+    if header[:2] != LZW_MAGIC or len(header) < 3:
+        raise IOError("Not in .Z (LZW) format")
+    flags = ord(header[2])
+    max_bits = flags & 0x1f
+    block_mode = bool(flags & 0x80)
+    if max_bits < _INIT_BITS or max_bits > 16:
+        raise IOError("Unsupported .Z code width of %d bits" % max_bits)
+    max_max_code = 1 << max_bits
+    first = 257 if block_mode else 256
+
+    buf, pos = header[3:], 0
+
+    table = [chr(i) for i in xrange(256)] + [""]*(max_max_code - 256)
+    n_bits = _INIT_BITS
+    max_code = (1 << n_bits) - 1
+    mask = (1 << n_bits) - 1
+    free_ent = first
+    prev = None
+
+    out, out_size = [], 0
+    while True:
+        ## As in `compress`, the width grows whenever the table outgrows the
+        ## codes; `max_code` only becomes `max_max_code` when the width
+        ## reaches `max_bits` by growing, so 9-bit streams widen to 10 bits
+        ## once their table fills
+        if free_ent > max_code:
+            n_bits += 1
+            max_code = max_max_code if n_bits == max_bits else (1 << n_bits) - 1
+            mask = (1 << n_bits) - 1
+
+        ## Read the next group of (up to) 8 codes
+        while len(buf) - pos < n_bits:
+            try:
+                more = next(chunks)
+            except StopIteration:
+                break
+            buf, pos = buf[pos:] + more, 0
+        group = buf[pos:pos+n_bits]
+        pos += len(group)
+        n_codes = (len(group) << 3) // n_bits
+        if not n_codes:
+            break
+        value = int(group[::-1].encode("hex"), 16)
+
+        for k in xrange(n_codes):
+            if k and (free_ent > max_code):
+                break
+            code = value & mask
+            value >>= n_bits
+
+            if prev is None:
+                if code >= 256:
+                    raise IOError("Corrupt .Z data")
+                prev = table[code]
+                out.append(prev)
+                out_size += 1
+                continue
+
+            if (code == _CLEAR) and block_mode:
+                n_bits = _INIT_BITS
+                max_code = (1 << n_bits) - 1
+                mask = (1 << n_bits) - 1
+                free_ent = first
+                prev = None
+                break
+
+            if code < free_ent:
+                entry = table[code]
+            elif code == free_ent:
+                entry = prev + prev[0]
+            else:
+                raise IOError("Corrupt .Z data")
+            out.append(entry)
+            out_size += len(entry)
+
+            if free_ent < max_max_code:
+                table[free_ent] = prev + entry[0]
+                free_ent += 1
+            prev = entry
+
+        if out_size >= CHUNK_SIZE:
+            yield "".join(out)
+            out, out_size = [], 0
+
+    if out:
+        yield "".join(out)
+
+def gzip_decompress(chunks):
+    """Decode a stream of gzip data.
+
+    """
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = d.decompress(chunk)
+        if data: yield data
+    data = d.flush()
+    if data: yield data
+
+def decompress(fileobj, chunk_size=CHUNK_SIZE):
+    """Decode a .Z, gzip or plain-text stream, based on its magic number.
+
+    Parameters
+    ----------
+    fileobj : file-like
+        Open (binary) file, or any object with a `read(size)` method such
+        as an HTTP response
+
+    Returns
+    -------
+    generator of strings
+        Successive pieces of the decompressed data
+
+    """
+    chunks = _read_chunks(fileobj, chunk_size)
+    head = ""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 2: break
+
+    def rejoined():
+        if head: yield head
+        for chunk in chunks:
+            yield chunk
+
+    if head[:2] == LZW_MAGIC:
+        return tracer.iterate("decompress", lzw_decompress(rejoined()), _measure)
+    elif head[:2] == GZIP_MAGIC:
+        return tracer.iterate("decompress", gzip_decompress(rejoined()), _measure)
+    return rejoined()
+
+def iter_lines(chunks):
+    """Re-assemble a stream of string pieces into complete lines.
+
+    """
+    partial = ""
+    for chunk in chunks:
+        lines = (partial + chunk).splitlines(True)
+        if lines and not lines[-1].endswith("\n"):
+            partial = lines.pop()
+        else:
+            partial = ""
+        for line in lines:
+            yield line
+    if partial:
+        yield partial
+
+def open_archive(filename):
+    """Iterate over the lines of a (possibly compressed) bulletin on disk.
+
+    Parameters
+    ----------
+    filename : string
+        Path to a .Z, gzip or plain-text bulletin
+
+    Returns
+    -------
+    generator of strings
+        Lines of the decompressed bulletin
+
+    """
+    with open(filename, "rb") as f:
+        for line in iter_lines(decompress(f)):
+            yield line
+
+def decompress_file(src, dst):
+    """Decompress a bulletin on disk into a new file.
+
+    """
+    tmp = dst + ".tmp"
+    with open(src, "rb") as f_in:
+        with open(tmp, "wb") as f_out:
+            for data in decompress(f_in):
+                with tracer.stage("write", bytes=len(data)):
+                    f_out.write(data)
+    os.rename(tmp, dst)
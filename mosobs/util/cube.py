@@ -0,0 +1,392 @@
+"""Dense, labeled arrays of MOS forecasts over a range of dates.
+
+A `MOSCube` holds every requested field of every MOS run for a set of
+stations over a range of dates, aligned on the dimensions
+
+    station x run date x cycle x lead x field
+
+where a "cycle" is a model run of the day (labeled like the keys used by
+`mos.concatenate_MOS`, e.g. "GFS18Z") and the lead is the number of hours
+after the model run that a forecast is valid. `load_mos_range()` builds
+one in a single bulk pass over the archive, rather than opening and
+processing runs one date at a time.
+
+Cubes can be saved to a directory holding one memory-mapped `.npy` file
+per field and a small JSON sidecar with the labels of each dimension.
+Re-opening a saved cube reads only the sidecar; slicing a field then
+touches only the pages of the file which are actually needed.
+
+"""
+from collections import OrderedDict
+import datetime
+import json
+import os
+
+import numpy as np
+
+from download import model_cycles
+from index import load_index, find_runs, read_blocks
+from mos import data_path, archive_pattern, full_model_name
+from data import FIELD_DTYPES
+from parse import parse_blocks, missing_value, missing_mask, FIELDS
+
+DIMS = ["station", "date", "cycle", "lead"]
+
+META_FILENAME = "meta.json"
+CUBE_VERSION = 2
+
+class MOSCube(object):
+    """Dense forecast cube, with one array per field.
+
+    Parameters
+    ----------
+    data : OrderedDict
+        Mapping of each field name to an array with dimensions
+        (station, date, cycle, lead)
+    stations, dates, cycles, leads : array-like
+        Labels along each dimension
+
+    """
+
+    def __init__(self, data, stations, dates, cycles, leads):
+        self.data = OrderedDict(data)
+        self.coords = OrderedDict([ ('station', np.asarray(stations, dtype='S8')),
+                                    ('date', np.asarray(dates, dtype='M8[D]')),
+                                    ('cycle', np.asarray(cycles, dtype='S6')),
+                                    ('lead', np.asarray(leads, dtype='i2')) ])
+
+    @property
+    def fields(self):
+        return list(self.data.keys())
+
+    @property
+    def shape(self):
+        return tuple(len(c) for c in self.coords.values()) + (len(self.data), )
+
+    @property
+    def values(self):
+        """All fields stacked into one (station, date, cycle, lead, field)
+        array of floats, with NaN where missing; this is a copy.
+
+        """
+        return np.stack([self.masked(f).astype('f8').filled(np.nan)
+                         for f in self.data], axis=-1)
+
+    def __getitem__(self, field):
+        return self.data[field]
+
+    def masked(self, field):
+        """One field as a masked array, with its missing values masked.
+
+        """
+        arr = self.data[field]
+        return np.ma.masked_array(arr, mask=missing_mask(field, arr))
+
+    def position(self, dim, label):
+        """Integer position of a label along one of the dimensions.
+
+        """
+        coord = self.coords[dim]
+        if dim == 'date':
+            label = np.datetime64(label, 'D')
+        matches = np.nonzero(coord == label)[0]
+        if not len(matches):
+            raise KeyError("%r not found along %s" % (label, dim))
+        return matches[0]
+
+    def sel(self, field, **labels):
+        """Select from one field by label, e.g.
+
+        >>> cube.sel("X/N", station="KSDF", cycle="GFS18Z", lead=54)
+
+        Dimensions which aren't given a label are returned in full.
+
+        """
+        index = tuple(slice(None) if labels.get(dim) is None else
+                      self.position(dim, labels[dim]) for dim in DIMS)
+        return self.data[field][index]
+
+    def flush(self):
+        """Write any changes to memory-mapped fields back to disk.
+
+        """
+        for arr in self.data.values():
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+def _field_filename(field):
+    # Field names such as "X/N" aren't valid file names
+    return field.replace("/", "_") + ".npy"
+
+def _write_meta(path, fields, stations, dates, cycles, leads):
+    dates = np.asarray(dates, dtype='M8[D]')
+    if len(dates) and not (np.diff(dates).astype('i8') == 1).all():
+        raise ValueError("Saved cubes must span consecutive dates")
+    meta = { 'version': CUBE_VERSION,
+             'fields': [ {'name': f, 'file': _field_filename(f), 'dtype': dtype.str}
+                         for f, dtype in fields ],
+             'station': [str(s) for s in stations],
+             'date': {'start': str(dates[0]) if len(dates) else None,
+                      'count': len(dates)},
+             'cycle': [str(c) for c in cycles],
+             'lead': [int(l) for l in leads] }
+    tmp = os.path.join(path, META_FILENAME + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.rename(tmp, os.path.join(path, META_FILENAME))
+
+def _read_meta(path):
+    with open(os.path.join(path, META_FILENAME)) as f:
+        meta = json.load(f)
+    if meta['version'] != CUBE_VERSION:
+        raise IOError("Unsupported cube version %r in %s" % (meta['version'], path))
+    start, count = meta['date']['start'], meta['date']['count']
+    dates = (np.datetime64(start, 'D') + np.arange(count)) if count else \
+            np.zeros(0, dtype='M8[D]')
+    return meta, (meta['station'], dates, meta['cycle'], meta['lead'])
+
+def create_cube(path, stations, dates, cycles, leads, fields=None):
+    """Create an empty, memory-mapped cube on disk.
+
+    Every field is pre-allocated at full size and filled with missing
+    values, so that it can then be filled in piece by piece (possibly by
+    several processes at once, as long as they write to disjoint slices).
+
+    Parameters
+    ----------
+    path : string
+        Directory in which to store the cube; created if necessary
+    stations, dates, cycles, leads : array-like
+        Labels along each dimension; the dates must be consecutive
+    fields : iterable of strings, optional
+        MOS fields to include; all of `parse.FIELDS` by default
+
+    Returns
+    -------
+    MOSCube
+        Cube whose fields are writable memory maps of the files on disk
+
+    """
+    if fields is None:
+        fields = FIELDS
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    shape = (len(stations), len(dates), len(cycles), len(leads))
+    data = OrderedDict()
+    for field in fields:
+        template = empty_field(field, (1, ))
+        arr = np.lib.format.open_memmap(os.path.join(path, _field_filename(field)),
+                                        mode="w+", dtype=template.dtype, shape=shape)
+        arr[...] = template[0]
+        data[field] = arr
+    _write_meta(path, [(f, a.dtype) for f, a in data.items()],
+                stations, dates, cycles, leads)
+
+    return MOSCube(data, stations, dates, cycles, leads)
+
+def save_cube(cube, path):
+    """Save a cube to disk, with one `.npy` file per field.
+
+    Parameters
+    ----------
+    cube : MOSCube
+        Cube to save; its dates must be consecutive
+    path : string
+        Directory in which to store the cube; created if necessary
+
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for field, arr in cube.data.items():
+        np.save(os.path.join(path, _field_filename(field)), arr)
+    _write_meta(path, [(f, a.dtype) for f, a in cube.data.items()],
+                *cube.coords.values())
+
+def open_cube(path, mode="r", fields=None):
+    """Open a cube saved by `save_cube()` or `create_cube()`.
+
+    Nothing but the sidecar is read up front; each field is a memory map
+    of its file on disk.
+
+    Parameters
+    ----------
+    path : string
+        Directory in which the cube is stored
+    mode : string, optional
+        Memory-map mode; "r" (the default) for read-only access, or "r+"
+        to modify the cube in place
+    fields : iterable of strings, optional
+        Subset of the saved fields to open
+
+    Returns
+    -------
+    MOSCube
+
+    """
+    meta, coords = _read_meta(path)
+    data = OrderedDict()
+    for entry in meta['fields']:
+        if (fields is not None) and (entry['name'] not in fields): continue
+        data[entry['name']] = np.load(os.path.join(path, entry['file']), mmap_mode=mode)
+    return MOSCube(data, *coords)
+
+def empty_field(field, shape):
+    """Allocate a field of the given shape, filled with missing values.
+
+    """
+    return np.full(shape, missing_value(field), dtype=FIELD_DTYPES[field])
+
+def _months(start, end):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+def _read_model_blocks(stations, start, end, model, hours):
+    """Gather the raw blocks for one model, preferring indexed bulletins
+    and falling back on single-run files.
+
+    """
+    entries, blocks = [], []
+    for year, month in _months(start, end):
+        for hour in (hours if model == "GFS" else [0, ]):
+            archive_fn = os.path.join(data_path, archive_pattern[model] %
+                                      {'year': year, 'month': month, 'hour': hour})
+            if os.path.exists(archive_fn):
+                found = find_runs(load_index(archive_fn, model), stations, model,
+                                  start, end + datetime.timedelta(hours=23))
+                found = found[np.in1d(found['run'].astype('M8[h]').astype('i8') % 24, hours)]
+                entries.append(found)
+                continue
+
+            ## No bulletin for this month - look for exploded, single-run files
+            day = max(start, datetime.datetime(year, month, 1))
+            while (day <= end) and (day.month == month):
+                for station in stations:
+                    for h in (hours if model == "NAM" else [hour, ]):
+                        filename = "%s.%02d%02d%4d.%s.%02dZ" % (station, day.month, day.day,
+                                                                day.year, full_model_name[model], h)
+                        full_path = os.path.join(data_path, station, model, filename)
+                        if os.path.exists(full_path):
+                            with open(full_path) as f:
+                                blocks.append(f.readlines())
+                day += datetime.timedelta(days=1)
+
+    if entries:
+        blocks.extend(read_blocks(np.concatenate(entries), data_path))
+    return blocks
+
+def load_mos_range(stations, start, end, models=None, cycles=None, fields=None):
+    """Load every MOS run for a set of stations over a range of dates into
+    a single dense cube.
+
+    For example, to load the GFS 12Z and 18Z max/min forecasts issued at
+    Syracuse and Louisville during January 2009,
+
+    >>> cube = load_mos_range(["KSYR", "KSDF"], datetime.datetime(2009, 1, 1),
+    ...                       datetime.datetime(2009, 1, 31), ["GFS"], [12, 18],
+    ...                       ["X/N"])
+    >>> cube["X/N"].shape
+    (2, 31, 2, 21)
+
+    Runs are read from indexed monthly bulletins (see `mos.get_GFS()` with
+    `explode=False`) when they are available, and otherwise from the
+    single-run files under ``data_path/{STATION}/{MODEL}``. All of the
+    blocks for each model are parsed together in one batch.
+
+    Parameters
+    ----------
+    stations : string or iterable of strings
+        Station identifier code(s)
+    start, end : datetime.datetime
+        First and last (inclusive) dates on which the models were run
+    models : iterable of strings, optional
+        Models to include ("GFS" and/or "NAM"); both by default
+    cycles : iterable of int, optional
+        Hours of the model runs to include; all available by default
+    fields : iterable of strings, optional
+        MOS fields to include; all of `parse.FIELDS` by default
+
+    Returns
+    -------
+    MOSCube
+        Forecasts with dimensions (station, date, cycle, lead, field);
+        runs or leads which are absent are filled with missing values
+
+    """
+    if isinstance(stations, basestring):
+        stations = [stations, ]
+    stations = [s.upper() for s in stations]
+    if models is None:
+        models = ["GFS", "NAM"]
+    if fields is None:
+        fields = FIELDS
+    start = datetime.datetime(start.year, start.month, start.day)
+    end = datetime.datetime(end.year, end.month, end.day)
+
+    dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    cycle_labels, parsed = [], []
+    for model in models:
+        hours = [h for h in model_cycles[model] if (cycles is None) or (h in cycles)]
+        cycle_labels.extend("%s%02dZ" % (model, h) for h in hours)
+        if not hours: continue
+        blocks = _read_model_blocks(stations, start, end, model, hours)
+        parsed.append(parse_blocks(blocks, model))
+
+    ## Union of all the lead times present
+    leads = np.unique(np.concatenate([ [0] ] + [data['lead'].ravel() for _, data in parsed]))
+    leads = leads[leads > 0]
+
+    shape = (len(stations), len(dates), len(cycle_labels), len(leads))
+    cube = MOSCube([ (f, empty_field(f, shape)) for f in fields ],
+                   stations, dates, cycle_labels, leads)
+
+    for runs, data in parsed:
+        scatter_runs(cube, runs, data)
+
+    return cube
+
+def scatter_runs(cube, runs, data):
+    """Write parsed runs into their places in a cube.
+
+    Runs for stations, dates or cycles which aren't in the cube, and
+    leads which aren't among its leads, are skipped.
+
+    Parameters
+    ----------
+    cube : MOSCube
+        Destination, which may be memory-mapped from disk
+    runs, data : numpy.ndarray
+        Parsed runs, as returned by `parse.parse_blocks()`
+
+    Returns
+    -------
+    int
+        Number of runs written
+
+    """
+    if not (len(runs) and len(cube.coords['lead'])):
+        return 0
+    stations, dates = cube.coords['station'], cube.coords['date']
+    cycles, leads = cube.coords['cycle'], cube.coords['lead']
+    station_pos = dict((s, i) for i, s in enumerate(stations))
+    cycle_pos = dict((c, i) for i, c in enumerate(cycles))
+
+    run_days = runs['run'].astype('M8[D]')
+    run_hours = (runs['run'] - run_days).astype('i8')
+    i_station = np.array([station_pos.get(s, -1) for s in runs['station']])
+    i_date = (run_days - dates[0]).astype('i8')
+    i_cycle = np.array([cycle_pos.get("%s%02dZ" % (m, h), -1)
+                        for m, h in zip(runs['model'], run_hours)])
+    keep = (i_station >= 0) & (i_cycle >= 0) & (i_date >= 0) & (i_date < len(dates))
+
+    ## Scatter every (run, lead) value into place at once
+    i_lead = np.searchsorted(leads, data['lead']).clip(0, len(leads) - 1)
+    valid = keep[:, None] & (data['lead'] > 0) & (leads[i_lead] == data['lead'])
+    rows, cols = np.nonzero(valid)
+    index = (i_station[rows], i_date[rows], i_cycle[rows], i_lead[valid])
+    for field in cube.fields:
+        cube.data[field][index] = data[field][valid]
+
+    return int(keep.sum())
@@ -3,6 +3,21 @@ import datetime
 ## Pre-defined flags
 MISSING = 9999
 
+## Compact storage type of each MOS field. Integer fields flag missing
+## values with MISSING where it fits in the type, and with the largest
+## value of the type otherwise (e.g. 255 for uint8).
+FIELD_DTYPES = { 'X/N': 'i2', 'TMP': 'i2', 'DPT': 'i2',
+                 'WDR': 'i1', 'WSP': 'u1',
+                 'P06': 'u1', 'P12': 'u1', 'Q06': 'u1', 'Q12': 'u1',
+                 'POZ': 'u1', 'POS': 'u1',
+                 'CIG': 'u1', 'VIS': 'u1',
+                 'CLD': 'u1', 'OBV': 'u1', 'TYP': 'u1', }
+
+## Labels of categorical MOS fields, stored as their position in the list
+CATEGORIES = { 'CLD': ['CL', 'FW', 'SC', 'BK', 'OV'],
+               'OBV': ['N', 'HZ', 'BR', 'FG', 'BL'],
+               'TYP': ['S', 'Z', 'R'], }
+
 STATIONS = { 'ksdf': 'LOUISVILLE INTERNATIONAL AIRPORT KY US',
              'ksyr': 'SYRACUSE HANCOCK INTERNATIONAL AIRPORT NY US', }
 
@@ -14,7 +29,6 @@ STATION_CODES = { 'khou': 'USC00414333',
                   'kcys': 'USC00481676',
                   'nrmn': 'USC00346382', 
                   'kgrr': 'USC00203337',
-                  'nrmn': 'USC00346382',
                   'kokc': 'USW00013967',
                   'kcon': 'USW00014745',
                   'krdd': 'USW00024257',
@@ -0,0 +1,517 @@
+"""Concurrent, resumable downloading of archived MOS bulletins.
+
+Files are fetched by a bounded pool of worker threads. Each worker keeps
+its HTTP connections alive between requests, streams responses to disk in
+chunks, retries transient failures with exponential backoff, and resumes
+partially downloaded files with a byte-range request.
+
+"""
+import httplib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+from urllib2 import urlopen, HTTPError
+
+from tracing import tracer
+
+MOS_ARCHIVE_URL = "http://www.mdl.nws.noaa.gov/~mos/archives/"
+
+## URL layouts of the monthly bulletins, relative to the archive root
+archive_layout = { 'NAM': "etamet/met%(year)4d%(month)02d.Z",
+                   'GFS': "avnmav/mav%(year)4d%(month)02d.t%(hour)02dz.Z" }
+model_cycles = { 'NAM': [0, 12], 'GFS': [0, 6, 12, 18] }
+
+CHUNK_SIZE = 64*1024
+MAX_REDIRECTS = 5
+
+class _ShortBodyHandler(BaseHTTPRequestHandler):
+    """Serves `body`, but drops the connection after `cutoff` bytes of the
+    first response; later requests may resume with a Range header.
+
+    """
+    body = "".join(chr(i % 256) for i in xrange(1000))
+    cutoff = 100
+    requests = []
+
+    def do_GET(self):
+        rng = self.headers.getheader("range")
+        self.requests.append(rng)
+        start = int(rng.split("=")[1].rstrip("-")) if rng else 0
+        self.send_response(206 if rng else 200)
+        if rng:
+            self.send_header("Content-Range", "bytes %d-%d/%d"
+                             % (start, len(self.body) - 1, len(self.body)))
+        self.send_header("Content-Length", str(len(self.body) - start))
+        self.end_headers()
+        end = self.cutoff if len(self.requests) == 1 else len(self.body)
+        self.wfile.write(self.body[start:end])
+
+    def log_message(self, *args):
+        pass
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+        _ShortBodyHandler.requests = []
+        self.server = HTTPServer(("127.0.0.1", 0), _ShortBodyHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d/mav200901.t00z.Z" % self.server.server_port
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "mav200901.t00z.Z")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def testShortBody(self):
+        ## A truncated download is never promoted to the finished file
+        self.assertRaises(IOError, fetch, self.url, self.filename, retries=0)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(os.path.getsize(self.filename + ".part"), 100)
+
+    def testResume(self):
+        transferred = fetch(self.url, self.filename, retries=1, backoff=0.)
+        self.assertEqual(transferred, 900)
+        self.assertEqual(_ShortBodyHandler.requests, [None, "bytes=100-"])
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), _ShortBodyHandler.body)
+
+class _ArchiveHandler(BaseHTTPRequestHandler):
+    """Serves a stand-in of the archive's `avnmav/` and `etamet/` layouts,
+    keeping connections alive between requests.
+
+    """
+    protocol_version = "HTTP/1.1"
+    missing = set()
+    ## Slow enough that the workers' downloads overlap
+    delay = 0.02
+    requests, connections = [], set()
+
+    @staticmethod
+    def body(path):
+        return "".join("%s %05d\n" % (path, i) for i in xrange(2000))
+
+    def respond(self, send_body):
+        self.connections.add(self.client_address)
+        directory, name = self.path.lstrip("/").split("/", 1)
+        if (directory not in ("avnmav", "etamet")) or (self.path in self.missing):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.body(self.path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        time.sleep(self.delay)
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def log_message(self, *args):
+        pass
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ArchiveDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        _ArchiveHandler.requests, _ArchiveHandler.connections = [], set()
+        self.server = _ThreadingServer(("127.0.0.1", 0), _ArchiveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = "http://127.0.0.1:%d/" % self.server.server_port
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def jobs(self, urls):
+        return [(url, os.path.join(self.path, url.split("/")[-1])) for url in urls]
+
+    def testLayouts(self):
+        urls = archive_urls("GFS", [2009], [1, 2], base_url=self.base_url)
+        self.assertEqual(len(urls), 8)
+        self.assertEqual(urls[1], self.base_url + "avnmav/mav200901.t06z.Z")
+        self.assertEqual(archive_urls("NAM", [2009], [1], base_url=self.base_url),
+                         [self.base_url + "etamet/met200901.Z"])
+
+    def testDownloadFiles(self):
+        urls = archive_urls("GFS", [2009], range(1, 7), base_url=self.base_url) + \
+               archive_urls("NAM", [2009], range(1, 7), base_url=self.base_url)
+        missing = "/avnmav/mav200903.t12z.Z"
+        _ArchiveHandler.missing = set([missing])
+        jobs = self.jobs(urls)
+        results = download_files(jobs, workers=4, print_progress=False)
+
+        for (url, filename), result in zip(jobs, results):
+            path = "/" + url[len(self.base_url):]
+            if path == missing:
+                self.assertTrue(isinstance(result, HTTPError))
+                self.assertEqual(result.code, 404)
+                self.assertFalse(os.path.exists(filename))
+            else:
+                self.assertTrue(result is None)
+                with open(filename) as f:
+                    self.assertEqual(f.read(), _ArchiveHandler.body(path))
+        self.assertEqual(sorted(_ArchiveHandler.requests),
+                         sorted("/" + url[len(self.base_url):] for url in urls))
+        ## The workers download concurrently, each keeping its connection
+        ## alive across its downloads
+        self.assertTrue(1 < len(_ArchiveHandler.connections) <= 4)
+        self.assertTrue(len(_ArchiveHandler.connections) < len(urls))
+
+    def testHeadReusesConnection(self):
+        pool = ConnectionPool()
+        url = archive_urls("NAM", [2009], [1], base_url=self.base_url)[0]
+        info = head(url, pool)
+        fetch(url, os.path.join(self.path, "met200901.Z"), pool)
+        self.assertEqual(info['size'], len(_ArchiveHandler.body("/etamet/met200901.Z")))
+        self.assertEqual(len(_ArchiveHandler.connections), 1)
+
+def archive_urls(model, years, months=None, base_url=MOS_ARCHIVE_URL):
+    """List the URLs of the monthly bulletins for a model.
+
+    Parameters
+    ----------
+    model : string
+        Model name, either "GFS" or "NAM"
+    years : iterable of int
+        The calendar years of data
+    months : iterable of int, optional
+        The calendar months of data; all of them by default
+    base_url : string, optional
+        Root of the archive, which can be pointed at a mirror
+
+    Returns
+    -------
+    list of strings
+        One URL per bulletin, in chronological order
+
+    """
+    # NAM bulletins hold every cycle, so only one is listed per month
+    cycles = model_cycles[model] if model == "GFS" else [0, ]
+    if months is None:
+        months = range(1, 13)
+    urls = []
+    for year in years:
+        for month in months:
+            for hour in cycles:
+                urls.append(base_url + archive_layout[model] %
+                            {'year': year, 'month': month, 'hour': hour})
+    return urls
+
+class ConnectionPool(object):
+    """Per-thread cache of persistent HTTP connections, keyed by host.
+
+    """
+
+    def __init__(self, timeout=60.):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections
+
+    def get(self, scheme, netloc):
+        connections = self._connections()
+        key = (scheme, netloc)
+        if key not in connections:
+            cls = httplib.HTTPSConnection if scheme == "https" else httplib.HTTPConnection
+            connections[key] = cls(netloc, timeout=self.timeout)
+        return connections[key]
+
+    def discard(self, scheme, netloc):
+        conn = self._connections().pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+def head(url, pool=None):
+    """Look up the size and version of a remote file without downloading it.
+
+    Parameters
+    ----------
+    url : string
+        HTTP(S) location of the file
+    pool : ConnectionPool, optional
+        Source of re-usable connections
+
+    Returns
+    -------
+    dict or None
+        The `size` (in bytes), `etag` and `modified` time reported by the
+        server, each `None` if it wasn't reported; `None` for URLs which
+        aren't HTTP(S), whose metadata can't be looked up
+
+    Raises
+    ------
+    HTTPError
+        If the server reports an error, such as the file not existing.
+
+    """
+    if urlparse.urlsplit(url).scheme not in ("http", "https"):
+        return None
+    if pool is None:
+        pool = ConnectionPool()
+
+    target = url
+    for _ in xrange(MAX_REDIRECTS + 1):
+        scheme, netloc, path, query, _ = urlparse.urlsplit(target)
+        if query: path += "?" + query
+        conn = pool.get(scheme, netloc)
+        try:
+            conn.request("HEAD", path)
+            resp = conn.getresponse()
+            resp.read()
+        except (IOError, socket.error, httplib.HTTPException):
+            pool.discard(scheme, netloc)
+            raise
+        if resp.status in (301, 302, 303, 307, 308):
+            target = urlparse.urljoin(target, resp.getheader("location"))
+            continue
+        break
+
+    if resp.status != 200:
+        raise HTTPError(url, resp.status, resp.reason, resp.msg, None)
+    size = resp.getheader("content-length")
+    return { 'size': int(size) if size is not None else None,
+             'etag': resp.getheader("etag"),
+             'modified': resp.getheader("last-modified") }
+
+def _content_total(resp):
+    """Total size of the file from the Content-Range header of a response,
+    e.g. "bytes 100-999/1000" or "bytes */1000"; `None` if it isn't known.
+
+    """
+    content_range = resp.getheader("content-range")
+    if content_range is None:
+        return None
+    total = content_range.rsplit("/", 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+def _expected_size(resp, offset):
+    """Size the partial file should have once the body of a 200 or 206
+    response has been written to it; `None` if the server didn't say.
+
+    """
+    if resp.status == 206:
+        total = _content_total(resp)
+        if total is not None:
+            return total
+    length = resp.getheader("content-length")
+    if length is None:
+        return None
+    return int(length) + (offset if resp.status == 206 else 0)
+
+def fetch(url, local_filename, pool=None, retries=3, backoff=1.):
+    """Download a single file, resuming any earlier partial download.
+
+    Data is streamed to `local_filename + ".part"`, which is renamed to
+    `local_filename` only once it is complete. If a partial file is left
+    over from an earlier attempt, only the remaining bytes are requested.
+
+    Parameters
+    ----------
+    url : string
+        HTTP(S) location of the file
+    local_filename : string
+        Where to save the file
+    pool : ConnectionPool, optional
+        Source of re-usable connections
+    retries : int, optional
+        Number of times to retry after a transient failure
+    backoff : float, optional
+        Delay (in seconds) before the first retry, doubled for each
+        subsequent one
+
+    Returns
+    -------
+    int
+        Number of bytes transferred
+
+    Raises
+    ------
+    HTTPError
+        If the server reports an error which isn't worth retrying (such
+        as the file not existing), or keeps reporting a server error.
+    IOError, socket.error, httplib.HTTPException
+        If the connection keeps failing after all the retries.
+
+    """
+    if pool is None:
+        pool = ConnectionPool()
+    part_filename = local_filename + ".part"
+
+    with tracer.stage("download", files=1) as counts:
+        for attempt in xrange(retries + 1):
+            target, redirects = url, 0
+            try:
+                while True:
+                    scheme, netloc, path, query, _ = urlparse.urlsplit(target)
+                    if query: path += "?" + query
+
+                    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+                    headers = {}
+                    if offset:
+                        headers['Range'] = "bytes=%d-" % offset
+
+                    conn = pool.get(scheme, netloc)
+                    conn.request("GET", path, headers=headers)
+                    resp = conn.getresponse()
+
+                    if resp.status in (301, 302, 303, 307, 308) and redirects < MAX_REDIRECTS:
+                        resp.read()
+                        target = urlparse.urljoin(target, resp.getheader("location"))
+                        redirects += 1
+                        continue
+                    break
+
+                if resp.status == 416:
+                    # Nothing left to fetch; the partial file should already be
+                    # complete, unless it's longer than the file itself
+                    resp.read()
+                    transferred = 0
+                    total = _content_total(resp)
+                    if (total is not None) and (total != offset):
+                        os.remove(part_filename)
+                        raise IOError("%s: partial file is %d bytes, but the file is %d"
+                                      % (url, offset, total))
+                elif resp.status in (200, 206):
+                    mode = "ab" if resp.status == 206 else "wb"
+                    transferred = 0
+                    with open(part_filename, mode) as f:
+                        while True:
+                            chunk = resp.read(CHUNK_SIZE)
+                            if not chunk: break
+                            f.write(chunk)
+                            transferred += len(chunk)
+                    counts['bytes'] += transferred
+                    if resp.getheader("connection", "").lower() == "close":
+                        pool.discard(scheme, netloc)
+
+                    # httplib returns short reads silently if the connection
+                    # drops, so check that the whole file arrived before
+                    # trusting it; the retry will resume from where it stopped
+                    expected = _expected_size(resp, offset)
+                    received = os.path.getsize(part_filename)
+                    if (expected is not None) and (received != expected):
+                        raise IOError("%s: received %d of %d bytes"
+                                      % (url, received, expected))
+                else:
+                    resp.read()
+                    error = HTTPError(url, resp.status, resp.reason, resp.msg, None)
+                    if (resp.status < 500) or (attempt == retries):
+                        raise error
+                    # Server-side errors are usually transient, so try again
+                    raise IOError(str(error))
+
+                os.rename(part_filename, local_filename)
+                return transferred
+
+            except HTTPError:
+                raise
+            except (IOError, socket.error, httplib.HTTPException):
+                pool.discard(scheme, netloc)
+                if attempt == retries:
+                    raise
+                counts['retries'] += 1
+                time.sleep(backoff * 2**attempt)
+
+def download_files(jobs, workers=4, retries=3, backoff=1., print_progress=True):
+    """Download many files concurrently.
+
+    Parameters
+    ----------
+    jobs : iterable of (string, string)
+        URL of each file, and where to save it
+    workers : int, optional
+        Number of files to download simultaneously
+    retries, backoff : optional
+        Passed to `fetch()`
+    print_progress : boolean, optional
+        Print each URL as its download finishes
+
+    Returns
+    -------
+    list of Exception or None
+        For each job, in order, the error which stopped it being
+        downloaded, or `None` if it was downloaded successfully
+
+    """
+    jobs = list(jobs)
+    results = [None, ]*len(jobs)
+    pool = ConnectionPool()
+    queue = Queue()
+    for i, job in enumerate(jobs):
+        queue.put((i, job))
+
+    def worker():
+        while True:
+            i, job = queue.get()
+            if job is None:
+                break
+            url, local_filename = job
+            try:
+                fetch(url, local_filename, pool, retries, backoff)
+                if print_progress: print url, "done"
+            except Exception, e:
+                if print_progress: print url, "...failed (%s)" % e
+                results[i] = e
+
+    threads = [threading.Thread(target=worker) for _ in xrange(max(1, workers))]
+    for t in threads:
+        queue.put((None, None))
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
+def download_file(url, local_filename):
+    """Convenience utility for downloading and saving a file to disk.
+
+    The file is streamed to disk in chunks rather than read into memory.
+    HTTP(S) downloads are retried and resumed as in `fetch()`; other
+    schemes (such as FTP) are read in a single attempt.
+
+    """
+    print "downloading " + url,
+    if urlparse.urlsplit(url).scheme in ("http", "https"):
+        fetch(url, local_filename)
+        return
+
+    with tracer.stage("download", files=1) as counts:
+        f = urlopen(url)
+        try:
+            with open(local_filename, "wb") as local_file:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk: break
+                    local_file.write(chunk)
+                    counts['bytes'] += len(chunk)
+        finally:
+            f.close()
@@ -0,0 +1,193 @@
+"""Bulk ingest of GHCN-Daily observations from local copies of the archive.
+
+`obs.fetch_OBS()` downloads one station's .dly file at a time, and only
+for stations with a hand-mapped entry in `data.STATION_CODES`. Here,
+observations for any number of stations are instead streamed out of
+either of the bulk distributions of the archive,
+
+- `ghcnd_all.tar.gz`, holding one .dly file per station, or
+- the by-year files (e.g. `2009.csv.gz`), holding one line per station,
+  day and element,
+
+and saved to each station's observation store (see `obs.save_obs()`).
+Both are read as streams in a single pass, and nothing is extracted to
+disk. Station and element filters are applied before anything is
+decoded, and only one station (from the tarball) or one year (from the
+by-year files) of the selected observations is held in memory at once.
+
+"""
+import gzip
+import os
+import tarfile
+
+import numpy as np
+
+import obs
+from obs import parse_dly_lines, save_obs, load_obs, DLY_CONVERSIONS, OBS_ELEMENTS, \
+                OBS_META_FILENAME
+
+GHCND_ID_LENGTH = 11
+
+def station_codes(stations):
+    """Map stations to their GHCN-Daily identifiers.
+
+    Parameters
+    ----------
+    stations : iterable of strings
+        Station identifiers; GHCN-Daily identifiers (e.g. "USW00014745")
+        are kept as they are, and anything else is translated with
+        `obs.code_from_station()`
+
+    Returns
+    -------
+    dict
+        The station of each GHCN-Daily identifier
+
+    """
+    codes = {}
+    for station in stations:
+        code = station if len(station) == GHCND_ID_LENGTH else obs.code_from_station(station)
+        codes[code] = station
+    return codes
+
+def _obs_path(station, path):
+    return os.path.join(obs.data_path if path is None else path, station, "OBS")
+
+def ingest_tarball(filename, stations, elements=OBS_ELEMENTS, path=None):
+    """Save the observations of a set of stations from `ghcnd_all.tar.gz`.
+
+    The tarball is read as a stream; the .dly files of other stations are
+    skipped over without being decoded.
+
+    Parameters
+    ----------
+    filename : string
+        Local copy of the tarball (gzipped, or not)
+    stations : iterable of strings
+        Stations to ingest (see `station_codes()`)
+    elements : iterable of strings, optional
+        Elements to keep
+    path : string, optional
+        Data directory in which to save the observations; `obs.data_path`
+        by default
+
+    Returns
+    -------
+    list of strings
+        Stations which were found in the tarball, in the order they were
+        saved
+
+    """
+    codes = station_codes(stations)
+    saved = []
+    with tarfile.open(filename, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile(): continue
+            name = os.path.basename(member.name)
+            code, ext = os.path.splitext(name)
+            if (ext != ".dly") or (code not in codes): continue
+
+            f = tar.extractfile(member)
+            records = parse_dly_lines(f.read().splitlines(), elements)
+            station = codes[code]
+            save_obs(_obs_path(station, path), records)
+            saved.append(station)
+    return saved
+
+def _parse_year_lines(lines, elements):
+    """Decode the (station, element)-grouped lines of a by-year file.
+
+    """
+    fields = [l.split(",") for l in lines]
+    dates = np.array(["%s-%s-%s" % (f[1][:4], f[1][4:6], f[1][6:8]) for f in fields],
+                     dtype='M8[D]')
+    values = np.array([f[3] for f in fields], dtype='f8')
+    flags = np.array(["%1s%1s%1s" % tuple(f[4:7]) for f in fields], dtype='S3')
+    element_ids = np.array([f[2] for f in fields], dtype='S4')
+
+    records = {}
+    for element in elements:
+        rows = element_ids == element
+        element_values = values[rows]
+        if element in DLY_CONVERSIONS:
+            element_values = DLY_CONVERSIONS[element](element_values)
+        records[element] = (dates[rows], element_values, flags[rows])
+    return records
+
+def _merge_records(path, records):
+    """Add records to those already in a station's observation store,
+    replacing any on the same dates.
+
+    """
+    if not os.path.exists(os.path.join(path, OBS_META_FILENAME)):
+        return records
+
+    columns = load_obs(path)
+    merged = {}
+    for element in set(records) | set(c for c in columns if c != 't' and
+                                      not c.endswith("_flags")):
+        parts = []
+        if element in columns:
+            kept = ~np.isnan(columns[element]) | (columns[element + "_flags"] != "   ")
+            parts.append((columns['t'][kept], columns[element][kept],
+                          columns[element + "_flags"][kept]))
+        if element in records:
+            parts.append(records[element])
+        t, values, flags = [np.concatenate(p) for p in zip(*parts)]
+
+        ## Keep the last (newest) record of each date
+        _, last = np.unique(t[::-1], return_index=True)
+        last = len(t) - 1 - last
+        merged[element] = (t[last], values[last], flags[last])
+    return merged
+
+def ingest_by_year(filenames, stations, elements=OBS_ELEMENTS, path=None):
+    """Add the observations of a set of stations from by-year files.
+
+    Each file is streamed through line by line, and only the lines of the
+    requested stations and elements are decoded. After each file, the
+    observations of each station are merged into its store, replacing any
+    already there on the same dates, so a year can be (re-)ingested on its
+    own.
+
+    Parameters
+    ----------
+    filenames : iterable of strings
+        Local copies of the by-year files (e.g. "2009.csv.gz"), gzipped
+        or not
+    stations : iterable of strings
+        Stations to ingest (see `station_codes()`)
+    elements : iterable of strings, optional
+        Elements to keep
+    path : string, optional
+        Data directory in which to save the observations; `obs.data_path`
+        by default
+
+    Returns
+    -------
+    dict
+        Number of observations added for each station
+
+    """
+    codes = station_codes(stations)
+    wanted = set(elements)
+    counts = dict((station, 0) for station in codes.values())
+
+    for filename in filenames:
+        opener = gzip.open if filename.endswith(".gz") else open
+        ## Lines of each station, e.g. "USW00014745,20090101,TMAX,-56,,,W,2400"
+        lines = dict((code, []) for code in codes)
+        with opener(filename, "rb") as f:
+            for line in f:
+                selected = lines.get(line[:11])
+                if (selected is not None) and (line[21:25] in wanted):
+                    selected.append(line.rstrip())
+
+        for code, station_lines in lines.iteritems():
+            if not station_lines: continue
+            station = codes[code]
+            station_path = _obs_path(station, path)
+            records = _parse_year_lines(station_lines, elements)
+            save_obs(station_path, _merge_records(station_path, records))
+            counts[station] += len(station_lines)
+    return counts
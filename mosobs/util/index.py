@@ -0,0 +1,193 @@
+"""Byte-offset indices over monthly MOS bulletins.
+
+Rather than exploding each monthly bulletin into one file per station per
+run, the uncompressed bulletin is kept on disk and a small index mapping
+(station, model, run) to (archive, byte offset, length) is built once and
+saved alongside it. Any single forecast block can then be recovered with
+one seek and read.
+
+"""
+import mmap
+import os
+import re
+
+import numpy as np
+
+from tracing import tracer
+
+## Record layout for each indexed forecast block
+INDEX_DTYPE = np.dtype([ ('station', 'S8'), ('model', 'S3'), ('run', 'M8[h]'),
+                         ('archive', 'S24'), ('offset', 'i8'), ('length', 'i4') ])
+
+## Matches the header line which begins each forecast block
+HEADER_RE = re.compile(r"^ *(\w+) +\w+ MOS GUIDANCE +(\d+)/(\d+)/(\d+) +(\d\d)\d\d UTC",
+                       re.MULTILINE)
+
+_loaded = {}
+
+def index_filename(archive_fn):
+    """Name of the index file saved alongside a bulletin.
+
+    """
+    return archive_fn + ".idx.npy"
+
+@tracer.traced("index")
+def build_index(archive_fn, model):
+    """Index every forecast block in an uncompressed monthly bulletin.
+
+    The bulletin is memory-mapped and scanned once for block headers;
+    each block runs from its header to the header of the next block (or
+    the end of the file).
+
+    Parameters
+    ----------
+    archive_fn : string
+        Path to the uncompressed bulletin, e.g. `data_arch/met200901`
+    model : string
+        Model whose MOS guidance is contained in the bulletin
+
+    Returns
+    -------
+    numpy.ndarray
+        Index records, with dtype `INDEX_DTYPE`, in file order
+
+    """
+    size = os.path.getsize(archive_fn)
+    if size == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+    with open(archive_fn, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            headers = [(m.start(), m.groups()) for m in HEADER_RE.finditer(buf)]
+        finally:
+            buf.close()
+
+    index = np.zeros(len(headers), dtype=INDEX_DTYPE)
+    if not headers:
+        return index
+
+    offsets = np.array([start for start, _ in headers], dtype='i8')
+    index['station'] = [groups[0] for _, groups in headers]
+    index['model'] = model
+    index['run'] = ["%04d-%02d-%02dT%s" % (int(year), int(month), int(day), hour)
+                    for _, (_, month, day, year, hour) in headers]
+    index['archive'] = os.path.basename(archive_fn)
+    index['offset'] = offsets
+    index['length'] = np.diff(np.append(offsets, size))
+
+    return index
+
+def save_index(index, archive_fn):
+    """Write an index next to the bulletin it describes.
+
+    """
+    with tracer.stage("write", bytes=index.nbytes):
+        np.save(index_filename(archive_fn), index)
+
+def load_index(archive_fn, model):
+    """Load the index for a bulletin, (re-)building it if necessary.
+
+    The index is rebuilt whenever it is missing or older than the
+    bulletin, and indices which have already been read are re-used.
+
+    Parameters
+    ----------
+    archive_fn : string
+        Path to the uncompressed bulletin
+    model : string
+        Model whose MOS guidance is contained in the bulletin
+
+    Returns
+    -------
+    numpy.ndarray
+        Index records, with dtype `INDEX_DTYPE`
+
+    """
+    idx_fn = index_filename(archive_fn)
+    archive_mtime = os.path.getmtime(archive_fn)
+
+    if (not os.path.exists(idx_fn)) or (os.path.getmtime(idx_fn) < archive_mtime):
+        index = build_index(archive_fn, model)
+        save_index(index, archive_fn)
+    else:
+        key = (os.path.abspath(idx_fn), os.path.getmtime(idx_fn))
+        if key in _loaded:
+            return _loaded[key]
+        index = np.load(idx_fn)
+
+    _loaded[(os.path.abspath(idx_fn), os.path.getmtime(idx_fn))] = index
+    return index
+
+def find_runs(index, stations=None, models=None, start=None, end=None):
+    """Select the entries of an index matching the given criteria.
+
+    Parameters
+    ----------
+    index : numpy.ndarray
+        Index records, such as those returned by `load_index()`
+    stations, models : iterable of strings, optional
+        Station identifier codes and models to keep
+    start, end : datetime.datetime, optional
+        Inclusive bounds on the model run times to keep
+
+    Returns
+    -------
+    numpy.ndarray
+        Matching index records, sorted by run time and then station
+
+    """
+    keep = np.ones(len(index), dtype=bool)
+    if stations is not None:
+        if isinstance(stations, basestring): stations = [stations, ]
+        keep &= np.in1d(index['station'], [s.upper() for s in stations])
+    if models is not None:
+        if isinstance(models, basestring): models = [models, ]
+        keep &= np.in1d(index['model'], list(models))
+    if start is not None:
+        keep &= index['run'] >= np.datetime64(start, 'h')
+    if end is not None:
+        keep &= index['run'] <= np.datetime64(end, 'h')
+
+    found = index[keep]
+    return found[np.argsort(found, order=['run', 'station', 'model'])]
+
+def read_blocks(entries, archive_dir, use_mmap=False):
+    """Read the raw lines of indexed forecast blocks.
+
+    Each archive is opened only once, and each block is read with a
+    single seek and read (or sliced out of a memory map).
+
+    Parameters
+    ----------
+    entries : numpy.ndarray
+        Index records of the blocks to read
+    archive_dir : string
+        Directory containing the bulletins named in `entries`
+    use_mmap : boolean, optional
+        Memory-map each archive instead of seeking through it
+
+    Returns
+    -------
+    list of lists of strings
+        Lines of each forecast block, in the same order as `entries`
+
+    """
+    blocks = [None, ]*len(entries)
+    archives = np.unique(entries['archive'])
+    for archive in archives:
+        which = np.nonzero(entries['archive'] == archive)[0]
+        with open(os.path.join(archive_dir, archive), "rb") as f:
+            if use_mmap:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for i in which:
+                        offset, length = entries['offset'][i], entries['length'][i]
+                        blocks[i] = buf[offset:offset+length].splitlines(True)
+                finally:
+                    buf.close()
+            else:
+                for i in which:
+                    f.seek(entries['offset'][i])
+                    blocks[i] = f.read(entries['length'][i]).splitlines(True)
+    return blocks
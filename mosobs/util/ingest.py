@@ -0,0 +1,143 @@
+"""Parallel ingest of archived MOS runs into a cube on disk.
+
+Re-ingesting years of bulletins for many stations is dominated by
+parsing, which runs on a single core in `cube.load_mos_range()`. Here the
+work is split into one task per monthly bulletin and spread across a pool
+of processes. The output cube is created up front, with fixed labels
+along every dimension, and each worker writes the runs it parses straight
+into the memory-mapped fields on disk - no forecasts are sent back to the
+parent process. Every task fills a disjoint set of (date, cycle) slices,
+so the output is identical no matter how many workers are used or in
+which order the tasks finish.
+
+"""
+import datetime
+import multiprocessing
+
+import numpy as np
+
+from cube import create_cube, open_cube, scatter_runs, _months, _read_model_blocks
+from download import model_cycles
+from parse import parse_blocks, FIELDS
+
+## Lead times (in hours) of the MAV and MET guidance - every 3 hours out
+## to 60 hours, and then every 6 hours out to 72 hours
+MOS_LEADS = range(6, 61, 3) + [66, 72]
+
+def ingest_tasks(start, end, models=None, cycles=None):
+    """List the per-bulletin tasks covering a range of model run dates.
+
+    Returns
+    -------
+    list of tuples
+        (model, first date, last date, cycle hours) of each task, in
+        chronological order for each model
+
+    """
+    if models is None:
+        models = ["GFS", "NAM"]
+    tasks = []
+    for model in models:
+        hours = [h for h in model_cycles[model] if (cycles is None) or (h in cycles)]
+        if not hours: continue
+        ## Each GFS bulletin holds a single cycle, each NAM bulletin all of them
+        groups = [[h, ] for h in hours] if model == "GFS" else [hours, ]
+        for year, month in _months(start, end):
+            first = max(start, datetime.datetime(year, month, 1))
+            next_month = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+            last = min(end, next_month - datetime.timedelta(days=1))
+            for group in groups:
+                tasks.append((model, first, last, group))
+    return tasks
+
+def _ingest_task(args):
+    """Parse one bulletin's worth of runs and write them into the cube.
+
+    """
+    path, stations, fields, (model, first, last, hours) = args
+    cube = open_cube(path, mode="r+", fields=fields)
+    blocks = _read_model_blocks(stations, first, last, model, hours)
+    runs, data = parse_blocks(blocks, model)
+    written = scatter_runs(cube, runs, data)
+    cube.flush()
+    return written
+
+def ingest(path, stations, start, end, models=None, cycles=None,
+           fields=None, leads=MOS_LEADS, workers=None):
+    """Parse every MOS run for a set of stations over a range of dates into
+    a cube saved on disk, using a pool of processes.
+
+    For example, to re-ingest all of 2009 for three stations on 8 cores,
+
+    >>> counts = ingest("store/2009", ["KSYR", "KSDF", "KAUS"],
+    ...                 datetime.datetime(2009, 1, 1),
+    ...                 datetime.datetime(2009, 12, 31), workers=8)
+    >>> cube = open_cube("store/2009")
+
+    Runs are read just as in `cube.load_mos_range()`, from indexed monthly
+    bulletins or single-run files under `mos.data_path`.
+
+    Parameters
+    ----------
+    path : string
+        Directory in which to create the cube; an existing cube there is
+        overwritten
+    stations : string or iterable of strings
+        Station identifier code(s)
+    start, end : datetime.datetime
+        First and last (inclusive) dates on which the models were run
+    models : iterable of strings, optional
+        Models to include ("GFS" and/or "NAM"); both by default
+    cycles : iterable of int, optional
+        Hours of the model runs to include; all of them by default
+    fields : iterable of strings, optional
+        MOS fields to include; all of `parse.FIELDS` by default
+    leads : iterable of int, optional
+        Lead times to keep; since the cube is allocated before anything is
+        parsed, these can't be discovered from the data
+    workers : int, optional
+        Number of processes; by default, one per CPU. With a single
+        worker, everything is done in the calling process.
+
+    Returns
+    -------
+    list of (tuple, int)
+        Each task (see `ingest_tasks()`), in order, and the number of runs
+        it wrote
+
+    """
+    if isinstance(stations, basestring):
+        stations = [stations, ]
+    stations = [s.upper() for s in stations]
+    if models is None:
+        models = ["GFS", "NAM"]
+    if fields is None:
+        fields = FIELDS
+    start = datetime.datetime(start.year, start.month, start.day)
+    end = datetime.datetime(end.year, end.month, end.day)
+
+    dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    cycle_labels = ["%s%02dZ" % (model, h) for model in models
+                    for h in model_cycles[model] if (cycles is None) or (h in cycles)]
+    cube = create_cube(path, stations, dates, cycle_labels, sorted(leads), fields)
+    cube.flush()
+    del cube
+
+    tasks = ingest_tasks(start, end, models, cycles)
+    args = [(path, stations, fields, task) for task in tasks]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        counts = map(_ingest_task, args)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            ## map() hands back results in task order, whatever order the
+            ## tasks actually finish in
+            counts = pool.map(_ingest_task, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return zip(tasks, counts)
@@ -0,0 +1,150 @@
+"""Bookkeeping for incremental synchronization of the MOS archive.
+
+A manifest, saved as JSON in the data directory, records for each monthly
+bulletin where it came from, the size, ETag and checksum of the copy on
+disk, which stations have been extracted from it and how many runs were
+written. It is re-written after every step of processing a
+bulletin, so an interrupted backfill can tell exactly which months are
+finished and which need to be (re-)processed.
+
+"""
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+## Stages of processing a bulletin, in order
+DOWNLOADED, EXTRACTING, COMPLETE = "downloaded", "extracting", "complete"
+
+def file_checksum(filename, chunk_size=1024*1024):
+    """SHA-1 checksum of a file, read in chunks.
+
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk: break
+            h.update(chunk)
+    return h.hexdigest()
+
+class Manifest(object):
+    """Record of the bulletins which have been downloaded and processed.
+
+    Entries are keyed by the file name of each bulletin, and are plain
+    dictionaries holding
+
+    - `url`: where the bulletin was downloaded from
+    - `size`, `etag`, `modified`: as reported by the server (see
+      `download.head()`), used to detect bulletins which have changed
+    - `checksum`: SHA-1 of the bulletin on disk
+    - `status`: one of `DOWNLOADED`, `EXTRACTING` or `COMPLETE`
+    - `stations`: station identifiers whose runs have been written to
+      their own files, or `None` if every station's have
+    - `runs`: number of runs written to their own files
+    - `indexed`: number of runs in the bulletin's index, if it has been
+      indexed instead (see `index.build_index()`)
+    - `updated`: when the entry was last changed
+
+    Parameters
+    ----------
+    path : string
+        Data directory holding the bulletins and the manifest
+
+    """
+
+    def __init__(self, path):
+        self.filename = os.path.join(path, MANIFEST_FILENAME)
+        self.entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                saved = json.load(f)
+            if saved.get('version') == MANIFEST_VERSION:
+                self.entries = saved['entries']
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def update(self, name, **fields):
+        """Change (or create) the entry for a bulletin, and checkpoint the
+        manifest to disk.
+
+        """
+        entry = self.entries.setdefault(name, {})
+        entry.update(fields)
+        entry['updated'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.save()
+        return entry
+
+    def remove(self, name):
+        if self.entries.pop(name, None) is not None:
+            self.save()
+
+    def save(self):
+        """Write the manifest to disk atomically.
+
+        """
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump({ 'version': MANIFEST_VERSION, 'entries': self.entries },
+                      f, indent=1, sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def is_current(self, name, remote=None, stations=None, indexed=False):
+        """Check whether a bulletin has already been fully processed.
+
+        Parameters
+        ----------
+        name : string
+            File name of the bulletin
+        remote : dict, optional
+            Metadata of the bulletin on the server (see `download.head()`);
+            if given, the bulletin is only current if it hasn't changed
+        stations : iterable of strings, optional
+            Stations which should have been extracted; by default, every
+            station
+        indexed : boolean, optional
+            Check that the bulletin has been indexed, rather than that
+            the stations have been extracted
+
+        """
+        entry = self.entries.get(name)
+        if (entry is None) or (entry['status'] != COMPLETE):
+            return False
+        if self.changed(name, remote):
+            return False
+        if indexed:
+            return bool(entry.get('indexed'))
+        if entry['stations'] is None:
+            return True
+        return stations is not None and set(stations) <= set(entry['stations'])
+
+    def verify(self, name, filename):
+        """Check a local copy of a bulletin against the checksum on record;
+        copies with no checksum on record are taken on trust.
+
+        """
+        entry = self.entries.get(name)
+        if (entry is None) or not entry.get('checksum'):
+            return True
+        return file_checksum(filename) == entry['checksum']
+
+    def changed(self, name, remote):
+        """Check whether the server reports a different version of a bulletin
+        than the one on record.
+
+        """
+        entry = self.entries.get(name)
+        if (entry is None) or (remote is None):
+            return False
+        for key in ['etag', 'size', 'modified']:
+            if (remote.get(key) is not None) and (entry.get(key) is not None) \
+               and (remote[key] != entry[key]):
+                return True
+        return False
@@ -4,22 +4,65 @@
 
 from collections import OrderedDict
 import datetime
+import httplib
 import itertools
 import os
 import re
-import subprocess
+import socket
 import sys
-from urllib2 import urlopen, HTTPError
+import unittest
 
 import numpy as np
 import pandas as pd
 
+from cache import MOSCache
+from compress import open_archive, decompress_file
+from download import (MOS_ARCHIVE_URL, ConnectionPool, archive_urls, head,
+                      download_file, download_files)
+from index import build_index, save_index, load_index, find_runs, read_blocks
+from manifest import Manifest, file_checksum, DOWNLOADED, EXTRACTING, COMPLETE
+from tracing import tracer
+
 full_model_name = { 'NAM': "NAM-MET", "GFS": "GFS-MAV" }
 months = {"JAN":1, "FEB":2, "MAR":3, "APR":4, "MAY":5, "JUNE":6,
           "JULY":7, "AUG":8, "SEPT":9, "OCT":10, "NOV":11,
           "DEC":12}
 
 data_path = "data_arch/"
+archive_url = MOS_ARCHIVE_URL
+
+## Names of the uncompressed monthly bulletins in the MDL archive
+archive_pattern = { 'NAM': "met%(year)4d%(month)02d",
+                    'GFS': "mav%(year)4d%(month)02d.t%(hour)02dz" }
+
+class ProcessMOSSummaryTest(unittest.TestCase):
+    """`process_MOS_summary()` should agree with `process_MOS()`."""
+
+    def setUp(self):
+        ## The synthetic bulletin generator lives with the benchmarks
+        benchmarks = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                                  "benchmarks")
+        if benchmarks not in sys.path:
+            sys.path.insert(0, benchmarks)
+        import synthetic
+        self.synthetic = synthetic
+
+    def check(self, model, runs):
+        for station in ["KSYR", "KSDF"]:
+            for run in runs:
+                block = self.synthetic.mos_block(station, run, model)
+                df, summary = process_MOS(block), process_MOS_summary(block)
+                self.assertEqual(summary.meta, df.meta)
+                self.assertEqual(summary.maxmins.items(), df.maxmins.items())
+                self.assertEqual([(pd.Timestamp(k), v) for k, v in summary.precip.items()],
+                                 [(pd.Timestamp(k), v) for k, v in df.precip.items()])
+
+    def testMAV(self):
+        self.check("GFS", [datetime.datetime(2009, 1, 1, h) for h in [0, 6, 12, 18]] +
+                          [datetime.datetime(2008, 12, 31, 18)])
+
+    def testMET(self):
+        self.check("NAM", [datetime.datetime(2009, 2, 28, h) for h in [0, 12]])
 
 def reporthook(a,b,c):
     """Custom download progress bar.
@@ -32,33 +75,99 @@ def reporthook(a,b,c):
     #                 % (min(100, float(a * b) / c * 100), c)
     sys.stdout.flush()
 
+def station_blocks(mos_lines, stations=None, model="GFS"):
+    """Split a compilation of MOS data into per-station blocks in one pass.
+
+    Walks the lines of a monthly MOS bulletin exactly once, and yields
+    each forecast block belonging to one of the requested stations as
+    soon as the header of the following block (or the end of the
+    bulletin) is reached.
+
+    Parameters
+    ----------
+    mos_lines : iterable of strings
+        Lines of a MOS bulletin; an open file works just as well
+    stations : string or iterable of strings, optional
+        Station identifier code(s) to keep; if not provided, the blocks
+        for every station in the bulletin are returned
+    model : string, optional
+        Model whose MOS guidance is contained in the bulletin
+
+    Returns
+    -------
+    generator of (string, list of strings)
+        Station identifier and lines of each forecast block
+
+    """
+    return tracer.iterate("split", _iter_blocks(mos_lines, stations, model), blocks=1)
+
+def _iter_blocks(mos_lines, stations, model):
+    if isinstance(stations, basestring):
+        stations = [stations, ]
+    if stations is not None:
+        stations = set(s.upper() for s in stations)
+    marker = "%s MOS GUIDANCE" % model
+
+    station_id, block = None, None
+    for line in mos_lines:
+        if marker in line:
+            if block is not None:
+                yield station_id, block
+            station_id = line.split()[0]
+            if (stations is None) or (station_id in stations):
+                block = [line, ]
+            else:
+                block = None
+        elif block is not None:
+            block.append(line)
+    if block is not None:
+        yield station_id, block
+
 def station_headers(mos_file, station_id, model="GFS"):
     """Seek forward from block to block in compilation of MOS data.
 
     """
-    lines = mos_file.readlines()
-    for i, line in enumerate(lines):
-        if station_id in line:
-            # seek forward to find end of station data
-            for i_end in xrange(i+1, i+30):
-                if "%s MOS GUIDANCE" % model in lines[i_end]: break
-            yield lines[i:i_end]
+    for _, mos_lines in station_blocks(mos_file, station_id, model):
+        yield mos_lines
+
+def _split_archive(archive_fn, stations, model):
+    """Write each block of a monthly MOS bulletin to its own file.
 
-def download_file(url, local_filename):
-    """Convenience utility for downloading and saving a file to disk.
+    All of the requested stations are extracted in the same pass over the
+    bulletin, into ``data_path/{STATION}/{MODEL}``. The bulletin may be
+    compressed, in which case it is decompressed on the fly. Returns the
+    number of blocks written.
 
     """
-    print "downloading " + url,
-    f = urlopen(url)
-    with open(local_filename, "wb") as local_file:
-        local_file.write(f.read())
+    created, written = set(), 0
+    for station_id, mos_lines in station_blocks(open_archive(archive_fn), stations, model):
+        _, _, _, _, run_date, run_time, _ = mos_lines[0].split()
+        fcst_time = int(run_time)/100
+        rd_month, rd_day, rd_year = map(int, run_date.split("/"))
+        mos_filename = "%s.%02d%02d%4d.%s.%02dZ" % (station_id, rd_month, rd_day, rd_year,
+                                                   full_model_name[model], fcst_time)
+
+        full_path = os.path.join(data_path, station_id, model)
+        if full_path not in created:
+            if not os.path.exists(full_path):
+                print "Creating", full_path
+                os.makedirs(full_path)
+            created.add(full_path)
+
+        print mos_filename
+        with tracer.stage("write", runs=1, bytes=sum(len(l) for l in mos_lines)):
+            with open(os.path.join(full_path, mos_filename), 'wb') as new_f:
+                new_f.writelines(mos_lines)
+        written += 1
+    return written
 
-def get_NAM(station, years):
+def get_NAM(stations, years, explode=True, workers=4, sync=False):
     """Download NAM MOS output.
 
     Queries the NWS MDL to download NAM MOS output (00Z and 12Z) 
-    for a given station over a specified range of years, and saves 
-    single-block outputs of each forecast locally. 
+    for a given set of stations over a specified range of years, and saves 
+    single-block outputs of each forecast locally. Each monthly bulletin
+    is read only once, no matter how many stations are requested.
 
     For example, to download all the NAM MOS forecasts from 2009 for
     Lousville's Standiford Field forecast location, one can execute 
@@ -74,10 +183,22 @@ def get_NAM(station, years):
 
     Parameters
     ----------
-    station : string
-        Station identifier code
+    stations : string or iterable of strings
+        Station identifier code(s); pass `None` to extract every station
+        in the bulletins
     years : iterable of int
         The calendar years of data to download
+    explode : boolean, optional
+        Write each forecast block to its own file (default); otherwise,
+        keep the uncompressed bulletins in `data_path` and index them for
+        use with `read_run()`
+    workers : int, optional
+        Number of bulletins to download simultaneously
+    sync : boolean, optional
+        Ask the server whether bulletins which have already been processed
+        have changed, and fetch and process any that have again. Either
+        way, months which the manifest in `data_path` records as finished
+        are skipped, so an interrupted download resumes where it stopped.
 
     Raises
     ------
@@ -85,59 +206,20 @@ def get_NAM(station, years):
         If the requested data could not be downloaded.
 
     """
-    print "Downloading MOS data for", station
-    #years = range(2009, 2012)
-    months = range(1, 13)
-
-    for (year, month) in itertools.product(years, months):
-        link = "http://www.mdl.nws.noaa.gov/~mos/archives/etamet/met%4d%02d.Z" % (year, month)
-        print link
-        ## Download file
-        temp_file_name = link.split("/")[-1]
-
-        full_path = os.path.join(data_path, station, "NAM")
-        ## Make the path to store the data
-        if not os.path.exists(full_path):
-            print "Creating", full_path
-            os.makedirs(full_path)
-        full_fn = os.path.join(data_path, temp_file_name)
-
-        if not os.path.exists(full_fn):
-            try:
-                download_file(link, full_fn)
-                print "done"
-            except HTTPError, e:
-                print "...resource not found. Skipping."
-                continue
-
-            ## Uncompress file
-            subprocess.call(["uncompress", full_fn])
-        uncomp_fn = full_fn[:-2] # trim the ".Z"
+    if isinstance(stations, basestring):
+        stations = [stations, ]
+    print "Downloading MOS data for", \
+        "all stations" if stations is None else ", ".join(stations)
 
-        f = open(uncomp_fn)
+    _fetch_archives("NAM", years, stations, explode, workers, sync)
 
-        sh = station_headers(f, station, "NAM")
-        for mos_lines in sh:
-
-            station_id, _, _, _, run_date, run_time, _ = mos_lines[0].split()
-            fcst_time = int(run_time)/100
-            rd_month, rd_day, rd_year = map(int, run_date.split("/"))
-            mos_filename = "%s.%02d%02d%4d.NAM-MET.%02dZ" % (station_id, rd_month, rd_day, rd_year, fcst_time)
-
-            print mos_filename
-            new_f = open("data_arch/%s/NAM/%s" % (station_id, mos_filename), 'wb')
-            new_f.writelines(mos_lines)
-            new_f.close()
-
-        f.close()
-        os.remove(uncomp_fn)
-
-def get_GFS(station, years):    
+def get_GFS(stations, years, explode=True, workers=4, sync=False):    
     """Download GFS MOS output.
 
     Queries the NWS MDL to download GFS MOS output (00Z, 06Z, 12Z, 18Z) 
-    for a given station over a specified range of years, and saves 
-    single-block outputs of each forecast locally. 
+    for a given set of stations over a specified range of years, and saves 
+    single-block outputs of each forecast locally. Each monthly bulletin
+    is read only once, no matter how many stations are requested.
 
     For example, to download all the NAM MOS forecasts from 2009 for
     Lousville's Standiford Field forecast location, one can execute 
@@ -153,10 +235,22 @@ def get_GFS(station, years):
 
     Parameters
     ----------
-    station : string
-        Station identifier code
+    stations : string or iterable of strings
+        Station identifier code(s); pass `None` to extract every station
+        in the bulletins
     years : iterable of int
         The calendar years of data to download
+    explode : boolean, optional
+        Write each forecast block to its own file (default); otherwise,
+        keep the uncompressed bulletins in `data_path` and index them for
+        use with `read_run()`
+    workers : int, optional
+        Number of bulletins to download simultaneously
+    sync : boolean, optional
+        Ask the server whether bulletins which have already been processed
+        have changed, and fetch and process any that have again. Either
+        way, months which the manifest in `data_path` records as finished
+        are skipped, so an interrupted download resumes where it stopped.
 
     Raises
     ------
@@ -164,54 +258,175 @@ def get_GFS(station, years):
         If the requested data could not be downloaded.
 
     """
-    print "Downloading MOS data for", station
-    months = range(1, 13)
+    if isinstance(stations, basestring):
+        stations = [stations, ]
+    print "Downloading MOS data for", \
+        "all stations" if stations is None else ", ".join(stations)
 
-    for (year, month) in itertools.product(years, months):
-        for fcst_time in [0, 6, 12, 18]:
-            ## 18Z
-            link = "http://www.mdl.nws.noaa.gov/~mos/archives/avnmav/mav%4d%02d.t%02dz.Z" % (year, month, fcst_time)
+    _fetch_archives("GFS", years, stations, explode, workers, sync)
 
-            print link
-            ## Download file
-            temp_file_name = link.split("/")[-1]
+def _local_copy(full_fn):
+    """The local copy of a bulletin - compressed if it's still around,
+    otherwise uncompressed - or `None` if there isn't one.
 
-            ## Make the path to store the data
-            full_path = os.path.join(data_path, station, "GFS")
-            if not os.path.exists(full_path):
-                print "Creating", full_path
-                os.makedirs(full_path)
-            full_fn = os.path.join(data_path, temp_file_name)
+    """
+    for fn in [full_fn, full_fn[:-2]]:
+        if os.path.exists(fn):
+            return fn
+    return None
+
+def _fetch_archives(model, years, stations, explode, workers, sync=False):
+    """Download (concurrently) and then split or index the monthly
+    bulletins for a model.
+
+    Progress is checkpointed to the manifest in `data_path` after every
+    step, and bulletins which the manifest shows to be fully processed
+    (for all of the requested stations) are skipped. With `sync`, the
+    server is also asked whether each bulletin has changed since it was
+    downloaded, and changed bulletins are fetched and processed again.
 
-            if not os.path.exists(full_fn):
-                try:
-                    download_file(link, full_fn)
-                    print "done"
-                except HTTPError, e:
-                    print "...resource not found. Skipping."
-                    continue
+    """
+    if not os.path.exists(data_path):
+        print "Creating", data_path
+        os.makedirs(data_path)
+    manifest = Manifest(data_path)
+    if stations is not None:
+        stations = [s.upper() for s in stations]
+
+    links = archive_urls(model, years, base_url=archive_url)
+    full_fns = [os.path.join(data_path, link.split("/")[-1]) for link in links]
+
+    remote = dict((link, None) for link in links)
+    if sync:
+        pool = ConnectionPool()
+        for link, full_fn in zip(links, full_fns):
+            name = os.path.basename(full_fn)
+            try:
+                remote[link] = head(link, pool)
+            except (IOError, socket.error, httplib.HTTPException):
+                continue
+            if manifest.changed(name, remote[link]):
+                print link, "has changed; fetching it again"
+                for fn in [full_fn, full_fn + ".part", full_fn[:-2]]:
+                    if os.path.exists(fn): os.remove(fn)
+                manifest.remove(name)
+
+    ## Local copies which don't match their checksum (e.g. corrupted, or
+    ## replaced by hand) can't be trusted, so they're fetched again
+    for full_fn in full_fns:
+        name = os.path.basename(full_fn)
+        local_fn = _local_copy(full_fn)
+        if (name in manifest) and (local_fn is not None) \
+           and not manifest.verify(name, local_fn):
+            print local_fn, "doesn't match its checksum; fetching it again"
+            for fn in [full_fn, full_fn + ".part", full_fn[:-2]]:
+                if os.path.exists(fn): os.remove(fn)
+            manifest.remove(name)
+
+    todo = [(link, full_fn) for link, full_fn in zip(links, full_fns)
+            if not manifest.is_current(os.path.basename(full_fn), remote[link],
+                                       stations, indexed=not explode)]
+
+    ## Download everything we don't already have in one go
+    jobs = [(link, full_fn) for link, full_fn in todo
+            if not (os.path.exists(full_fn) or os.path.exists(full_fn[:-2]))]
+    download_files(jobs, workers)
+
+    for link, full_fn in todo:
+        print link
+        name = os.path.basename(full_fn)
+        uncomp_fn = full_fn[:-2] # trim the ".Z"
+        if not (os.path.exists(full_fn) or os.path.exists(uncomp_fn)):
+            print "...resource not found. Skipping."
+            continue
 
+        entry = manifest.get(name)
+        if entry is None:
+            info = remote[link] or {}
+            entry = manifest.update(name, url=link, status=DOWNLOADED,
+                                    size=info.get('size'), etag=info.get('etag'),
+                                    modified=info.get('modified'),
+                                    checksum=file_checksum(_local_copy(full_fn)),
+                                    stations=[], runs=0, indexed=0)
+
+        if explode:
+            ## Only extract the stations which haven't been already. The
+            ## stations on record were finished by an earlier pass, even if
+            ## a later one was interrupted; only the rest are (re-)extracted
+            done = entry.get('stations')
+            if stations is None:
+                done, new_stations, runs = set(), None, 0
+            elif done is None:
+                ## Every station has already been extracted
+                new_stations, runs = [], entry['runs']
+            else:
+                done = set(done)
+                new_stations = [s for s in stations if s not in done]
+                runs = entry['runs']
+            manifest.update(name, status=EXTRACTING)
+
+            ## Stream straight from the compressed bulletin
+            archive_fn = uncomp_fn if os.path.exists(uncomp_fn) else full_fn
+            if (new_stations is None) or new_stations:
+                runs += _split_archive(archive_fn, new_stations, model)
+            extracted = None if (stations is None) or (done is None) \
+                        else sorted(done | set(stations))
+        else:
+            manifest.update(name, status=EXTRACTING)
+            if not os.path.exists(uncomp_fn):
                 ## Uncompress file
-                subprocess.call(["uncompress", full_fn])
-            uncomp_fn = full_fn[:-2] # trim the ".Z"
+                decompress_file(full_fn, uncomp_fn)
+                os.remove(full_fn)
+                ## The uncompressed bulletin is the local copy from now on
+                manifest.update(name, checksum=file_checksum(uncomp_fn))
+            index = build_index(uncomp_fn, model)
+            save_index(index, uncomp_fn)
+            manifest.update(name, status=COMPLETE, indexed=len(index))
+            continue
 
-            f = open(uncomp_fn)
+        manifest.update(name, status=COMPLETE, stations=extracted, runs=runs)
 
-            sh = station_headers(f, station, "GFS")
-            for mos_lines in sh:
+def read_run(station, model, run, use_mmap=False):
+    """Read a single forecast block from an indexed monthly bulletin.
 
-                station_id, _, _, _, run_date, run_time, _ = mos_lines[0].split()
-                rd_month, rd_day, rd_year = map(int, run_date.split("/"))
-                mos_filename = "%s.%02d%02d%4d.GFS-MAV.%02dZ" % (station_id, rd_month, rd_day, rd_year, fcst_time)
+    This is the counterpart to `get_NAM()`/`get_GFS()` with 
+    `explode=False`; the block is located through the bulletin's index
+    and read with a single seek, rather than from its own file.
 
-                print mos_filename
-                new_f = open("data_arch/%s/GFS/%s" % (station_id, mos_filename), 'wb')
-                new_f.writelines(mos_lines)
-                new_f.close()
+    >>> lines = read_run("KSDF", "GFS", datetime.datetime(2009, 1, 1, 18))
+    >>> df = process_MOS(lines)
 
-            f.close()
-            os.remove(uncomp_fn)
+    Parameters
+    ----------
+    station : string
+        Station identifier code
+    model : string
+        Model name, either "GFS" or "NAM"
+    run : datetime.datetime
+        Model initialization time
+    use_mmap : boolean, optional
+        Read the block from a memory map of the bulletin
+
+    Returns
+    -------
+    list of strings
+        Individual lines comprising the MOS block forecast
 
+    Raises
+    ------
+    KeyError
+        If the run is not present in the bulletin's index
+
+    """
+    archive_fn = os.path.join(data_path,
+                              archive_pattern[model] % {'year': run.year, 'month': run.month,
+                                                         'hour': run.hour})
+    entries = find_runs(load_index(archive_fn, model), station, model, run, run)
+    if not len(entries):
+        raise KeyError("No %s run for %s at %s" % (model, station, run))
+    return read_blocks(entries[:1], data_path, use_mmap)[0]
+
+@tracer.traced("parse", blocks=1)
 def process_MOS(lines):
     """Process a block of MOS output.
 
@@ -355,6 +570,154 @@ def process_MOS(lines):
 
     return df
 
+class MOSSummary(object):
+    """Day 1 and Day 2 max/min and 12-hour precipitation forecasts from a
+    single MOS block, without the rest of the 3-hourly forecast.
+
+    The attributes `meta`, `maxmins` and `precip` are identical to those
+    attached to the DataFrame produced by `process_MOS()`.
+
+    """
+    __slots__ = ("meta", "maxmins", "precip")
+
+    def __init__(self, meta, maxmins, precip):
+        self.meta, self.maxmins, self.precip = meta, maxmins, precip
+
+    def __getstate__(self):
+        return self.meta, self.maxmins, self.precip
+
+    def __setstate__(self, state):
+        self.meta, self.maxmins, self.precip = state
+
+@tracer.traced("parse", blocks=1)
+def process_MOS_summary(lines):
+    """Extract only the max/min and 12-hour precipitation forecasts from a
+    block of MOS output.
+
+    This is a lightweight alternative to `process_MOS()` for when only the
+    `maxmins` and `precip` attributes are needed. Just the header, the
+    forecast dates and hours, and the X/N (or N/X), P12 and Q12 rows are
+    decoded, and no DataFrame is built.
+
+    Parameters
+    ----------
+    lines : list of strings
+        Individual lines comprising a MOS block forecast
+
+    Returns
+    -------
+    MOSSummary
+        Max/min and precipitation forecasts
+
+    """
+    # Line 1 - header info
+    station_id, _, _, _, run_date, run_time, _ = lines[0].split()
+    month, day, year = map(int, run_date.split("/"))
+    hour = int(run_time)/100
+    fcst_datetime = datetime.datetime(year, month, day, hour)
+    meta = {'station': station_id, 'run': fcst_datetime}
+
+    # Line 2/3 - first forecast date, and forecast hours
+    first_month, first_day = lines[1].split("/")[1].split()
+    hours_line = lines[2].strip()
+    forecast_hours = map(int, hours_line.split()[1:])
+    line_length = len(hours_line)
+
+    minmax, rows = [], {}
+    for line in lines[3:]:
+        name = line.lstrip()[:3]
+        if name in ["X/N", "N/X"]:
+            minmax = [int(d) for d in line.split()[1:]]
+        elif name in ["P12", "Q12"]:
+            line = line.strip().ljust(line_length)
+            rows[name] = [line[i:i+3] for i in xrange(4, line_length, 3)]
+
+    # Calendar days spanned by the forecast, and the valid time of each column
+    if (month == 12) and (day == 31) and (fcst_datetime.hour == 18):
+        current_year = fcst_datetime.year + 1
+    else:
+        current_year = fcst_datetime.year
+    cd = datetime.datetime(current_year, months[first_month], int(first_day))
+    cds, timestamps = [cd, ], []
+    for i, fcst_hour in enumerate(forecast_hours):
+        if (i != 0) and (fcst_hour == 0):
+            cd += datetime.timedelta(days=1)
+            cds.append(cd)
+        timestamps.append(cd + datetime.timedelta(hours=fcst_hour))
+
+    maxmins = OrderedDict()
+    if fcst_datetime.hour < 12:
+        day0, day1, day2, day3 = cds
+        maxmins[day0] = {'TMAX': minmax[0]}
+        maxmins[day1] = {'TMIN': minmax[1], 'TMAX': minmax[2]}
+        maxmins[day2] = {'TMIN': minmax[3], 'TMAX': minmax[4]}
+    else:
+        if fcst_datetime.hour == 12: day0, day1, day2, day3 = cds
+        if fcst_datetime.hour == 18: day1, day2, day3 = cds
+        maxmins[day1] = {'TMIN': minmax[0], 'TMAX': minmax[1]}
+        maxmins[day2] = {'TMIN': minmax[2], 'TMAX': minmax[3]}
+        maxmins[day3] = {'TMIN': minmax[4]}
+
+    ## 12hr POP/QPF forecasts, shifted to the *beginning* of their interval
+    twelve_hours = datetime.timedelta(hours=12)
+    periods = [(t - twelve_hours, float(q), float(p))
+               for t, q, p in zip(timestamps, rows.get("Q12", []), rows.get("P12", []))
+               if q.strip() and p.strip()]
+    # Only grab the Day 1 and beyond values
+    if fcst_datetime.hour < 12: periods = periods[1:]
+    precip = OrderedDict()
+    for first in [0, 2]:
+        precip[periods[first][0]] = { "Q12": [periods[first][1], periods[first+1][1]],
+                                      "P12": [periods[first][2], periods[first+1][2]] }
+
+    return MOSSummary(meta, maxmins, precip)
+
+## Parsed forecasts are memoized on the path and modification time of the
+## file they came from; replace with a new MOSCache to change its size or
+## to add an on-disk tier
+mos_cache = MOSCache(process_MOS)
+summary_cache = MOSCache(process_MOS_summary)
+
+def load_MOS(filename):
+    """Read and process the MOS block in a file, re-using the result from
+    any previous call for the same (unmodified) file.
+
+    .. note:: Repeated calls return the same DataFrame, which should
+        therefore not be modified in place.
+
+    Parameters
+    ----------
+    filename : string
+        Path to a single-block MOS file, such as those written by
+        `get_NAM()` and `get_GFS()`
+
+    Returns
+    -------
+    pandas.DataFrame
+        MOS forecast, as produced by `process_MOS()`
+
+    """
+    return mos_cache.load(filename)
+
+def load_MOS_summary(filename):
+    """Read only the max/min and precipitation forecasts from the MOS block
+    in a file, re-using the result from any previous call for the same
+    (unmodified) file.
+
+    Parameters
+    ----------
+    filename : string
+        Path to a single-block MOS file
+
+    Returns
+    -------
+    MOSSummary
+        Max/min and precipitation forecasts, as produced by
+        `process_MOS_summary()`
+
+    """
+    return summary_cache.load(filename)
+
 def concatenate_MOS(station, forecast_date, gfs=True, nam=True, print_debug=False):
     """ Concatenate MOS forecasts from GFS and NAM corresponding to
     a given forecast date.
@@ -381,8 +744,50 @@ def concatenate_MOS(station, forecast_date, gfs=True, nam=True, print_debug=Fals
     Returns
     -------
     pandas.DataFrame
-        Aligned MOS forecasts
+        Aligned MOS forecasts, with a column for each (run, field) pair
+        such as ("GFS18Z", "TMP")
+    dict
+        The processed MOS forecast of each run, keyed by the run name
+
+    Raises
+    ------
+    ValueError
+        If none of the requested runs could be found
+
+    .. note:: To align many forecast dates at once, use
+        `cube.load_mos_range()` instead.
         
+    """
+    all_mos = {}
+    for fcst_name, full_path in _run_files(station, forecast_date, gfs, nam, print_debug):
+        all_mos[fcst_name] = load_MOS(full_path)
+    
+    ## (pandas.Panel is deprecated, so stack the runs side-by-side instead)
+    mos_frame = pd.concat(all_mos, axis=1)
+    
+    return mos_frame, all_mos
+
+def summarize_MOS(station, forecast_date, gfs=True, nam=True, print_debug=False):
+    """Collect the max/min and precipitation forecasts from the GFS and NAM
+    runs corresponding to a given forecast date.
+
+    This reads the same runs as `concatenate_MOS()`, but only decodes
+    their `maxmins` and `precip`, which is several times faster.
+
+    Returns
+    -------
+    dict
+        The `MOSSummary` of each run found, keyed by the run name (such
+        as "GFS18Z")
+
+    """
+    return dict((fcst_name, load_MOS_summary(full_path)) for fcst_name, full_path
+                in _run_files(station, forecast_date, gfs, nam, print_debug))
+
+def _run_files(station, forecast_date, gfs=True, nam=True, print_debug=False):
+    """Find the single-run files for the model runs made on the day before
+    a forecast date.
+
     """
     mos_pattern = "%s.%02d%02d%4d.%s.%02dZ" # station, mm, dd, yyyy, model, hh
     one_day = datetime.timedelta(days=1)
@@ -396,9 +801,7 @@ def concatenate_MOS(station, forecast_date, gfs=True, nam=True, print_debug=Fals
     if gfs: models.append("GFS")
     if nam: models.append("NAM")
     
-    combos = itertools.product(hours, models)
-    all_mos = {}
-    for hour, model in combos:
+    for hour, model in itertools.product(hours, models):
         filename = mos_pattern % (station, md.month, md.day, md.year,
                                   full_model_name[model], hour)
         if print_debug:
@@ -410,17 +813,10 @@ def concatenate_MOS(station, forecast_date, gfs=True, nam=True, print_debug=Fals
                 print "   could not find file; skipping"
             continue
             
-        model_fcst_date = datetime.datetime(md.year, md.month, md.day, hour)
-        with open(full_path, 'r') as f:
-            proc_mos = process_MOS(f.readlines())
-        
-        fcst_name = "%s%02dZ" % (model, hour)
-        all_mos[fcst_name] = proc_mos
-    
-    mos_panel = pd.Panel(all_mos)
-    
-    return mos_panel, all_mos
+        yield "%s%02dZ" % (model, hour), full_path
 
 if __name__ == "__main__":
-    lines = open("data_arch/KAUS/GFS/KAUS.01012009.GFS-MAV.18Z", "r").readlines()
+    ## Process a single-run file, e.g. data_arch/KAUS/GFS/KAUS.01012009.GFS-MAV.18Z;
+    ## see benchmarks/synthetic.py to generate some offline
+    lines = open(sys.argv[1], "r").readlines()
     df = process_MOS(lines)
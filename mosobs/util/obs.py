@@ -1,25 +1,129 @@
 import os, sys
+import json
+from collections import OrderedDict
 from urllib2 import HTTPError
 
 import pandas as pd
 import numpy as np
 
-from data import STATION_CODES, ONE_DAY
+from data import ONE_DAY
 from mos import download_file, data_path
+from parse import decode_numeric
+from stations import ghcnd_code
+from verify import Verification
+
+## Layout of a GHCN-Daily (.dly) record: the header, followed by 31 days
+## of (value, measurement flag, quality flag, source flag)
+DLY_HEADER = 21
+DLY_DAY_WIDTH = 8
+DLY_WIDTH = DLY_HEADER + 31*DLY_DAY_WIDTH
+DLY_MISSING = -9999
+
+## Conversions from the archived units (tenths of a degree C, tenths of a
+## mm) of each element we keep
+DLY_CONVERSIONS = { 'TMAX': lambda v: v*0.1*(9./5.) + 32., # to deg F
+                    'TMIN': lambda v: v*0.1*(9./5.) + 32., # to deg F
+                    'PRCP': lambda v: v*0.1, }              # to mm
+
+OBS_ELEMENTS = ['TMAX', 'TMIN', 'PRCP']
+
+## Each station's observations are stored as one .npy file per column -
+## the dates, and the value and flags of each element - aligned on a
+## single, consecutive daily index, with a small JSON sidecar
+OBS_META_FILENAME = "obs.json"
+OBS_VERSION = 1
+
+def _decode_digits(chars):
+    values = np.zeros(chars.shape[:-1], dtype='i8')
+    for i in xrange(chars.shape[-1]):
+        values = values*10 + (chars[..., i].astype('i8') - ord("0"))
+    return values
+
+def parse_dly(filename, elements=None):
+    """Read the daily records of a station from a GHCN-Daily (.dly) file.
+
+    The fixed-width records are loaded into a single array of characters,
+    and the value and flags of every day of every record are sliced out
+    of it at once; days which don't exist (e.g. February 30) are dropped
+    using `datetime64` arithmetic.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the .dly file
+    elements : iterable of strings, optional
+        Elements to read; by default, those in `DLY_CONVERSIONS`
+
+    Returns
+    -------
+    dict
+        For each element, a tuple of arrays holding the date (as a
+        `datetime64`), the value (converted with `DLY_CONVERSIONS`, and NaN
+        where missing), and the 3-character flags of each day, in the
+        order they appear in the file
 
+    """
+    with open(filename, "rb") as f:
+        return parse_dly_lines(f.read().splitlines(), elements)
+
+def parse_dly_lines(lines, elements=None):
+    """Decode the records (lines, without line endings) of a .dly file, e.g.
+    as read out of an archive without extracting it (see `ghcnd.py`).
 
+    Takes the same `elements` and returns the same records as
+    `parse_dly()`.
+
+    """
+    if elements is None:
+        elements = DLY_CONVERSIONS.keys()
+
+    ## Only the records of the requested elements are decoded
+    wanted = set(elements)
+    lines = [l for l in lines if l[17:21] in wanted]
+    records = np.array(lines, dtype='S%d' % DLY_WIDTH)
+    chars = np.full((len(records), DLY_WIDTH), ord(" "), dtype='u1')
+    if len(records):
+        chars[:] = np.frombuffer(records.tostring(), dtype='u1').reshape(len(records), DLY_WIDTH)
+        chars[chars == 0] = ord(" ")
+
+    element_ids = np.ascontiguousarray(chars[:, 17:21]).view('S4')[:, 0]
+    years = _decode_digits(chars[:, 11:15])
+    months = _decode_digits(chars[:, 15:17])
+
+    ## The first of each record's month, and the number of days in it
+    first = ((years - 1970)*12 + months - 1).astype('M8[M]')
+    ndays = ((first + 1).astype('M8[D]') - first.astype('M8[D]')).astype('i8')
+    days = np.arange(31)
+
+    cells = chars[:, DLY_HEADER:].reshape(len(records), 31, DLY_DAY_WIDTH)
+    result = {}
+    for element in elements:
+        rows = np.nonzero(element_ids == element)[0]
+        valid = days[None, :] < ndays[rows, None]
+
+        dates = first[rows, None].astype('M8[D]') + days[None, :]
+        values = decode_numeric(cells[rows, :, :5])
+        values[values == DLY_MISSING] = np.nan
+        if element in DLY_CONVERSIONS:
+            values = DLY_CONVERSIONS[element](values)
+        flags = np.ascontiguousarray(cells[rows, :, 5:]).view('S3')[..., 0]
+
+        result[element] = (dates[valid], values[valid], flags[valid])
+    return result
 
 def code_from_station(station):
-    # translate 4 letter station id to hcn code
-    return STATION_CODES[station.lower()]
+    # translate 4 letter station id to hcn code, pairing stations which
+    # aren't hand-mapped with the closest one in the station registry
+    return ghcnd_code(station, data_path)
 
 def fetch_OBS(station, update='True'):
     '''Script for downloading the observations for the station and 
     archiving them in a subdirctory of the data_path defined by the 
     other utils.
     
-    ATMo only works for stations who have an ID translation in the 
-    STATION_CODES dictionary'''
+    Stations without an ID translation in the STATION_CODES dictionary
+    are paired with the closest GHCN-Daily station, using the station
+    lists in data_path (see stations.load_registry)'''
     
     print "Downloading OBS data for", station
     station_code = code_from_station(station) # switching ID systems
@@ -41,64 +145,210 @@ def fetch_OBS(station, update='True'):
         except HTTPError:
             print "...resource not found. Skipping."
 
-    f = open(full_fn)
-    
     ## Put data in archivable format
-    obs_data = {'TMAX':{'t':[],'data':[], 'flags':[]},
-                'TMIN':{'t':[],'data':[], 'flags':[]},
-                'PRCP':{'t':[],'data':[], 'flags':[]}
-                }
-    for line in f.readlines():
-        yyyy = line[11:15] #file formatted particularly by text line, column
-        mm = line[15:17]
-        var_id = line[17:21]
-        if var_id in obs_data.keys():
-            rest = line[21:]
-            for d in range(31):
-                try: 
-                    dt = pd.datetime(int(yyyy),int(mm),int(d+1))
-                except ValueError:
-                    break
-                obs_data[var_id]['t'].append(dt)   
-                
-                if var_id in ['TMAX', 'TMIN']:
-                    datum = float(rest[d*8:d*8+5])
-                    if datum == -9999.:
-                        obs_data[var_id]['data'].append(np.nan)
-                    else:
-                        # to deg C
-                        obs_data[var_id]['data'].append(datum*0.1*(9./5.)+32.)
-                elif var_id == 'PRCP':
-                    datum = float(rest[d*8:d*8+5])
-                    if datum == -9999.:
-                        obs_data[var_id]['data'].append(np.nan)
-                    else:
-                        # to mm
-                        obs_data[var_id]['data'].append(datum*0.1)
-                obs_data[var_id]['flags'].append(rest[d*8+5:d*8+8])
-    f.close()
-    
-    ## archive data by variable ID
-    for var_id in obs_data:
-        df = pd.DataFrame(obs_data[var_id])
-        df.to_csv(os.path.join(full_path,'%s.csv') %(var_id) )
+    records = parse_dly(full_fn, OBS_ELEMENTS)
+    save_obs(full_path, records)
+
+def _column_filename(column):
+    return column + ".npy"
+
+def save_obs(path, records):
+    """Save a station's daily observations, aligned on one daily index.
 
+    Every element is spread out over the consecutive days from the first
+    to the last one observed (of any element), with NaN values and blank
+    flags on the days it wasn't. Each column is written as its own `.npy`
+    file, so that it can be loaded (or memory-mapped) without any parsing.
 
-def get_OBS(station, variable_id):
+    Parameters
+    ----------
+    path : string
+        Directory in which to store the observations; created if necessary
+    records : dict
+        Dates, values and flags of each element, as returned by
+        `parse_dly()`
+
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    observed = [t for t, _, _ in records.values() if len(t)]
+    if observed:
+        start = min(t.min() for t in observed)
+        count = int((max(t.max() for t in observed) - start).astype('i8')) + 1
+    else:
+        start, count = None, 0
+    dates = (start + np.arange(count)) if count else np.zeros(0, dtype='M8[D]')
+
+    columns = OrderedDict([ ('t', dates) ])
+    for element in sorted(records):
+        t, values, flags = records[element]
+        days = (t - start).astype('i8') if count else np.zeros(0, dtype='i8')
+        columns[element] = np.full(count, np.nan, dtype='f8')
+        columns[element][days] = values
+        columns[element + "_flags"] = np.full(count, "   ", dtype='S3')
+        columns[element + "_flags"][days] = flags
+
+    for column, arr in columns.items():
+        np.save(os.path.join(path, _column_filename(column)), arr)
+    meta = { 'version': OBS_VERSION,
+             'elements': sorted(records),
+             'start': str(start) if count else None,
+             'count': count }
+    tmp = os.path.join(path, OBS_META_FILENAME + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.rename(tmp, os.path.join(path, OBS_META_FILENAME))
+
+def load_obs(path, elements=None, mmap=False):
+    """Load a station's daily observations saved by `save_obs()`.
+
+    Parameters
+    ----------
+    path : string
+        Directory in which the observations are stored
+    elements : iterable of strings, optional
+        Subset of the saved elements to load
+    mmap : boolean, optional
+        Memory-map each column read-only, rather than reading it in
+
+    Returns
+    -------
+    OrderedDict
+        The daily dates ("t", as `datetime64[D]`), followed by the value
+        (NaN where missing) and the 3-character flags ("<element>_flags")
+        of each element, all of the same length
+
+    """
+    with open(os.path.join(path, OBS_META_FILENAME)) as f:
+        meta = json.load(f)
+    if meta['version'] != OBS_VERSION:
+        raise IOError("Unsupported observation store version %r in %s" %
+                      (meta['version'], path))
+
+    mode = "r" if mmap else None
+    columns = OrderedDict()
+    columns['t'] = np.load(os.path.join(path, _column_filename('t')), mmap_mode=mode)
+    for element in map(str, meta['elements']):
+        if (elements is not None) and (element not in elements): continue
+        for column in [element, element + "_flags"]:
+            columns[column] = np.load(os.path.join(path, _column_filename(column)),
+                                      mmap_mode=mode)
+    return columns
+
+def _as_days(dates):
+    dates = np.asarray(dates)
+    if dates.dtype.kind != 'M':
+        dates = dates.astype('M8[us]')
+    return dates.astype('M8[D]')
+
+class ObsRecord(object):
+    """A station's daily observations, looked up by integer offset.
+
+    Since the record covers consecutive days, the row of any date is
+    simply the number of days since the start of the record; gathering
+    the observations on an arbitrary set of dates is then a single
+    fancy-indexing operation, with no searching or string formatting.
+
+    Parameters
+    ----------
+    columns : OrderedDict
+        Columns of the record, as returned by `load_obs()`
+
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.dates = columns['t']
+        self.start = self.dates[0] if len(self.dates) else None
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def elements(self):
+        return [c for c in self.columns if (c != 't') and not c.endswith("_flags")]
+
+    def __getitem__(self, element):
+        return self.columns[element]
+
+    def offsets(self, dates):
+        """Map a date, or an array of dates, to rows of the record.
+
+        Returns
+        -------
+        int or array of int
+            Number of days since the start of the record; this is out of
+            range for dates outside of the record
+
+        """
+        days = _as_days(dates)
+        if self.start is None:
+            return np.full(days.shape, -1, dtype='i8')[()]
+        return (days - self.start).astype('i8')[()]
+
+    def take(self, element, dates, flags=False):
+        """Gather an element's observations on a set of dates.
+
+        Parameters
+        ----------
+        element : string
+            Element to gather, e.g. "TMAX"
+        dates : date-like or array of date-likes
+            Dates to look up, in any order and possibly repeated; times of
+            day are ignored
+        flags : boolean, optional
+            Gather the 3-character flags rather than the values
+
+        Returns
+        -------
+        numpy.ma.MaskedArray
+            The observation on each date, masked on dates which are
+            outside of the record or have no observation
+
+        """
+        offsets = np.atleast_1d(self.offsets(dates))
+        inside = (offsets >= 0) & (offsets < len(self))
+        column = self.columns[element + "_flags" if flags else element]
+
+        values = np.asarray(column[np.where(inside, offsets, 0)]) if len(self) else \
+                 np.zeros(offsets.shape, dtype=column.dtype)
+        mask = ~inside
+        if not flags:
+            mask |= np.isnan(values)
+        result = np.ma.masked_array(values, mask=mask)
+        return result if np.ndim(dates) else result[0]
+
+def open_obs(station, elements=None, mmap=False):
+    """Open the archived observations of a station as an `ObsRecord`.
+
+    e.g.  record = open_obs('KHOU', mmap=True)
+          tmax = record.take('TMAX', dates)
+
+    """
+    return ObsRecord(load_obs(os.path.join(data_path, station, "OBS"), elements, mmap))
+
+def get_OBS(station, variable_id, mmap=False):
     '''Get the archived obs of variable_id type and return them as a DataFrame
     for easy use.
     e.g.  df = get_OBS('KHOU', 'TMAX')
     '''
 
     full_path = os.path.join(data_path, station, "OBS")
-    if not os.path.exists(full_path):
+    if not os.path.exists(os.path.join(full_path, OBS_META_FILENAME)):
         print 'No archived OBS data for this station'
         return None
-    
-    df = pd.read_csv(os.path.join(full_path,'%s.csv') %(variable_id) , index_col='t')
-    # format: index, variable, flag, datetime
+
+    columns = load_obs(full_path, [variable_id, ], mmap)
+    # format: variable, flag, indexed by date
+    index = pd.DatetimeIndex(columns['t'].astype('M8[ns]'), name='t')
+    df = _obs_frame(columns, variable_id, index)
         
     return df
+
+def _obs_frame(columns, element, index):
+    return pd.DataFrame({'data': columns[element], 'flags': columns[element + "_flags"]},
+                        index=index, columns=['data', 'flags'])
     
 
 def choose_OBS(obsdf, dtime_start, dtime_end=None, flag=False):
@@ -108,22 +358,22 @@ def choose_OBS(obsdf, dtime_start, dtime_end=None, flag=False):
     If flag set to True, return a 2d array with [data, flag] sets
     '''
 
-    str_start = dtime_start.isoformat().replace('T', ' ')
-    if dtime_end:
-        str_end = dtime_end.isoformat().replace('T', ' ')
+    ## The records are daily and consecutive, so rows are just offsets
+    ## from the first date; like slicing by label, only the part of the
+    ## range which overlaps the record is returned
+    if len(obsdf):
+        start = _as_days(obsdf.index[0])
+        i0 = int((_as_days(dtime_start) - start).astype('i8'))
+        i1 = int((_as_days(dtime_end) - start).astype('i8')) if dtime_end else i0
+        i0, i1 = max(i0, 0), min(i1 + 1, len(obsdf))
+        rows = slice(i0, max(i0, i1))
     else:
-        str_end = str_start
-    i0 = obsdf['Unnamed: 0'][str_start]
-
-    if dtime_end:
-        i1 = obsdf['Unnamed: 0'][str_end]
-    else:
-        i1 = i0
+        rows = slice(0, 0)
 
     if flag:
-        return obsdf.values[i0:i1+1, 1:3]
+        return obsdf.values[rows, 0:2]
     else:
-        return obsdf.values[i0:i1+1, 1]
+        return obsdf.values[rows, 0]
     
     
 def parse_mos(filename):
@@ -165,17 +415,17 @@ def parse_observations(station_name):
 #    latitude = data.LATITUDE.values[0]
 #    longitude = data.LONGITUDE.values[0]
 
-    variable_data = {}
+    var_names = OBS_ELEMENTS
+    columns = load_obs(os.path.join(data_path, station_name, "OBS"), var_names)
 
-    var_names = ['TMAX', 'TMIN', 'PRCP']    
-    for var_name in var_names:
-        variable_data[var_name] = get_OBS(station_name, var_name)
-
-    core_df_fields = {}
+    ## Every element shares the same daily index, so there's nothing to
+    ## align or parse
+    index = pd.DatetimeIndex(columns['t'].astype('M8[ns]'), name='t')
+    variable_data = {}
     for var_name in var_names:
-        core_df_fields[var_name] = variable_data[var_name].data
-    core = pd.DataFrame(core_df_fields)
-    core.index = [pd.datetime.strptime(x, '%Y-%m-%d %H:%M:%S') for x in core.index]
+        variable_data[var_name] = _obs_frame(columns, var_name, index)
+    core = pd.DataFrame(dict((var_name, columns[var_name]) for var_name in var_names),
+                        index=index)
     
     return variable_data, core
 
@@ -189,10 +439,13 @@ if __name__ == "__main__":
 #    print station_name
     variable_data, core = parse_observations(id)
 
-    tmaxes, tmins = [], []
+    ## Verify each day's forecast by month as it's read, rather than
+    ## collecting and grouping them all afterwards
+    verification = Verification(["field", "bucket"], bucket="month")
     for date in core.index:
         # Decrement the day by "1" - we want to grab the MOS forecast from the *previous day*
         # since this is the observation to validate it.
+        valid_date = date
         date = date-ONE_DAY
         print date
         filename = "data_arch/%s/%s.%02d%02d%04d.GFS-MAV.18Z" % (id, id, date.month, date.day, date.year)
@@ -200,24 +453,8 @@ if __name__ == "__main__":
             tmin, tmax = parse_mos(filename)
         except IOError, e:
             print "Could not find MOS file:", filename
-            tmin, tmax = None, None
-        tmaxes.append(tmax)
-        tmins.append(tmin)
-    mos = pd.DataFrame({'TMAX': tmaxes, 'TMIN': tmins}, index=core.index)
-
-    ## group by month
-    mos_grouped = mos.groupby([lambda x: x.year, lambda x: x.month])
-    core_grouped = core.groupby([lambda x: x.year, lambda x: x.month])
-
-    def rmse(fcst, obs, varname):
-        sqe = np.power(fcst[varname] - np.floor(obs[varname]), 2)
-        msqe = np.mean(sqe)
-        rmsqe = np.sqrt(msqe)
-        return rmsqe
-
-    for mg, cg in zip(mos_grouped, core_grouped):
-        (year, month), fcst = mg
-        (_, _), obs = cg
-
-        rms = rmse(fcst, obs, 'TMAX')
-        print year, month, rms
+            continue
+        verification.add([tmax, tmin], np.floor(core.loc[valid_date, ['TMAX', 'TMIN']].values),
+                         dates=[valid_date, valid_date], field=['TMAX', 'TMIN'])
+
+    print verification.to_frame().loc['TMAX', 'rmse']
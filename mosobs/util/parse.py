@@ -0,0 +1,311 @@
+"""Vectorized parsing of many MOS forecast blocks at once.
+
+Where `mos.process_MOS` decodes a single block into a DataFrame, the
+routines here decode thousands of fixed-width blocks (such as a whole
+monthly bulletin) in one go. All of the lines are packed into a single
+character array, and every row of a given field - across every block -
+is decoded with a handful of array operations.
+
+Decoded fields are stored compactly, using the types in
+`data.FIELD_DTYPES`: small integers for numeric fields, and integer codes
+(indexing `data.CATEGORIES`) for categorical ones. Missing values are
+flagged with a sentinel; see `missing_value()`.
+
+"""
+import datetime
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from compress import open_archive
+from data import MISSING, FIELD_DTYPES, CATEGORIES
+from mos import station_blocks, process_MOS
+from tracing import tracer
+
+## Fields decoded from each block; "N/X" rows are stored under "X/N", since
+## the valid time of each column determines whether it holds a max or a min
+NUMERIC_FIELDS = ["X/N", "TMP", "DPT", "WDR", "WSP", "P06", "P12", "Q06", "Q12",
+                  "POZ", "POS", "CIG", "VIS"]
+CATEGORICAL_FIELDS = ["CLD", "OBV", "TYP"]
+FIELDS = NUMERIC_FIELDS + CATEGORICAL_FIELDS
+
+RUN_DTYPE = np.dtype([ ('station', 'S8'), ('model', 'S3'), ('run', 'M8[h]') ])
+
+_ZERO, _SPACE, _MINUS = ord("0"), ord(" "), ord("-")
+
+def _synthetic_blocks(model, runs, stations=("KSYR", "KSDF")):
+    """MAV or MET blocks from the synthetic bulletin generator, which lives
+    with the benchmarks.
+
+    """
+    benchmarks = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                              "benchmarks")
+    if benchmarks not in sys.path:
+        sys.path.insert(0, benchmarks)
+    import synthetic
+    return [synthetic.mos_block(s, run, model) for s in stations for run in runs]
+
+class ParseBlocksTest(unittest.TestCase):
+    """`parse_blocks()` should agree with `mos.process_MOS()`."""
+
+    def check(self, model, runs):
+        blocks = _synthetic_blocks(model, runs)
+        parsed_runs, data = parse_blocks(blocks, model)
+        for i, block in enumerate(blocks):
+            df = process_MOS(block)
+            self.assertEqual(parsed_runs[i]['station'], df.meta['station'])
+            self.assertEqual(parsed_runs[i]['run'].astype(datetime.datetime), df.meta['run'])
+
+            row = data[i][data[i]['lead'] >= 0]
+            valid = pd.DatetimeIndex(row['valid'].astype('M8[ns]'))
+            self.assertEqual(list(valid), list(df.index))
+            for field in df.columns:
+                decoded = decode_field(field, row[field])
+                if field in CATEGORICAL_FIELDS:
+                    self.assertEqual(list(decoded), [v.strip() for v in df[field]])
+                else:
+                    expected = df[field].values.astype('f8')
+                    self.assertTrue(np.array_equal(np.isnan(decoded), np.isnan(expected)))
+                    self.assertTrue((decoded[~np.isnan(decoded)] ==
+                                     expected[~np.isnan(expected)]).all())
+
+            ## The max/min row holds the same temperatures
+            maxmin = decode_field("X/N", row["X/N"])
+            expected = [t for day in df.maxmins.values() for t in day.values()]
+            self.assertEqual(sorted(maxmin[~np.isnan(maxmin)]), sorted(expected))
+
+    def testMAV(self):
+        self.check("GFS", [datetime.datetime(2009, 1, 1, h) for h in [0, 6, 12, 18]] +
+                          [datetime.datetime(2008, 12, 31, 18)])
+
+    def testMET(self):
+        self.check("NAM", [datetime.datetime(2009, 2, 28, h) for h in [0, 12]])
+
+def _char_matrix(lines):
+    """Pack stripped lines into a 2D array of characters, blank-padded so
+    that every row holds a whole number of 3-character columns.
+
+    """
+    lines = np.array([l.strip() for l in lines])
+    width = max(lines.dtype.itemsize, 4)
+    width += (1 - width) % 3
+    chars = np.full((len(lines), width), _SPACE, dtype='u1')
+    raw = np.frombuffer(lines.tostring(), dtype='u1').reshape(len(lines), -1)
+    chars[:, :raw.shape[1]] = raw
+    chars[chars == 0] = _SPACE
+    return chars
+
+def decode_numeric(cells):
+    """Decode right-justified integers from an array of fixed-width cells,
+    given as the character codes along the last dimension (e.g. the
+    3-character columns of a MOS block, or the 5-character values of a
+    GHCN-Daily record).
+
+    Blank or malformed cells are returned as NaN.
+
+    """
+    digits = cells.astype('i2') - _ZERO
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_blank = cells == _SPACE
+    is_minus = cells == _MINUS
+
+    values = np.zeros(cells.shape[:-1], dtype='f8')
+    for i in xrange(cells.shape[-1]):
+        values = np.where(is_digit[..., i], values*10 + digits[..., i], values)
+    values[is_minus.any(axis=-1)] *= -1
+
+    bad = ~(is_digit | is_blank | is_minus).all(axis=-1)
+    bad |= ~is_digit.any(axis=-1)
+    values[bad] = np.nan
+    return values
+
+def _decode_string(cells):
+    """Decode (stripped) category labels from an array of 3-character cells.
+
+    """
+    labels = np.ascontiguousarray(cells).view('S3')[..., 0]
+    return np.char.strip(labels)
+
+def missing_value(field):
+    """The sentinel flagging missing values of a field in its compact type.
+
+    This is `data.MISSING` if it can be represented by the field's type,
+    and otherwise the largest value of that type.
+
+    """
+    info = np.iinfo(FIELD_DTYPES[field])
+    return MISSING if MISSING <= info.max else info.max
+
+def encode_field(field, values):
+    """Convert decoded values of a field to its compact representation.
+
+    Parameters
+    ----------
+    field : string
+        Name of the MOS field
+    values : array-like
+        Numbers (NaN where missing) for numeric fields, or labels (empty
+        where missing) for categorical ones
+
+    Returns
+    -------
+    numpy.ndarray
+        Values with dtype `data.FIELD_DTYPES[field]`, and missing (or
+        unrepresentable) values set to `missing_value(field)`
+
+    """
+    dtype = np.dtype(FIELD_DTYPES[field])
+    sentinel = missing_value(field)
+    values = np.asarray(values)
+    encoded = np.full(values.shape, sentinel, dtype=dtype)
+
+    if field in CATEGORIES:
+        for code, label in enumerate(CATEGORIES[field]):
+            encoded[values == label] = code
+    else:
+        info = np.iinfo(dtype)
+        with np.errstate(invalid='ignore'):
+            ok = (values >= info.min) & (values <= info.max) & (values != sentinel)
+        encoded[ok] = values[ok]
+    return encoded
+
+def decode_field(field, encoded):
+    """Convert compact values of a field back to numbers or labels.
+
+    Numeric fields are returned as floats with NaN where missing;
+    categorical fields as labels, empty where missing.
+
+    """
+    encoded = np.asarray(encoded)
+    missing = encoded == missing_value(field)
+    if field in CATEGORIES:
+        labels = np.array(CATEGORIES[field] + [""])
+        codes = np.where(missing, len(labels) - 1, encoded)
+        return labels[codes]
+    decoded = encoded.astype('f8')
+    decoded[missing] = np.nan
+    return decoded
+
+def missing_mask(field, encoded):
+    """Boolean mask of the missing values in a compact array of a field.
+
+    """
+    return np.asarray(encoded) == missing_value(field)
+
+def parse_blocks(blocks, model):
+    """Decode a batch of MOS forecast blocks into columnar arrays.
+
+    Each block is decoded onto its own row of the output, with one column
+    per forecast hour in the block (blocks with fewer forecast hours are
+    padded with missing values). Lead times are derived from the forecast
+    hours of each block, and valid times are computed as offsets from the
+    model run time, so no per-timestamp date handling is needed.
+
+    Parameters
+    ----------
+    blocks : iterable of lists of strings
+        Individual lines of each MOS block forecast
+    model : string
+        Model which produced the forecasts
+
+    Returns
+    -------
+    runs : numpy.ndarray
+        Station, model and run time of each block, with dtype `RUN_DTYPE`
+    data : numpy.ndarray
+        Structured array of shape (run, lead) with the fields `lead`
+        (hours since the model run; -1 if missing), `valid` (the valid
+        time as a `datetime64`), and each of the `FIELDS` in its compact
+        type (see `encode_field()`).
+
+    """
+    blocks = list(blocks)
+    with tracer.stage("parse", blocks=len(blocks)):
+        return _parse_blocks(blocks, model)
+
+def _parse_blocks(blocks, model):
+    nruns = len(blocks)
+    lengths = np.array([len(b) for b in blocks], dtype='i8')
+    starts = np.cumsum(lengths) - lengths
+    lines = []
+    for block in blocks:
+        lines.extend(block)
+
+    ## 1) Block headers - station and model run time
+    runs = np.zeros(nruns, dtype=RUN_DTYPE)
+    headers = [lines[i].split() for i in starts]
+    runs['station'] = [h[0] for h in headers]
+    runs['model'] = model
+    run_times = []
+    for h in headers:
+        month, day, year = h[4].split("/")
+        run_times.append("%s-%02d-%02dT%s" % (year, int(month), int(day), h[5][:2]))
+    runs['run'] = run_times
+
+    if not nruns:
+        return runs, np.zeros((0, 0), dtype=_data_dtype())
+
+    chars = _char_matrix(lines)
+    names = np.ascontiguousarray(chars[:, :3]).view('S3')[:, 0]
+    owner = np.repeat(np.arange(nruns), lengths)
+    cells = chars[:, 4:].reshape(len(lines), -1, 3)
+
+    ## 2) Forecast hours -> lead and valid times; the forecast hours also
+    ##    determine how many columns to keep, since other lines may be longer
+    is_hour = names == "HR "
+    hours = np.full((nruns, cells.shape[1]), np.nan)
+    hours[owner[is_hour]] = decode_numeric(cells[is_hour])
+    ncols = np.max(np.nonzero(~np.isnan(hours).all(axis=0))[0], initial=-1) + 1
+    hours, cells = hours[:, :ncols], cells[:, :ncols]
+    run_hour = (runs['run'] - runs['run'].astype('M8[D]')).astype('i8')
+
+    data = np.zeros((nruns, ncols), dtype=_data_dtype())
+    for field in FIELDS:
+        data[field] = missing_value(field)
+
+    steps = np.mod(np.diff(hours, axis=1), 24)
+    first = np.mod(hours[:, :1] - run_hour[:, None], 24)
+    leads = np.cumsum(np.hstack([first, steps]), axis=1)
+    missing = np.isnan(leads)
+    leads[missing] = -1
+    data['lead'] = leads
+    data['valid'] = runs['run'][:, None] + leads.astype('i8').astype('m8[h]')
+    data['valid'][missing] = np.datetime64('NaT')
+
+    ## 3) Every row of every field, all at once
+    names[names == "N/X"] = "X/N"
+    for field in FIELDS:
+        is_field = names == field
+        if not is_field.any(): continue
+        decode = _decode_string if field in CATEGORICAL_FIELDS else decode_numeric
+        data[field][owner[is_field]] = encode_field(field, decode(cells[is_field]))
+
+    return runs, data
+
+def parse_archive(archive_fn, model, stations=None):
+    """Decode every block (or those for some stations) in a MOS bulletin.
+
+    Parameters
+    ----------
+    archive_fn : string
+        Path to the bulletin, which may be compressed
+    model : string
+        Model whose MOS guidance is contained in the bulletin
+    stations : string or iterable of strings, optional
+        Station identifier code(s) to decode; all stations by default
+
+    Returns
+    -------
+    runs, data : numpy.ndarray
+        See `parse_blocks()`
+
+    """
+    blocks = [b for _, b in station_blocks(open_archive(archive_fn), stations, model)]
+    return parse_blocks(blocks, model)
+
+def _data_dtype():
+    return np.dtype([ ('lead', 'i2'), ('valid', 'M8[h]') ] +
+                    [ (f, FIELD_DTYPES[f]) for f in FIELDS ])
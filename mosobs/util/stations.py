@@ -0,0 +1,290 @@
+"""Registry of GHCN-Daily and MOS stations, searchable by location.
+
+Rather than relying on hand-mapped station codes, the registry is read
+from the station lists which come with each archive,
+
+- `ghcnd-stations.txt`, listing every GHCN-Daily station, and
+- a MOS station table in the fixed-width GEMPAK format (as used for the
+  MAV/MET guidance), listing the ICAO identifier and location of each
+  forecast site,
+
+and a KD-tree is built over the location of the GHCN-Daily stations, so
+that each MOS site can be paired with the closest station observing it.
+Locations are projected onto the unit sphere, so nearest-neighbour and
+radius queries follow great-circle distances. Parsing the text lists is
+slow, so the parsed tables are cached as a compact binary file alongside
+them and only re-read when they change.
+
+"""
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from data import STATION_CODES
+
+EARTH_RADIUS_KM = 6371.
+
+GHCND_STATIONS_FILENAME = "ghcnd-stations.txt"
+MOS_STATIONS_FILENAME = "mos_stations.tbl"
+CACHE_FILENAME = "stations.npz"
+CACHE_VERSION = 1
+
+## GHCN-Daily networks whose stations report the max/min temperature -
+## the first-order (WBAN) stations of the US and Puerto Rico, which are
+## usually at the airport the MOS site is named for. Many other stations
+## (e.g. the CoCoRaHS network, "US1...") only report precipitation.
+TEMPERATURE_NETWORKS = ("USW", "RQW")
+
+STATION_DTYPE = np.dtype([ ('id', 'S11'), ('lat', 'f4'), ('lon', 'f4'),
+                           ('elev', 'f4'), ('state', 'S2'), ('name', 'S32') ])
+
+## Columns of each line of ghcnd-stations.txt, e.g.
+## "USW00014771  43.1111  -76.1039  124.0 NY SYRACUSE HANCOCK INTL AP ..."
+GHCND_COLUMNS = { 'id': (0, 11), 'lat': (12, 20), 'lon': (21, 30),
+                  'elev': (31, 37), 'state': (38, 40), 'name': (41, 71) }
+## Columns of each line of a GEMPAK station table, e.g.
+## "KSYR     725190 SYRACUSE_HANCOCK_INTL_ARPT       NY US  4311  -7611   124  0"
+## where the location is in hundredths of a degree
+MOS_COLUMNS = { 'id': (0, 8), 'name': (16, 48), 'state': (49, 51),
+                'lat': (55, 60), 'lon': (61, 67), 'elev': (68, 73) }
+
+def _read_fixed_width(filename, columns, scale=1.):
+    with open(filename) as f:
+        lines = [l.rstrip("\r\n") for l in f if l.strip() and not l.startswith("!")]
+    table = np.zeros(len(lines), dtype=STATION_DTYPE)
+    for name, (start, end) in columns.items():
+        cells = [l[start:end].strip() for l in lines]
+        if table.dtype[name].kind == 'f':
+            values = np.array([c or "nan" for c in cells], dtype='f8')
+            table[name] = values*scale if name in ('lat', 'lon') else values
+        else:
+            table[name] = [c.replace("_", " ") for c in cells]
+    return table
+
+def read_ghcnd_stations(filename):
+    """Read the list of GHCN-Daily stations (`ghcnd-stations.txt`).
+
+    Returns
+    -------
+    numpy.ndarray
+        One record (of type `STATION_DTYPE`) per station
+
+    """
+    return _read_fixed_width(filename, GHCND_COLUMNS)
+
+def read_mos_stations(filename):
+    """Read a MOS station table, in the fixed-width GEMPAK format.
+
+    Returns
+    -------
+    numpy.ndarray
+        One record (of type `STATION_DTYPE`) per station
+
+    """
+    return _read_fixed_width(filename, MOS_COLUMNS, scale=0.01)
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype='f8')), np.radians(np.asarray(lon, dtype='f8'))
+    return np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)], axis=-1)
+
+def _chord_to_km(chord):
+    return 2.*EARTH_RADIUS_KM*np.arcsin(np.clip(chord/2., 0., 1.))
+
+def _km_to_chord(km):
+    return 2.*np.sin(np.minimum(km/EARTH_RADIUS_KM, np.pi)/2.)
+
+class StationTable(object):
+    """A table of stations, with a KD-tree over their locations.
+
+    Parameters
+    ----------
+    stations : numpy.ndarray
+        One record (of type `STATION_DTYPE`) per station
+
+    """
+
+    def __init__(self, stations):
+        self.stations = stations
+        self._positions = dict((s, i) for i, s in enumerate(stations['id']))
+        self.tree = cKDTree(_unit_vectors(stations['lat'], stations['lon']))
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, station_id):
+        return station_id in self._positions
+
+    def __getitem__(self, station_id):
+        return self.stations[self._positions[station_id]]
+
+    def nearest(self, lat, lon, k=1):
+        """Find the stations closest to a location.
+
+        Returns
+        -------
+        stations : numpy.ndarray
+            The `k` closest stations, nearest first
+        distances : numpy.ndarray
+            Their great-circle distance from the location, in km
+
+        """
+        chords, positions = self.tree.query(_unit_vectors(lat, lon), k=min(k, len(self)))
+        positions, chords = np.atleast_1d(positions), np.atleast_1d(chords)
+        return self.stations[positions], _chord_to_km(chords)
+
+    def within(self, lat, lon, radius):
+        """Find the stations within `radius` km of a location.
+
+        Returns
+        -------
+        stations : numpy.ndarray
+            The stations in range, nearest first
+        distances : numpy.ndarray
+            Their great-circle distance from the location, in km
+
+        """
+        xyz = _unit_vectors(lat, lon)
+        positions = np.array(self.tree.query_ball_point(xyz, _km_to_chord(radius)), dtype='i8')
+        distances = _chord_to_km(np.sqrt(((self.tree.data[positions] - xyz)**2).sum(axis=-1)))
+        order = np.argsort(distances, kind='mergesort')
+        return self.stations[positions[order]], distances[order]
+
+class StationRegistry(object):
+    """The GHCN-Daily and MOS stations, and the pairing between them.
+
+    Parameters
+    ----------
+    ghcnd, mos : numpy.ndarray
+        Records (of type `STATION_DTYPE`) of the GHCN-Daily and MOS stations
+
+    """
+
+    def __init__(self, ghcnd, mos):
+        self.ghcnd = StationTable(ghcnd)
+        self.mos = StationTable(mos)
+
+    def ghcnd_station(self, station, networks=None, radius=None):
+        """Find the GHCN-Daily station closest to a MOS site.
+
+        Parameters
+        ----------
+        station : string
+            ICAO identifier of the MOS site, e.g. "KSYR"
+        networks : iterable of strings, optional
+            Only consider GHCN-Daily stations whose identifiers start with
+            one of these prefixes; e.g. ("USW", ) restricts the search to
+            the first-order (WBAN) stations, which are usually at the
+            airport itself
+        radius : float, optional
+            Only consider stations within this many km
+
+        Returns
+        -------
+        record or None
+            The closest GHCN-Daily station, or `None` if none qualify
+
+        """
+        site = self.mos[station.upper()]
+        if radius is None:
+            ## Widen the search until enough candidates have been seen
+            k = 1 if networks is None else 16
+            while True:
+                candidates, _ = self.ghcnd.nearest(site['lat'], site['lon'], k)
+                matches = _in_networks(candidates, networks)
+                if len(matches) or (k >= len(self.ghcnd)):
+                    break
+                k *= 4
+        else:
+            candidates, _ = self.ghcnd.within(site['lat'], site['lon'], radius)
+            matches = _in_networks(candidates, networks)
+        return matches[0] if len(matches) else None
+
+    def ghcnd_code(self, station, networks=TEMPERATURE_NETWORKS, radius=None):
+        """Identifier of the GHCN-Daily station paired with a MOS site.
+
+        Only the networks which report temperature are searched by
+        default; pass `networks=None` to consider every station (see
+        `ghcnd_station()`).
+
+        Raises
+        ------
+        KeyError
+            If the site isn't a known MOS station, or has no GHCN-Daily
+            station nearby.
+
+        """
+        match = self.ghcnd_station(station, networks, radius)
+        if match is None:
+            raise KeyError("No GHCN-Daily station near %s" % station)
+        return match['id']
+
+def _in_networks(stations, networks):
+    if networks is None:
+        return stations
+    prefixes = tuple(networks)
+    return stations[[s.startswith(prefixes) for s in stations['id']]]
+
+def load_registry(path, ghcnd_filename=GHCND_STATIONS_FILENAME,
+                  mos_filename=MOS_STATIONS_FILENAME, cache=True):
+    """Load the station registry from the station lists in a directory.
+
+    Parameters
+    ----------
+    path : string
+        Directory holding the station lists
+    ghcnd_filename, mos_filename : string, optional
+        Names of the GHCN-Daily station list and the MOS station table
+    cache : boolean, optional
+        Read the parsed tables from (and save them to) a binary cache in
+        the same directory, as long as it's newer than both lists
+
+    Returns
+    -------
+    StationRegistry
+
+    """
+    ghcnd_filename = os.path.join(path, ghcnd_filename)
+    mos_filename = os.path.join(path, mos_filename)
+    cache_filename = os.path.join(path, CACHE_FILENAME)
+
+    if cache and os.path.exists(cache_filename) and \
+       os.path.getmtime(cache_filename) >= max(os.path.getmtime(ghcnd_filename),
+                                               os.path.getmtime(mos_filename)):
+        with np.load(cache_filename) as saved:
+            if int(saved['version']) == CACHE_VERSION:
+                return StationRegistry(saved['ghcnd'], saved['mos'])
+
+    ghcnd, mos = read_ghcnd_stations(ghcnd_filename), read_mos_stations(mos_filename)
+    if cache:
+        tmp = cache_filename + ".tmp.npz"
+        np.savez(tmp, version=CACHE_VERSION, ghcnd=ghcnd, mos=mos)
+        os.rename(tmp, cache_filename)
+    return StationRegistry(ghcnd, mos)
+
+_registries = {}
+
+def ghcnd_code(station, path, networks=TEMPERATURE_NETWORKS):
+    """Identifier of the GHCN-Daily station for a MOS site.
+
+    Hand-mapped stations in `data.STATION_CODES` take precedence; any
+    other site is paired with its closest GHCN-Daily station in one of
+    `networks`, using the registry in `path` (loaded once, and then
+    re-used).
+
+    Raises
+    ------
+    KeyError
+        If the site isn't hand-mapped and can't be paired, including when
+        there are no station lists in `path`.
+
+    """
+    if station.lower() in STATION_CODES:
+        return STATION_CODES[station.lower()]
+    if path not in _registries:
+        try:
+            _registries[path] = load_registry(path)
+        except (IOError, OSError):
+            raise KeyError("%s isn't hand-mapped, and there are no station lists in %s"
+                           % (station, path))
+    return _registries[path].ghcnd_code(station, networks)
@@ -0,0 +1,282 @@
+"""Stage-level timers, counters and profiling hooks for the ingest pipeline.
+
+Each step of turning the MDL archive into forecasts - downloading,
+reading, decompressing, splitting bulletins into blocks, parsing blocks
+and writing files - is recorded as a named stage. For every stage, the
+number of calls and failures, the wall time spent in it (both including
+and excluding any stages nested inside it), and counters such as bytes,
+blocks and runs are accumulated in the module-level `tracer`:
+
+>>> mos.get_GFS("KSDF", [2009, ])
+>>> tracing.tracer.write_prometheus("wxc.prom")
+>>> tracing.tracer.write_jsonl("wxc.jsonl", station="KSDF")
+
+Stages nest per thread, so time spent pulling decompressed lines while
+splitting a bulletin is charged to "decompress" rather than "split" in
+the exclusive (`self_seconds`) totals.
+
+For a closer look at a single run, wrap it in `profile()`, which either
+runs `cProfile` or periodically samples the Python stack.
+
+"""
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import json
+import os
+import signal
+import threading
+import time
+
+class StageStats(object):
+    """Accumulated timings and counters of one stage.
+
+    """
+    __slots__ = ("calls", "failures", "seconds", "self_seconds", "counts")
+
+    def __init__(self):
+        self.calls, self.failures = 0, 0
+        self.seconds, self.self_seconds = 0., 0.
+        self.counts = defaultdict(int)
+
+    def as_dict(self):
+        d = OrderedDict([ ('calls', self.calls), ('failures', self.failures),
+                          ('seconds', self.seconds), ('self_seconds', self.self_seconds) ])
+        d.update(sorted(self.counts.items()))
+        return d
+
+class Tracer(object):
+    """Thread-safe registry of per-stage statistics.
+
+    Set `enabled` to False to turn off all recording.
+
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.stats = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, name, elapsed, child, failed, counts):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats()
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.seconds += elapsed
+            stats.self_seconds += elapsed - child
+            for key, n in counts.iteritems():
+                stats.counts[key] += n
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """Time a block of code as a stage.
+
+        Yields a dictionary of counters, which the block can add to, e.g.
+
+        >>> with tracer.stage("write", runs=1) as counts:
+        ...     f.write(data)
+        ...     counts['bytes'] += len(data)
+
+        An exception raised in the block is counted as a failure of the
+        stage, and re-raised.
+
+        """
+        counts = defaultdict(int, counts)
+        if not self.enabled:
+            yield counts
+            return
+        stack = self._stack()
+        stack.append(0.)
+        failed = False
+        start = time.time()
+        try:
+            yield counts
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.time() - start
+            child = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._record(name, elapsed, child, failed, counts)
+
+    def count(self, name, **counts):
+        """Add to the counters of a stage without timing anything.
+
+        """
+        if self.enabled:
+            with self._lock:
+                stats = self.stats.get(name)
+                if stats is None:
+                    stats = self.stats[name] = StageStats()
+                for key, n in counts.iteritems():
+                    stats.counts[key] += n
+
+    def traced(self, name, **counts):
+        """Decorator recording every call of a function as a stage.
+
+        """
+        def decorate(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.stage(name, **counts):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def iterate(self, name, iterable, measure=None, **counts):
+        """Wrap an iterator so that the time spent producing each item is
+        recorded as a stage.
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage
+        iterable : iterable
+            Source of the items
+        measure : function, optional
+            Called on each item to give the counters to add for it, e.g.
+            ``lambda chunk: {'bytes': len(chunk)}``
+        **counts
+            Counters to add for every item
+
+        """
+        it = iter(iterable)
+        while True:
+            with self.stage(name) as item_counts:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                item_counts.update(counts)
+                if measure is not None:
+                    for key, n in measure(item).iteritems():
+                        item_counts[key] += n
+            yield item
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    def snapshot(self):
+        """Current statistics of every stage, as plain dictionaries.
+
+        """
+        with self._lock:
+            return OrderedDict((name, stats.as_dict())
+                               for name, stats in self.stats.iteritems())
+
+    def write_jsonl(self, filename, **labels):
+        """Append the statistics of every stage to a file of JSON lines.
+
+        Each line holds one stage, along with the time it was written and
+        any extra `labels`.
+
+        """
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(filename, "a") as f:
+            for name, stats in self.snapshot().iteritems():
+                record = OrderedDict([ ('time', now), ('stage', name) ])
+                record.update(sorted(labels.items()))
+                record.update(stats)
+                f.write(json.dumps(record) + "\n")
+
+    def write_prometheus(self, filename, prefix="wxc"):
+        """Write the statistics of every stage in the Prometheus text format.
+
+        The file is replaced atomically, so that it can be picked up by
+        the textfile collector of the node exporter.
+
+        """
+        snapshot = self.snapshot()
+        metrics = OrderedDict()
+        for name, stats in snapshot.iteritems():
+            for key, value in stats.iteritems():
+                metrics.setdefault(key, []).append((name, value))
+
+        lines = []
+        for key, samples in metrics.iteritems():
+            metric = "%s_stage_%s_total" % (prefix, key)
+            lines.append("# HELP %s %s" % (metric, _HELP.get(key, "Number of %s processed" % key)))
+            lines.append("# TYPE %s counter" % metric)
+            for name, value in samples:
+                lines.append('%s{stage="%s"} %r' % (metric, name, value))
+
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.rename(tmp_filename, filename)
+
+_HELP = { 'calls': "Number of times the stage ran",
+          'failures': "Number of times the stage raised an error",
+          'seconds': "Wall time spent in the stage, including nested stages",
+          'self_seconds': "Wall time spent in the stage, excluding nested stages" }
+
+## Shared by the whole pipeline
+tracer = Tracer()
+
+@contextmanager
+def profile(filename, kind="cprofile", interval=0.005):
+    """Profile a block of code, such as a single ingest run.
+
+    >>> with profile("ingest.prof"):
+    ...     mos.get_GFS("KSDF", [2009, ])
+
+    Parameters
+    ----------
+    filename : string
+        Where to write the profile
+    kind : string, optional
+        "cprofile" to record every function call with `cProfile` (the
+        output can be read with `pstats`), or "sample" to sample the
+        stack of the main thread every `interval` seconds, which is much
+        cheaper; the samples are written as collapsed stacks, one
+        ``frame;frame;... count`` per line, ready for flame graph tools
+    interval : float, optional
+        Sampling interval, in (CPU) seconds
+
+    """
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filename)
+
+    elif kind == "sample":
+        samples = defaultdict(int)
+
+        def sample(signum, frame):
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            samples[";".join(reversed(stack))] += 1
+
+        previous = signal.signal(signal.SIGPROF, sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        try:
+            yield samples
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, previous)
+            with open(filename, "w") as f:
+                for stack, n in sorted(samples.iteritems()):
+                    f.write("%s %d\n" % (stack, n))
+
+    else:
+        raise ValueError("Unknown profiler '%s'" % kind)
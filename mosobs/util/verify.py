@@ -0,0 +1,301 @@
+"""Streaming verification statistics of MOS forecasts against observations.
+
+Rather than collecting every forecast and observation into one table and
+grouping it afterwards, errors are folded into small accumulators as they
+are computed - one run, one station or one chunk at a time. Each
+accumulator keeps the count, mean and sum of squared deviations of the
+errors (following Welford, with the pairwise update of Chan et al. for
+whole batches) and the sum of their absolute values, from which the bias,
+MAE and RMSE follow. Accumulators built separately, e.g. by parallel
+workers, can be merged exactly.
+
+A `Verification` keeps one accumulator per combination of labels, using
+any of
+
+    station, model, cycle, lead day, field and calendar bucket
+
+as the key, so that the same stream of errors can be summarized, say, by
+station and month, or by model and lead day.
+
+"""
+import pickle
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+KEYS = ["station", "model", "cycle", "lead_day", "field", "bucket"]
+
+class VerificationTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = 20000
+        self.df = pd.DataFrame({
+            'station': rng.choice(["KSYR", "KSDF", "KAUS"], n),
+            'lead_day': rng.randint(1, 3, n),
+            'dates': pd.Timestamp("2009-01-01") + pd.to_timedelta(rng.randint(0, 365, n), 'D'),
+            'fcst': rng.normal(60., 10., n).round(),
+            'obs': rng.normal(59., 10., n).round() })
+        self.df.loc[rng.rand(n) < 0.05, 'obs'] = np.nan
+        self.df.loc[rng.rand(n) < 0.05, 'fcst'] = np.nan
+
+    def expected(self):
+        df = self.df.assign(bucket=self.df['dates'].dt.strftime("%Y-%m"),
+                            error=self.df['fcst'] - self.df['obs']).dropna()
+        grouped = df.groupby(["station", "lead_day", "bucket"])['error']
+        return pd.DataFrame({ 'count': grouped.count(), 'bias': grouped.mean(),
+                              'mae': grouped.apply(lambda e: e.abs().mean()),
+                              'rmse': grouped.apply(lambda e: np.sqrt((e**2).mean())) })
+
+    def add(self, v, df):
+        v.add(df['fcst'].values, df['obs'].values, dates=df['dates'].values,
+              station=df['station'].values, lead_day=df['lead_day'].values)
+
+    def check(self, v):
+        result, expected = v.to_frame(), self.expected()
+        self.assertEqual(list(result.index), list(expected.index))
+        for column in ['count', 'bias', 'mae', 'rmse']:
+            self.assertTrue(np.allclose(result[column], expected[column], rtol=0., atol=1e-10))
+
+    def testAdd(self):
+        v = Verification(["station", "lead_day", "bucket"])
+        self.add(v, self.df)
+        self.check(v)
+        ## Pairs with a missing forecast or observation are left out
+        self.assertEqual(sum(a.count for a in v.accumulators.values()),
+                         len(self.df.dropna()))
+
+    def testMergePickled(self):
+        parts = []
+        for chunk in np.array_split(np.arange(len(self.df)), 7):
+            v = Verification(["station", "lead_day", "bucket"])
+            self.add(v, self.df.iloc[chunk])
+            parts.append(pickle.loads(pickle.dumps(v, pickle.HIGHEST_PROTOCOL)))
+        merged = parts[0]
+        for v in parts[1:]:
+            merged.merge(v)
+        self.check(merged)
+        self.assertRaises(ValueError, merged.merge, Verification(["station"]))
+
+    def testMissing(self):
+        v = Verification()
+        v.add([np.nan, 1., 3.], [0., np.nan, 1.])
+        self.assertEqual(v[()].count, 1)
+        self.assertEqual(v[()].bias, 2.)
+        self.assertTrue(np.isnan(Accumulator().rmse))
+
+    def testCalendarBuckets(self):
+        dates = np.array(["2009-01-15", "2009-03-01", "2009-06-30", "2009-11-30",
+                          "2009-12-01"], dtype='M8[D]')
+        self.assertEqual(list(calendar_bucket(dates, "season")),
+                         ["DJF", "MAM", "JJA", "SON", "DJF"])
+        self.assertEqual(list(calendar_bucket(dates, "month")),
+                         ["2009-01", "2009-03", "2009-06", "2009-11", "2009-12"])
+        self.assertEqual(list(calendar_bucket(dates, "month_of_year")), [1, 3, 6, 11, 12])
+        self.assertRaises(ValueError, calendar_bucket, dates, "week")
+
+def calendar_bucket(dates, bucket):
+    """Label each date with the calendar bucket it falls in.
+
+    Parameters
+    ----------
+    dates : array-like
+        Dates (anything convertible to `datetime64`)
+    bucket : string
+        One of "day", "month" (e.g. "2009-01"), "year", "month_of_year"
+        (1-12) or "season" ("DJF", "MAM", "JJA" or "SON")
+
+    Returns
+    -------
+    numpy.ndarray
+
+    """
+    dates = np.asarray(dates)
+    if dates.dtype.kind != 'M':
+        dates = dates.astype('M8[us]')
+    if bucket in ["day", "month", "year"]:
+        return dates.astype('M8[%s]' % bucket[0].upper()).astype(str)
+    months = dates.astype('M8[M]').astype('i8') % 12
+    if bucket == "month_of_year":
+        return months + 1
+    if bucket == "season":
+        return np.array(["DJF", "MAM", "JJA", "SON"])[((months + 1) % 12) // 3]
+    raise ValueError("Unknown calendar bucket %r" % bucket)
+
+class Accumulator(object):
+    """Running count, mean, sum of squared deviations and sum of absolute
+    values of a stream of errors.
+
+    """
+    __slots__ = ("count", "mean", "m2", "abs_sum")
+
+    def __init__(self, count=0, mean=0., m2=0., abs_sum=0.):
+        self.count, self.mean, self.m2, self.abs_sum = count, mean, m2, abs_sum
+
+    def __getstate__(self):
+        return self.count, self.mean, self.m2, self.abs_sum
+
+    def __setstate__(self, state):
+        self.count, self.mean, self.m2, self.abs_sum = state
+
+    def update(self, errors):
+        """Add a batch of errors; missing (NaN) ones are ignored.
+
+        """
+        errors = np.asarray(errors, dtype='f8').ravel()
+        errors = errors[~np.isnan(errors)]
+        if len(errors):
+            mean = errors.mean()
+            self.merge(Accumulator(len(errors), mean, ((errors - mean)**2).sum(),
+                                   np.abs(errors).sum()))
+        return self
+
+    def merge(self, other):
+        """Fold in the errors accumulated by another accumulator.
+
+        """
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta**2*self.count*other.count/count
+            self.mean += delta*other.count/count
+            self.abs_sum += other.abs_sum
+            self.count = count
+        return self
+
+    @property
+    def bias(self):
+        return self.mean if self.count else np.nan
+
+    @property
+    def mae(self):
+        return self.abs_sum/self.count if self.count else np.nan
+
+    @property
+    def variance(self):
+        return self.m2/self.count if self.count else np.nan
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.variance + self.mean**2) if self.count else np.nan
+
+class Verification(object):
+    """Accumulators of errors, keyed by a combination of labels.
+
+    For example, to verify one run's forecasts of a field at each lead
+    day, by station and month,
+
+    >>> v = Verification(["station", "lead_day", "bucket"], bucket="month")
+    >>> v.add(fcsts, obs, station="KSYR", lead_day=[1, 1, 2, 2],
+    ...       dates=valid_dates)
+    >>> v.to_frame()
+
+    Parameters
+    ----------
+    keys : list of strings, optional
+        Labels (from `KEYS`) to keep separate accumulators for; by
+        default, a single accumulator for everything
+    bucket : string, optional
+        Calendar bucket (see `calendar_bucket()`) of the dates given to
+        `add()`, if "bucket" is one of the `keys`
+
+    """
+
+    def __init__(self, keys=None, bucket="month"):
+        keys = [] if keys is None else keys
+        for key in keys:
+            if key not in KEYS:
+                raise ValueError("Unknown verification key %r" % key)
+        self.keys = list(keys)
+        self.bucket = bucket
+        self.accumulators = OrderedDict()
+
+    def __getitem__(self, key):
+        return self.accumulators[key]
+
+    def __len__(self):
+        return len(self.accumulators)
+
+    def add(self, forecasts, observations, dates=None, **labels):
+        """Add the errors of a batch of forecasts.
+
+        Parameters
+        ----------
+        forecasts, observations : array-like
+            Forecasts and the values verifying them; pairs where either
+            is missing (NaN) are left out
+        dates : array-like, optional
+            The date each forecast is valid on, from which its calendar
+            bucket is worked out; required if "bucket" is a key
+        labels : scalars or array-likes
+            Label of each forecast for each of the keys; each is either
+            one label shared by the whole batch, or one per forecast
+
+        """
+        errors = np.asarray(forecasts, dtype='f8') - np.asarray(observations, dtype='f8')
+        errors = errors.ravel()
+        if ("bucket" in self.keys) and ("bucket" not in labels):
+            if dates is None:
+                raise ValueError("Dates are needed to verify by calendar bucket")
+            labels["bucket"] = calendar_bucket(dates, self.bucket)
+
+        columns = []
+        for key in self.keys:
+            if key not in labels:
+                raise ValueError("No %r given for the forecasts" % key)
+            column = np.asarray(labels[key])
+            if column.ndim == 0:
+                column = np.repeat(column, len(errors))
+            columns.append(column.ravel())
+
+        valid = ~np.isnan(errors)
+        if not self.keys:
+            self.accumulators.setdefault((), Accumulator()).update(errors)
+            return
+
+        ## Reduce each group of labels at once; only the (few) groups are
+        ## then merged one at a time
+        errors = errors[valid]
+        columns = [c[valid] for c in columns]
+        if not len(errors):
+            return
+        groups = pd.MultiIndex.from_arrays(columns)
+        codes, uniques = pd.factorize(groups)
+        counts = np.bincount(codes)
+        means = np.bincount(codes, weights=errors)/counts
+        m2s = np.bincount(codes, weights=(errors - means[codes])**2)
+        abs_sums = np.bincount(codes, weights=np.abs(errors))
+        for i, key in enumerate(uniques):
+            key = tuple(_plain(k) for k in (key if isinstance(key, tuple) else (key, )))
+            self.accumulators.setdefault(key, Accumulator()).merge(
+                Accumulator(counts[i], means[i], m2s[i], abs_sums[i]))
+
+    def merge(self, other):
+        """Fold in the accumulators of another `Verification` (e.g. one
+        built by a parallel worker) with the same keys.
+
+        """
+        if (other.keys != self.keys) or (other.bucket != self.bucket):
+            raise ValueError("Can't merge verifications with different keys")
+        for key, accumulator in other.accumulators.iteritems():
+            self.accumulators.setdefault(key, Accumulator()).merge(accumulator)
+        return self
+
+    def to_frame(self):
+        """Summarize every accumulator as a row of a DataFrame, with the
+        count, bias, MAE and RMSE of its errors.
+
+        """
+        rows = [ list(key) + [a.count, a.bias, a.mae, a.rmse]
+                 for key, a in sorted(self.accumulators.iteritems()) ]
+        df = pd.DataFrame(rows, columns=self.keys + ["count", "bias", "mae", "rmse"])
+        if self.keys:
+            df = df.set_index(self.keys)
+        return df
+
+def _plain(label):
+    ## numpy scalars are turned back into plain Python values, so that keys
+    ## compare and hash the same however they were labeled
+    return label.item() if isinstance(label, np.generic) else label
@@ -0,0 +1,307 @@
+"""Precipitation forecasts which minimize the expected contest penalty.
+
+Given a probability distribution of the observed precipitation over
+whole hundredths of an inch, the expected penalty of forecasting each
+amount is worked out for every amount at once. Since the penalty is the
+difference between the penalty accumulated up to the forecast and up to
+the observation (see `precip_error.accumulated_penalty()`), which only
+grows with the amount,
+
+    E[penalty(i)] = A(i) P(X <= i) - S(i) + (S(N) - S(i)) - A(i) P(X > i)
+
+where A is the accumulated penalty and S(i) the cumulative sum of
+A(j) P(X = j) over j <= i - a couple of cumulative sums per distribution,
+rather than a penalty evaluation for every pair of forecast and outcome.
+
+Distributions can be built from an empirical sample of amounts (e.g.
+past forecast errors added to today's forecast), or from the MOS QPF
+categories and probabilities of precipitation of any number of GFS/NAM
+runs - either the 12-hour ones (Q12/P12) of the two periods of a contest
+day, or the 6-hour ones (Q06/P06) of its four periods. Everything is
+vectorized over leading "batch" dimensions, so every city and day can be
+handled in one call.
+
+"""
+import unittest
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from precip_error import accumulated_penalty, penalty
+
+## Number of hundredths of an inch in the default grid (0 - 5.00")
+GRID_SIZE = 501
+
+## Range of amounts (in hundredths of an inch, inclusive) of each MOS
+## 12-hour QPF category; the open-ended top category is capped at 3.00"
+_COMPONENT_RANGES = [ (1, 9), (10, 24), (25, 49), (50, 99), (100, 199), (200, 300) ]
+## Which of those ranges each category is spread over; wet periods with
+## a category of 0 are taken to be in category 1
+Q12_COMPONENTS = { 0: 1, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6 }
+## The 6-hour categories share the bottom five ranges; the open-ended top
+## one (1.00" or more) is spread over 1.00 - 1.99"
+Q06_COMPONENTS = { 0: 1, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5 }
+
+class ExpectedPenaltyTest(unittest.TestCase):
+
+    def testCurve(self):
+        rng = np.random.RandomState(0)
+        probs = rng.rand(3, 120)**4
+        curve = expected_penalty(probs)
+        probs = probs / probs.sum(axis=-1, keepdims=True)
+        amounts = (np.arange(120) + 0.5)/100.
+        for i in [0, 7, 33, 119]:
+            expected = (penalty(amounts[i], amounts[None, :])*probs).sum(axis=-1)
+            self.assertTrue(np.allclose(curve[:, i], expected))
+
+    def testBestForecast(self):
+        samples = np.array([[0., 0., 0., .05, .30], [.5, .5, .5, .5, .5]])
+        amounts, _ = best_forecast(empirical_distribution(samples))
+        self.assertEqual(list(amounts), [0., .5])
+
+    def testQPF(self):
+        ## Two dry runs, and one certain to have 0.10-0.24" in each period
+        p12 = np.array([[0., 0.], [0., 0.], [100., 100.]])
+        q12 = np.array([[0., 0.], [0., 0.], [2., 2.]])
+        probs = qpf_distribution(p12, q12)
+        self.assertAlmostEqual(probs.sum(), 1.)
+        self.assertAlmostEqual(probs[0], 2./3.)
+        self.assertAlmostEqual(probs[20:49].sum(), 1./3.)
+
+    def testQPF06(self):
+        ## Four 6-hour periods, of which only the second is certain to have
+        ## 0.10-0.24"
+        p06 = np.array([[0., 100., 0., 0.]])
+        q06 = np.array([[0., 2., 0., 0.]])
+        probs = qpf_distribution(p06, q06, components=Q06_COMPONENTS)
+        self.assertAlmostEqual(probs.sum(), 1.)
+        self.assertAlmostEqual(probs[10:25].sum(), 1.)
+        self.assertTrue(np.allclose(probs[10:25], 1./15.))
+
+    def testQPFFromFrames(self):
+        times = pd.date_range("2009-01-01 06:00", periods=8, freq="6H")
+        df = pd.DataFrame({ "P06": [0, 10, 20, 30, 40, 50, 60, 70],
+                            "Q06": [0, 0, 1, 1, 2, 2, 3, np.nan] }, index=times)
+        p06, q06 = qpf_from_frames([df, df], datetime.datetime(2009, 1, 1, 6))
+        self.assertEqual(p06.shape, (2, 4))
+        self.assertEqual(list(p06[0]), [10., 20., 30., 40.])
+        self.assertEqual(list(q06[1]), [0., 1., 1., 2.])
+
+def _normalize(probs):
+    probs = np.asarray(probs, dtype='f8')
+    return probs / probs.sum(axis=-1, keepdims=True)
+
+def expected_penalty(probs):
+    """Expected penalty of forecasting each amount on the grid.
+
+    Parameters
+    ----------
+    probs : array-like
+        Probability (or any non-negative weight) of observing each whole
+        number of hundredths of an inch, along the last dimension
+
+    Returns
+    -------
+    numpy.ndarray
+        Expected penalty of forecasting each amount, with the same shape
+        as `probs`
+
+    """
+    probs = _normalize(probs)
+    accumulated = accumulated_penalty(np.arange(probs.shape[-1]))
+
+    below = np.cumsum(probs, axis=-1)
+    moments = np.cumsum(probs*accumulated, axis=-1)
+    total = moments[..., -1:]
+    return accumulated*below - moments + (total - moments) - accumulated*(1. - below)
+
+def best_forecast(probs):
+    """The forecast with the smallest expected penalty.
+
+    Parameters
+    ----------
+    probs : array-like
+        Probability of observing each whole number of hundredths of an
+        inch, along the last dimension
+
+    Returns
+    -------
+    amount : real or numpy.ndarray
+        Best forecast (in inches) for each distribution; the smallest,
+        where several are equally good
+    curve : numpy.ndarray
+        Expected penalty of forecasting each amount (see
+        `expected_penalty()`)
+
+    """
+    curve = expected_penalty(probs)
+    return (np.argmin(curve, axis=-1)/100.)[()], curve
+
+def empirical_distribution(samples, size=GRID_SIZE):
+    """Distribution of a sample of precipitation amounts on the grid.
+
+    Parameters
+    ----------
+    samples : array-like
+        Amounts (in inches) along the last dimension; negative amounts are
+        counted as none, missing ones (NaN) are ignored, and those past the
+        end of the grid are counted in its last hundredth
+
+    Returns
+    -------
+    numpy.ndarray
+        Probability of each hundredth, with the samples' last dimension
+        replaced by the grid
+
+    """
+    samples = np.asarray(samples, dtype='f8')
+    batch = samples.shape[:-1]
+    samples = samples.reshape(-1, samples.shape[-1])
+
+    valid = ~np.isnan(samples)
+    hundredths = np.clip(np.floor(np.where(valid, samples, 0.)*100.), 0, size - 1).astype('i8')
+    ## Count every row at once, by offsetting each into its own stretch
+    cells = (hundredths + size*np.arange(len(samples))[:, None])[valid]
+    counts = np.bincount(cells, minlength=size*len(samples)).reshape(len(samples), size)
+    return _normalize(counts).reshape(batch + (size, ))
+
+def _component_table(size):
+    """Distributions of each component of a period: none at all, or an
+    even spread over the range of each QPF category.
+
+    """
+    table = np.zeros((len(_COMPONENT_RANGES) + 1, size))
+    table[0, 0] = 1.
+    for i, (low, high) in enumerate(_COMPONENT_RANGES):
+        high = min(high, size - 1)
+        table[i+1, low:high+1] = 1./(high - low + 1)
+    return table
+
+_combination_tables = {}
+
+def _combination_table(size, periods):
+    """Distributions of the total over several periods of every
+    combination of components of each period, in C (row-major) order.
+
+    """
+    key = (size, periods)
+    if key not in _combination_tables:
+        components = _component_table(size)
+        table = components
+        for _ in xrange(1, periods):
+            totals = np.array([np.convolve(t, c) for t in table for c in components])
+            ## Anything past the end of the grid is counted in its last hundredth
+            totals[:, size-1] += totals[:, size:].sum(axis=-1)
+            table = totals[:, :size]
+        _combination_tables[key] = table
+    return _combination_tables[key]
+
+def qpf_distribution(p12, q12, size=GRID_SIZE, components=Q12_COMPONENTS):
+    """Distribution of the precipitation over consecutive periods (e.g. the
+    two 12-hour or four 6-hour periods of a contest day) from the MOS
+    guidance of several runs.
+
+    Each period of each run is modeled as dry with probability
+    1 - P12/100, and otherwise as evenly spread over the range of its Q12
+    category (or likewise for P06 and Q06). The periods of a run are taken to be independent, so the
+    distribution of their total is a mixture of the convolutions of
+    every combination of these pieces; those are worked out once, and
+    only the weights of each combination vary with the guidance. The
+    runs are then weighted equally.
+
+    Parameters
+    ----------
+    p12, q12 : array-like
+        P12 (in percent) and Q12 category of each period, with dimensions
+        (..., run, period); runs with a missing (NaN) P12 or Q12 in any
+        period are left out. For 6-hour periods, pass P06 and Q06 instead.
+    components : dict, optional
+        Which component (see `_component_table()`) each category is
+        spread over; `Q06_COMPONENTS` for the 6-hour categories
+
+    Returns
+    -------
+    numpy.ndarray
+        Probability of each hundredth of an inch, with dimensions
+        (..., hundredth)
+
+    """
+    p12, q12 = np.asarray(p12, dtype='f8'), np.asarray(q12, dtype='f8')
+    n_periods = p12.shape[-1]
+
+    ## Weight of each component (see `_component_table()`) of each period
+    categories = components
+    components = np.full(q12.shape, -1, dtype='i8')
+    for category, component in categories.items():
+        components[q12 == category] = component
+    wet = np.where(np.isnan(p12), 0., p12/100.)
+    weights = np.zeros(p12.shape + (len(_COMPONENT_RANGES) + 1, ))
+    weights[..., 0] = 1. - wet
+    ## (runs with unknown categories are left out below)
+    np.put_along_axis(weights, np.maximum(components, 1)[..., None], wet[..., None], axis=-1)
+
+    ## ... and of each combination of them over the periods of each run
+    combinations = weights[..., 0, :]
+    for i in xrange(1, n_periods):
+        combinations = (combinations[..., :, None]*weights[..., i, None, :]).reshape(
+            combinations.shape[:-1] + (-1, ))
+
+    present = ~(np.isnan(p12) | np.isnan(q12) | (components < 0)).any(axis=-1)
+    runs = present / np.maximum(present.sum(axis=-1, keepdims=True), 1.)
+    combinations = (combinations*runs[..., None]).sum(axis=-2)
+
+    ## The distribution is then a weighted sum of the precomputed ones
+    return combinations.dot(_combination_table(size, n_periods))
+
+def qpf_from_summaries(precips):
+    """Collect the P12 and Q12 of a day from several MOS runs.
+
+    Parameters
+    ----------
+    precips : list of dicts
+        For each run, the `{"Q12": [...], "P12": [...]}` forecast of the
+        day from the `precip` attribute of its `mos.process_MOS()` or
+        `mos.process_MOS_summary()` output
+
+    Returns
+    -------
+    p12, q12 : numpy.ndarray
+        With dimensions (run, period), ready for `qpf_distribution()`
+
+    """
+    p12 = np.array([p["P12"] for p in precips], dtype='f8')
+    q12 = np.array([p["Q12"] for p in precips], dtype='f8')
+    return p12, q12
+
+def qpf_from_frames(frames, start, hours=6):
+    """Collect the P06 and Q06 (or P12 and Q12) of a contest day from
+    several MOS runs.
+
+    The 12-hour guidance is also carried by the `precip` attribute (see
+    `qpf_from_summaries()`), but the 6-hour guidance only by the columns of
+    the full `mos.process_MOS()` output, whose values are valid for the
+    period ending at each timestamp.
+
+    Parameters
+    ----------
+    frames : list of DataFrames
+        The `mos.process_MOS()` output of each run
+    start : datetime.datetime
+        Start of the contest day (e.g. 06Z)
+    hours : int, optional
+        Length of each period; 6 or 12
+
+    Returns
+    -------
+    p, q : numpy.ndarray
+        With dimensions (run, period), ready for `qpf_distribution()`;
+        runs which don't cover a period have NaN for it
+
+    """
+    ends = [start + datetime.timedelta(hours=hours*(i + 1)) for i in xrange(24 // hours)]
+    columns = ["P%02d" % hours, "Q%02d" % hours]
+    p, q = [np.array([ (df[c].reindex(ends).values if c in df else [np.nan, ]*len(ends))
+                        for df in frames ], dtype='f8') for c in columns]
+    return p, q
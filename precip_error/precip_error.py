@@ -1,7 +1,13 @@
-import numpy as np
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
-save_file = "all_penalties.npy"
+import numpy as np
+
+table_file = "penalty_table.npy"
+TABLE_VERSION = 1
 
 class PrecipPenaltyTest(unittest.TestCase):
 
@@ -33,111 +39,254 @@ class PrecipPenaltyTest(unittest.TestCase):
         fcst, obs = 1.07, .80
         self.assertAlmostEqual(penalty(fcst, obs), 2.7)
 
+class PenaltyTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, table_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testScore(self):
+        table = load_penalty_table(self.filename, max_amount=2.)
+        amounts = np.arange(0, 2.5, 0.01)
+        fcsts, obss = np.meshgrid(amounts, amounts)
+        self.assertTrue((table.score(fcsts, obss) == penalty(fcsts, obss)).all())
+        self.assertAlmostEqual(table.score(.17, .65), 8.9)
+        ## (offset by half a hundredth, so that flooring the amounts is exact)
+        amounts = table.amounts + 0.005
+        self.assertTrue((table.fcst_slice(.17) == penalty(.17, amounts)).all())
+        self.assertTrue((table.obs_slice(9.) == penalty(amounts, 9.)).all())
+
+    def testMissing(self):
+        table = load_penalty_table(self.filename, max_amount=2.)
+        self.assertTrue(np.isnan(table.score(np.nan, .1)))
+        scores = table.score([.1, np.nan, 3.], [.2, .3, np.nan])
+        self.assertAlmostEqual(scores[0], penalty(.1, .2))
+        self.assertTrue(np.isnan(scores[1:]).all())
+        self.assertTrue(np.isnan(table.fcst_slice(np.nan)).all())
+
+    def testRebuild(self):
+        load_penalty_table(self.filename, max_amount=1.)
+        table = load_penalty_table(self.filename, max_amount=2.)
+        self.assertEqual(table.shape, (201, 201))
+        with open(_table_meta_filename(self.filename)) as f:
+            meta = json.load(f)
+        meta['factors'][0] = 0.5
+        with open(_table_meta_filename(self.filename), "w") as f:
+            json.dump(meta, f)
+        table = load_penalty_table(self.filename, max_amount=2.)
+        self.assertAlmostEqual(table.score(.17, .30), 3.4)
+
+## Verification ranges (in hundredths of an inch) of the penalty, and the
+## penalty per hundredth of error within each of them
+PENALTY_BOUNDS = np.array([0., 10., 25., 50.])
+PENALTY_FACTORS = np.array([0.4, 0.3, 0.2, 0.1])
+## Penalty accumulated from zero up to the bottom of each range
+PENALTY_OFFSETS = np.concatenate([[0., ], np.cumsum(np.diff(PENALTY_BOUNDS)*PENALTY_FACTORS[:-1])])
+
+def accumulated_penalty(amount):
+    """The penalty accumulated between zero and each amount of precipitation.
+
+    This is the integral of the per-hundredth penalty of each verification
+    range, which is piecewise linear in the amount; a range includes its
+    upper bound, but not its lower one.
+
+    Parameters
+    ----------
+    amount : array-like
+        Precipitation, in hundredths of an inch
+
+    Returns
+    -------
+    numpy.ndarray
+
+    """
+    amount = np.asarray(amount, dtype='f8')
+    ranges = np.maximum(np.searchsorted(PENALTY_BOUNDS, amount, side='left') - 1, 0)
+    return PENALTY_OFFSETS[ranges] + PENALTY_FACTORS[ranges]*(amount - PENALTY_BOUNDS[ranges])
+
 def penalty(fcst, obs):
     """Calculate penalty given a pair of forecast and observed precipitation
     measurements.
 
     Taken from http://wxchallenge.com/info/rules.php. Both the forecast and
-    observation should be provided in hundredths of an inch.
+    observation should be provided in inches, and are floored to the
+    nearest hundredth. The penalty is the difference between the penalty
+    accumulated up to each of them, so whole arrays of pairs are scored
+    at once.
 
     Parameters
     ----------
-    fcst : real
-    obs : real
+    fcst : real or array-like
+    obs : real or array-like
 
     Returns
     -------
-    penalty : real
-        Calculated penalty given the forecast and observation.
+    penalty : real or numpy.ndarray
+        Calculated penalty given each forecast and observation, broadcast
+        against one another.
 
     Raises
     ------
     ValueError
-        If either fcst or obs are negative.
+        If any fcst or obs are negative.
     """
 
-    if (fcst < 0.) or (obs < 0.):
+    fcst, obs = np.asarray(fcst, dtype='f8'), np.asarray(obs, dtype='f8')
+    if (fcst < 0.).any() or (obs < 0.).any():
         raise ValueError("Either fcst or obs was negative")
 
     ## Adjust the fcst and obs by flooring to the nearest hundredth
     fcst = np.floor(fcst*100.)
     obs = np.floor(obs*100.)
 
-    ## Compile the accumulated penalties for each verification range
-    total_penalty = 0.
-
-    bounds = [0., 10., 25., 50., 1e6]
-    bins = zip(bounds[:-1], bounds[1:])
-    factors = [0.4, 0.3, 0.2, 0.1]
-
-    fcst_bin, obs_bin = 0, 0
-    for i, (a, b) in enumerate(bins):
-        if a < fcst <= b: fcst_bin = i#; print "fcst ->", i
-        if a < obs <= b: obs_bin = i#; print "obs ->", i
-
-    if fcst_bin == obs_bin:
-        total_penalty += factors[fcst_bin]*np.abs(fcst - obs)
-
-    elif fcst_bin < obs_bin:
-        #print "fcst_bin < obs_bin"
-        for bin in range(fcst_bin, obs_bin+1):
-            left, right = bins[bin]
-
-            #print left, right, factors[bin],
-
-            if left < obs <= right:
-                total_penalty += factors[bin]*(obs - left)
-                #print "(%2d - %2d)" % (obs, left)
-            elif left < fcst <= right:
-                total_penalty += factors[bin]*(right - fcst)
-                #print "(%2d - %2d)" % (right, fcst)
-            else: 
-                total_penalty += factors[bin]*(right - left)
-                #print "(%2d - %2d)" % (right, left)
-    else:
-        #print "fcst_bin > obs_bin"
-        for bin in range(obs_bin, fcst_bin+1):
-            left, right = bins[bin]
-
-            #print left, right, factors[bin],
-
-            if left < obs <= right:
-                total_penalty += factors[bin]*(right - obs)
-                #print "(%2d - %2d)" % (right, obs)
-            elif left < fcst <= right:
-                total_penalty += factors[bin]*(fcst - left)
-                #print "(%2d - %2d)" % (fcst, left)
-            else:
-                total_penalty += factors[bin]*(right - left)
-                #print "(%2d - %2d)" % (right, left)
-    
-    return total_penalty
+    total_penalty = np.abs(accumulated_penalty(fcst) - accumulated_penalty(obs))
+    return total_penalty[()]
 
-if __name__ == "__main__":
+class PenaltyTable(object):
+    """Penalties of every pair of forecast and observation, up to some
+    maximum amount, indexed by whole hundredths of an inch.
 
-    import os
+    Parameters
+    ----------
+    table : numpy.ndarray
+        Penalty of each (forecast, observation) pair of amounts, in
+        hundredths of an inch
+
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    @property
+    def shape(self):
+        return self.table.shape
+
+    @property
+    def amounts(self):
+        """The amount (in inches) along each side of the table."""
+        return np.arange(self.table.shape[0])/100.
+
+    def _indices(self, amount):
+        """Hundredths of an inch of each amount, and which are missing
+        (NaN); missing amounts are given an index of 0.
+
+        """
+        amount = np.asarray(amount, dtype='f8')
+        missing = np.isnan(amount)
+        amount = np.where(missing, 0., amount)
+        if (amount < 0.).any():
+            raise ValueError("Either fcst or obs was negative")
+        return np.floor(amount*100.).astype('i8'), missing
+
+    def score(self, fcst, obs):
+        """Look up the penalty of each pair of forecast and observation,
+        exactly as `penalty()` would calculate it.
+
+        Pairs beyond the end of the table are calculated instead, and pairs
+        with a missing (NaN) amount score NaN.
+
+        """
+        (fcst, fcst_missing), (obs, obs_missing) = self._indices(fcst), self._indices(obs)
+        fcst, obs, missing = np.broadcast_arrays(fcst, obs, fcst_missing | obs_missing)
+        size = self.table.shape[0]
+        inside = (fcst < size) & (obs < size)
+        scores = np.array(self.table[np.where(inside, fcst, 0), np.where(inside, obs, 0)],
+                          dtype='f8')
+        if not inside.all():
+            scores[~inside] = np.abs(accumulated_penalty(fcst[~inside]) -
+                                     accumulated_penalty(obs[~inside]))
+        scores[missing] = np.nan
+        return scores[()]
+
+    def _slice(self, amount, axis):
+        i, missing = self._indices(amount)
+        i = i[()]
+        if missing:
+            return np.full(self.table.shape[0], np.nan)
+        if i < self.table.shape[0]:
+            return np.array(self.table[i, :] if axis == 0 else self.table[:, i])
+        return np.abs(accumulated_penalty(i) -
+                      accumulated_penalty(np.arange(self.table.shape[0])))
+
+    def fcst_slice(self, fcst):
+        """Penalties of one forecast against every observation in the table."""
+        return self._slice(fcst, 0)
+
+    def obs_slice(self, obs):
+        """Penalties of every forecast in the table against one observation."""
+        return self._slice(obs, 1)
+
+def _table_meta_filename(filename):
+    return os.path.splitext(filename)[0] + ".json"
+
+def _table_meta(max_amount):
+    return { 'version': TABLE_VERSION,
+             'size': int(round(max_amount*100.)) + 1,
+             'bounds': PENALTY_BOUNDS.tolist(),
+             'factors': PENALTY_FACTORS.tolist() }
+
+def load_penalty_table(filename=table_file, max_amount=5., mmap=True):
+    """Load the table of penalties, building and saving it first if it
+    doesn't exist or was built for different rules.
+
+    The table is saved as a `.npy` file alongside a small JSON sidecar
+    recording the version, size, and verification ranges and factors it
+    was built with; if any of those differ from the current ones, it is
+    rebuilt.
+
+    Parameters
+    ----------
+    filename : string, optional
+        Where the table is saved
+    max_amount : real, optional
+        Largest forecast or observation (in inches) in the table
+    mmap : boolean, optional
+        Memory-map the saved table read-only, rather than reading it in
+
+    Returns
+    -------
+    PenaltyTable
+
+    """
+    meta = _table_meta(max_amount)
+    meta_filename = _table_meta_filename(filename)
+
+    saved = None
+    if os.path.exists(filename) and os.path.exists(meta_filename):
+        with open(meta_filename) as f:
+            saved = json.load(f)
+    if saved != meta:
+        accumulated = accumulated_penalty(np.arange(meta['size']))
+        table = np.abs(accumulated[:, None] - accumulated[None, :])
+        ## (np.save appends ".npy" to names which don't end with it)
+        tmp = filename + ".tmp.npy"
+        np.save(tmp, table)
+        os.rename(tmp, filename)
+        with open(meta_filename + ".tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.rename(meta_filename + ".tmp", meta_filename)
+
+    return PenaltyTable(np.load(filename, mmap_mode="r" if mmap else None))
+
+if __name__ == "__main__":
 
     from pylab import *
     ion()
 
     #unittest.main()
 
-    vec_penalty = np.vectorize(penalty)
-
     p_max = 1.0
 
-    fcsts = np.arange(0, p_max+0.01, 0.01)
-    obss = np.arange(0, p_max+0.01, 0.01)
-
-    if not os.path.exists(save_file):
-        print "Computing and saving penalties"
-        all_fcsts, all_obs = np.meshgrid(fcsts, obss)
-        all_penalties = vec_penalty(all_fcsts, all_obs)
+    table = load_penalty_table()
+    n = int(round(p_max*100.)) + 1
+    fcsts = table.amounts[:n]
+    obss = table.amounts[:n]
 
-        np.save(save_file, all_penalties)
-    else:
-        print "Loading saved penalties"
-        all_penalties = np.load(save_file)
+    ## (the table is indexed by forecast, then observation)
+    all_penalties = table.table[:n, :n].T
 
     fig = figure(1, figsize=(16, 12)); clf()
 
@@ -167,12 +316,11 @@ if __name__ == "__main__":
     glyph,  = ax_main.plot([], [], 'xk', markersize=15, markeredgewidth=3)
 
     def update_plots(fcst, obs):
-        stat_pen = penalty(fcst, obs)
+        stat_pen = table.score(fcst, obs)
 
         ## Update plot on right
         ax_right.cla()
-        fcst_exp = np.ones_like(fcsts)*fcst
-        fcst_pen = vec_penalty(fcst_exp, obss)
+        fcst_pen = table.fcst_slice(fcst)[:n]
         ax_right.plot(fcst_pen, obss, 'k')
         ax_right.hlines([obs], 0, 18, linestyle='dashed')
         ax_right.set_ylim(ax_main.get_ylim())
@@ -180,8 +328,7 @@ if __name__ == "__main__":
 
         ## Update plot on top
         ax_top.cla()
-        obs_exp = np.ones_like(obss)*obs
-        obs_pen = vec_penalty(fcsts, obs_exp)
+        obs_pen = table.obs_slice(obs)[:n]
         ax_top.plot(fcsts, obs_pen, 'k')
         ax_top.vlines([fcst], 0, 18, linestyle='dashed')
         ax_top.set_xlim(ax_main.get_xlim())
@@ -207,7 +354,7 @@ if __name__ == "__main__":
         bits = inp.split(",")
         fcst, obs = map(lambda s: float(s.strip()), bits)
 
-        exp_penalty = penalty(fcst, obs)
+        exp_penalty = table.score(fcst, obs)
         print "   Expected penalty = %1.1f" % exp_penalty
 
         update_plots(fcst, obs)
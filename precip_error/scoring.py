@@ -0,0 +1,171 @@
+"""Vectorized WxChallenge scoring of many forecasters at once.
+
+Forecasters are scored every day at every city on four variables: the
+high and low temperatures (deg F), the maximum sustained wind speed
+(knots) and the precipitation (inches). Taken from
+http://wxchallenge.com/info/rules.php, the error points of each are
+
+- one point per degree of error in the high and the low,
+- half a point per knot of error in the wind speed, and
+- the banded precipitation penalty of `precip_error.penalty()`,
+
+and the daily total is their sum. Forecasts are given as one array with
+dimensions
+
+    forecaster x day x station x variable
+
+(in the order of `VARIABLES`) and the verification as one with
+dimensions day x station x variable, so that every error, total and
+standing of a whole season or tournament is computed in a handful of
+array operations.
+
+"""
+import unittest
+
+import numpy as np
+
+from precip_error import penalty
+
+VARIABLES = ['high', 'low', 'wind', 'precip']
+
+## Error points per unit of error of the linearly-scored variables
+POINTS_PER_UNIT = { 'high': 1.0, 'low': 1.0, 'wind': 0.5 }
+
+class ScoringTest(unittest.TestCase):
+
+    def setUp(self):
+        ## 3 forecasters x 2 days x 2 stations
+        self.verification = np.array([ [[70, 50, 12, .30], [80, 60, 20, 0.]],
+                                       [[72, 52, 10, .02], [82, 62, np.nan, 0.]] ])
+        self.forecasts = np.array([ self.verification,
+                                    self.verification + [1, -2, 4, 0],
+                                    self.verification ])
+        self.forecasts[1, 0, 0, 3] = .17
+        self.forecasts[2, 1, 0, 0] = np.nan
+
+    def testPoints(self):
+        scores = score(self.forecasts, self.verification)
+        self.assertEqual(scores.points.shape, (3, 2, 2, 4))
+        self.assertTrue((scores.points[0] == 0).all())
+        self.assertEqual(list(scores.points[1, 0, 0]), [1., 2., 2., 3.4000000000000004])
+        ## No verification, no points
+        self.assertEqual(scores.points[1, 1, 1, 2], 0.)
+        self.assertAlmostEqual(scores.totals[1, 0, 0], 8.4)
+
+    def testStandings(self):
+        scores = score(self.forecasts, self.verification)
+        self.assertAlmostEqual(scores.tournament[1, -1], 8.4 + 5. + 5. + 3.)
+        ## A missing forecast ranks last from then on
+        self.assertEqual(list(scores.ranks(scores.tournament)[:, 0]), [1, 3, 1])
+        self.assertEqual(list(scores.ranks(scores.tournament)[:, 1]), [1, 2, 3])
+
+def error_points(forecasts, verification, variables=VARIABLES):
+    """Error points of each forecast of each variable.
+
+    Parameters
+    ----------
+    forecasts : array-like
+        Forecasts, with the variables along the last dimension
+    verification : array-like
+        Verifying values, with the variables along the last dimension,
+        broadcastable against `forecasts`
+    variables : list of strings, optional
+        The variable along each position of the last dimension
+
+    Returns
+    -------
+    numpy.ndarray
+        Error points of each forecast. Forecasts with no verification
+        (NaN) score no points; missing forecasts (NaN) score NaN.
+
+    """
+    forecasts = np.asarray(forecasts, dtype='f8')
+    verification = np.asarray(verification, dtype='f8')
+    forecasts, verification = np.broadcast_arrays(forecasts, verification)
+
+    points = np.empty(forecasts.shape, dtype='f8')
+    with np.errstate(invalid='ignore'):
+        for i, variable in enumerate(variables):
+            fcst, obs = forecasts[..., i], verification[..., i]
+            if variable == 'precip':
+                points[..., i] = penalty(fcst, np.where(np.isnan(obs), 0., obs))
+            else:
+                points[..., i] = POINTS_PER_UNIT[variable]*np.abs(fcst - obs)
+    points[np.isnan(verification)] = 0.
+    return points
+
+def ranks(totals, axis=0):
+    """Standing of each forecaster (1 for the fewest points), with ties
+    sharing the best of their places and missing (NaN) totals last.
+
+    """
+    totals = np.asarray(totals, dtype='f8')
+    order = np.argsort(totals, axis=axis, kind='mergesort')
+    ordered = np.take_along_axis(totals, order, axis=axis)
+
+    ## The place of each sorted total is that of the first one it ties with
+    shape = [1, ]*totals.ndim
+    shape[axis] = totals.shape[axis]
+    positions = np.arange(totals.shape[axis]).reshape(shape)
+    changed = np.ones(ordered.shape, dtype=bool)
+    tail = [slice(None), ]*totals.ndim
+    tail[axis] = slice(1, None)
+    head = list(tail)
+    head[axis] = slice(None, -1)
+    after, before = ordered[tuple(tail)], ordered[tuple(head)]
+    changed[tuple(tail)] = (after != before) & ~(np.isnan(after) & np.isnan(before))
+    places = np.maximum.accumulate(np.where(changed, positions, 0), axis=axis) + 1
+
+    result = np.empty(totals.shape, dtype='i8')
+    np.put_along_axis(result, order, places, axis=axis)
+    return result
+
+class Scores(object):
+    """Error points and standings of a set of forecasters.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        Error points of each forecaster, day, station and variable
+    totals : numpy.ndarray
+        Total error points of each forecaster, day and station
+    city : numpy.ndarray
+        Cumulative points of each forecaster at each station, through
+        each day (the season-long standings of each city)
+    tournament : numpy.ndarray
+        Cumulative points of each forecaster over every station, through
+        each day
+
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.totals = points.sum(axis=-1)
+        self.city = np.cumsum(self.totals, axis=1)
+        self.tournament = self.city.sum(axis=2)
+
+    def ranks(self, totals):
+        """Standings of the forecasters (along the first dimension) by some
+        set of their totals, e.g. `scores.ranks(scores.tournament)`.
+
+        """
+        return ranks(totals, axis=0)
+
+def score(forecasts, verification, variables=VARIABLES):
+    """Score every forecaster on every day at every station.
+
+    Parameters
+    ----------
+    forecasts : array-like
+        Forecasts, with dimensions forecaster x day x station x variable
+    verification : array-like
+        Verifying values, with dimensions day x station x variable
+    variables : list of strings, optional
+        The variable along each position of the last dimension
+
+    Returns
+    -------
+    Scores
+
+    """
+    return Scores(error_points(forecasts, np.asarray(verification)[None], variables))